@@ -0,0 +1,52 @@
+from ihc_client import send_batches_concurrently
+from local_attribution import attribute_batches_locally
+
+# Every backend has:
+#   name          'api' or 'local'
+#   limits        (max journeys, max sessions) per batch, or None if batches are unbounded
+#   cacheable     whether its results may be stored in the IHC cache
+#   send(batches, on_result)
+#                 attributes every batch, calls on_result(batch_idx, batch, response_data)
+#                 for each one that succeeded and returns (batch_idx, batch, error) for the
+#                 batches that failed, like ihc_client.send_batches_concurrently
+
+class ApiBackend:
+    """
+    Sends batches to the IHC API concurrently over a pooled session, rate limited
+    and retried on 429/5xx.
+    """
+    name = 'api'
+    cacheable = True
+
+    def __init__(self, api_url, conv_type_id, api_key, max_journeys, max_sessions,
+                 max_workers=4, requests_per_second=5, max_retries=5):
+        if not api_key:
+            raise ValueError("API key not found. Set IHC_API_KEY in .env file.")
+        self.request_url = f"{api_url}?conv_type_id={conv_type_id}"
+        self.headers = {
+            'Content-Type': 'application/json',
+            'x-api-key': api_key
+        }
+        self.limits = (max_journeys, max_sessions)
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+
+    def send(self, batches, on_result):
+        return send_batches_concurrently(batches, self.request_url, self.headers, on_result,
+                                         max_workers=self.max_workers,
+                                         requests_per_second=self.requests_per_second,
+                                         max_retries=self.max_retries)
+
+class LocalBackend:
+    """
+    Computes attributions offline with local_attribution.compute_local_attribution,
+    in large batches without request limits. Its results are not IHC results, so
+    they are kept out of the IHC cache.
+    """
+    name = 'local'
+    cacheable = False
+    limits = None
+
+    def send(self, batches, on_result):
+        return attribute_batches_locally(batches, on_result)
@@ -0,0 +1,60 @@
+import pandas as pd
+from batch_packer import pack_journey_batches, iter_conversion_journeys
+from journey_frame import iter_frame_entries, iter_frame_batches, frame_to_payload
+from local_attribution import iter_local_batches
+
+def valid_entries(entries):
+    """
+    Yields the entries, raising a ValueError for anything that is not a dictionary.
+    """
+    for entry in entries:
+        # Ensure the body is a list of dictionaries
+        if not isinstance(entry, dict):
+            raise ValueError("Error: Data must be a list of dictionaries.")
+        yield entry
+
+def kept_entries(entries, skip_journey=None):
+    """
+    Yields the entries of every journey skip_journey(journey) doesn't return True for.
+    """
+    if skip_journey is None:
+        yield from entries
+        return
+
+    for journey in iter_conversion_journeys(entries):
+        if not skip_journey(journey):
+            yield from journey
+
+def iter_attribution_batches(journeys, limits=None, oversized='skip', on_oversized=None, skip_journey=None):
+    """
+    Yields the batches (flat lists of entries of whole journeys) to attribute, from
+    journey entries or a journey frame (journey_frame.py).
+    With limits=(max_journeys, max_sessions) entries are bin-packed into batches
+    within both limits by batch_packer.pack_journey_batches, which handles
+    journeys over the session limit according to `oversized` and passes them to
+    on_oversized. A frame is sliced with journey_frame.iter_frame_batches and only
+    converted to entries one batch at a time, so skipped journeys leave their
+    batch smaller instead of being repacked.
+    Without limits whole journeys are grouped with local_attribution.iter_local_batches.
+    skip_journey(journey), if given, is called for every journey and returns True
+    for journeys that are dealt with already, e.g. served from the cache; they are
+    left out of the batches.
+    """
+    if limits is None:
+        entries = iter_frame_entries(journeys) if isinstance(journeys, pd.DataFrame) else valid_entries(journeys)
+        yield from iter_local_batches(iter_conversion_journeys(kept_entries(entries, skip_journey)))
+        return
+
+    max_journeys, max_sessions = limits
+    if not isinstance(journeys, pd.DataFrame):
+        yield from pack_journey_batches(kept_entries(valid_entries(journeys), skip_journey), max_journeys,
+                                        max_sessions, oversized, on_oversized)
+        return
+
+    for frame_batch in iter_frame_batches(journeys, max_journeys, max_sessions):
+        batch = list(kept_entries(frame_to_payload(frame_batch), skip_journey))
+        if len(batch) > max_sessions:
+            # An oversized journey is sliced as a batch of its own, apply the policy to it
+            yield from pack_journey_batches(batch, max_journeys, max_sessions, oversized, on_oversized)
+        elif batch:
+            yield batch
@@ -1,25 +1,54 @@
+import json
 import sqlite3
+import time
+from database import get_connection
+from change_tracking import upgrade_change_tracking
+from parallel_journeys import user_range_filter
+from instrumentation import get_logger, count, observe
+
+logger = get_logger(__name__)
+
+ATTRIBUTION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        conv_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        ihc REAL NOT NULL CHECK (ihc >= 0 AND ihc <= 1),
+        PRIMARY KEY(conv_id, session_id)
+    )
+"""
+
 
 def create_attribution_customer_journey_table(db_path):
     """
-    Creates the attribution_customer_journey table if it doesn't exist.
+    Creates the attribution_customer_journey table if it doesn't exist, keyed on
+    (conv_id, session_id) as in challenge_db_create.sql.
+    A table created by an earlier version without the primary key is rebuilt with it.
     """
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     cursor = conn.cursor()
 
     print("Checking if 'attribution_customer_journey' table exists...")
 
-    # Create table if not exists without PRIMARY KEY
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS attribution_customer_journey (
-        conv_id TEXT NOT NULL,
-        session_id TEXT NOT NULL,
-        ihc REAL NOT NULL CHECK (ihc >= 0 AND ihc <= 1)
-    )
-    """)
+    cursor.execute(ATTRIBUTION_TABLE_SQL.format(table_name="attribution_customer_journey"))
+
+    cursor.execute("PRAGMA table_info(attribution_customer_journey)")
+    primary_key = [row[1] for row in sorted(cursor.fetchall(), key=lambda row: row[5]) if row[5] > 0]
+
+    if primary_key != ["conv_id", "session_id"]:
+        print("Restoring the (conv_id, session_id) primary key...")
+        cursor.execute("DROP TABLE IF EXISTS attribution_customer_journey_keyed")
+        cursor.execute(ATTRIBUTION_TABLE_SQL.format(table_name="attribution_customer_journey_keyed"))
+        # Duplicate (conv_id, session_id) rows keep the value inserted last
+        cursor.execute("""
+            INSERT OR REPLACE INTO attribution_customer_journey_keyed (conv_id, session_id, ihc)
+            SELECT conv_id, session_id, ihc FROM attribution_customer_journey ORDER BY rowid
+        """)
+        cursor.execute("DROP TABLE attribution_customer_journey")
+        cursor.execute("ALTER TABLE attribution_customer_journey_keyed RENAME TO attribution_customer_journey")
 
+    # Triggers of older versions fail the upserts of insert_ihc_results
+    upgrade_change_tracking(cursor)
     conn.commit()
-    conn.close()
     print("Table 'attribution_customer_journey' is ready.")
 
 
@@ -28,50 +57,116 @@ def clear_attribution_customer_journey_table(db_path):
     Clears the contents of the attribution_customer_journey table.
     """
     print('Clearing the table...')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     cursor = conn.cursor()
 
     # Delete all rows from the table
     cursor.execute("DELETE FROM attribution_customer_journey")
 
     conn.commit()
-    conn.close()
     print("Table cleared.")
 
 
-def insert_ihc_results(response_data, db_path):
+def delete_unlisted_attributions(db_path, conv_ids, user_range=(None, None)):
+    """
+    Deletes the attribution rows of the conversions of the users in user_range (see
+    parallel_journeys.partition_users) that are not in conv_ids, and of conversions
+    that no longer exist, e.g. after a shard's journeys were rebuilt without them.
+    Returns the number of rows deleted.
+    """
+    conn = get_connection(db_path)
+    condition, params = user_range_filter(user_range)
+    cursor = conn.execute(f"""
+        DELETE FROM attribution_customer_journey
+        WHERE conv_id NOT IN (SELECT value FROM json_each(?))
+          AND (conv_id IN (SELECT conv_id FROM conversions WHERE {condition})
+               OR conv_id NOT IN (SELECT conv_id FROM conversions))
+    """, [json.dumps(sorted(conv_ids))] + params)
+    conn.commit()
+    return cursor.rowcount
+
+
+def conversion_is_attributed(conn, conv_id):
+    """
+    Returns True if conv_id already has rows in attribution_customer_journey.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM attribution_customer_journey WHERE conv_id = ? LIMIT 1", (conv_id,))
+    return cursor.fetchone() is not None
+
+
+def insert_ihc_results(response_data, db_path=None, conn=None, verify=False):
     """
-    Inserts the IHC API results into the database.
+    Upserts the IHC API results into the database in one transaction.
+    Rows are keyed on (conv_id, session_id), so storing the same results again is
+    harmless; sessions no longer part of a returned conversion's journey are removed.
+    Uses conn if given, otherwise the shared connection to db_path (see database.get_connection).
+    With verify=True every row is read back and missing rows are reported.
+    Returns the number of rows inserted.
     """
-    print("Inserting IHC results into the database...")
+    rows = [
+        (result.get("conversion_id"), result.get("session_id"), result.get("ihc", 0))
+        for result in response_data.get("value", [])
+    ]
+
+    if conn is None:
+        conn = get_connection(db_path)
 
-    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
     cursor = conn.cursor()
+    insert_query = """
+        INSERT INTO attribution_customer_journey (conv_id, session_id, ihc)
+        VALUES (?, ?, ?)
+        ON CONFLICT(conv_id, session_id) DO UPDATE SET ihc = excluded.ihc
+    """
+
+    delete_stale_query = """
+        DELETE FROM attribution_customer_journey
+        WHERE conv_id = ? AND session_id NOT IN (SELECT value FROM json_each(?))
+    """
+
+    rows_by_conversion = {}
+    for row in rows:
+        rows_by_conversion.setdefault(row[0], []).append(row)
+    stale_params = [
+        (conv_id, json.dumps([session_id for _, session_id, _ in conversion_rows]))
+        for conv_id, conversion_rows in rows_by_conversion.items()
+    ]
 
-    for result in response_data.get("value", []):
-        conv_id = result.get("conversion_id")
-        ihc_value = result.get("ihc", 0)
-        session_id = result.get("session_id")
+    try:
+        cursor.executemany(delete_stale_query, stale_params)
+        cursor.executemany(insert_query, rows)
+        conn.commit()
+        inserted = len(rows)
+    except sqlite3.Error as e:
+        # Fall back to row-by-row inserts so one bad row doesn't drop the whole batch
+        conn.rollback()
+        print(f"Bulk insert failed ({e}), inserting rows one by one...")
+        inserted = 0
+        for conv_id, session_ids in stale_params:
+            try:
+                cursor.execute(delete_stale_query, (conv_id, session_ids))
+            except sqlite3.Error as e:
+                print(f"Error removing stale sessions of conversion {conv_id}: {e}")
+            for _, session_id, ihc_value in rows_by_conversion[conv_id]:
+                try:
+                    cursor.execute(insert_query, (conv_id, session_id, ihc_value))
+                    inserted += 1
+                except sqlite3.Error as e:
+                    print(f"Error inserting data for session {session_id}: {e}")
+        conn.commit()
 
-        # Insert the data into the table
-        try:
+    if verify:
+        missing = 0
+        for conv_id, session_id, _ in rows:
             cursor.execute("""
-                INSERT INTO attribution_customer_journey (conv_id, session_id, ihc) 
-                VALUES (?, ?, ?)
-            """, (conv_id, session_id, ihc_value))
-            print(f"Inserted session {session_id} for conversion {conv_id}")
-        except sqlite3.Error as e:
-            print(f"Error inserting data for session {session_id}: {e}")
-        
-        # Fetch and print the row just inserted
-        cursor.execute("""
-            SELECT * FROM attribution_customer_journey 
-            WHERE conv_id = ? AND session_id = ?
-        """, (conv_id, session_id))
-        
-        inserted_row = cursor.fetchone()
-        print("Inserted row:", inserted_row)
-        
-    conn.commit()
-    conn.close()
-    print("IHC results successfully inserted.")
+                SELECT 1 FROM attribution_customer_journey
+                WHERE conv_id = ? AND session_id = ?
+            """, (conv_id, session_id))
+            if cursor.fetchone() is None:
+                missing += 1
+        logger.info(f"Verified IHC results: {len(rows) - missing} of {len(rows)} rows found.")
+
+    observe('attribution_insert_seconds', time.perf_counter() - start)
+    count('attribution_rows_written', inserted)
+    return inserted
@@ -0,0 +1,74 @@
+from itertools import groupby, islice
+
+OVERSIZED_POLICIES = ('skip', 'truncate', 'raise')
+
+def iter_conversion_journeys(entries):
+    """
+    Groups a stream of journey entries into one list per conversion.
+    Entries of a conversion must be contiguous, as every journey builder writes them.
+    """
+    for _, journey in groupby(entries, key=lambda entry: entry['conversion_id']):
+        yield list(journey)
+
+def first_fit_decreasing(journeys, max_journeys, max_sessions):
+    """
+    Packs whole journeys into as few batches as possible: journeys are placed
+    largest first into the first batch with room for both another journey and
+    its sessions. Returns the batches as lists of journeys.
+    """
+    bins = []  # [session_count, journeys]
+
+    for journey in sorted(journeys, key=len, reverse=True):
+        for packed in bins:
+            if len(packed[1]) < max_journeys and packed[0] + len(journey) <= max_sessions:
+                packed[0] += len(journey)
+                packed[1].append(journey)
+                break
+        else:
+            bins.append([len(journey), [journey]])
+
+    return [packed[1] for packed in bins]
+
+def pack_journey_batches(entries, max_journeys, max_sessions, oversized='skip',
+                         on_oversized=None, window=1000):
+    """
+    Yields request batches (flat lists of journey entries) that never split a
+    conversion's journey across requests and hold at most max_journeys journeys
+    and max_sessions sessions.
+    Journeys are bin-packed in windows of `window` journeys, so memory stays
+    bounded for streamed input.
+    Journeys longer than max_sessions are handled according to `oversized`:
+    'skip' leaves them out, 'truncate' keeps their max_sessions most recent
+    sessions, 'raise' raises a ValueError. Skipped or truncated journeys are
+    passed, complete, to on_oversized(journey) if given.
+    """
+    if oversized not in OVERSIZED_POLICIES:
+        raise ValueError(f"Unknown oversized policy '{oversized}'. Choose from {OVERSIZED_POLICIES}.")
+
+    journeys = iter_conversion_journeys(entries)
+
+    while True:
+        chunk = []
+        taken = 0
+        for journey in islice(journeys, window):
+            taken += 1
+            if len(journey) > max_sessions:
+                conversion_id = journey[0]['conversion_id']
+                if oversized == 'raise':
+                    raise ValueError(f"Journey of conversion {conversion_id} has {len(journey)} sessions, "
+                                     f"more than the {max_sessions} allowed per request.")
+                print(f"⚠️ Journey of conversion {conversion_id} has {len(journey)} sessions "
+                      f"(limit {max_sessions}), {'truncating' if oversized == 'truncate' else 'skipping'} it.")
+                if on_oversized:
+                    on_oversized(journey)
+                if oversized == 'skip':
+                    continue
+                journey = journey[-max_sessions:]
+            chunk.append(journey)
+
+        # A window whose journeys were all skipped yields nothing, but input may remain
+        if not taken:
+            return
+
+        for packed in first_fit_decreasing(chunk, max_journeys, max_sessions):
+            yield [entry for journey in packed for entry in journey]
@@ -0,0 +1,151 @@
+import os
+import time
+import contextlib
+import io
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+from customer_journey import build_journeys_iterrows, build_journeys_vectorized, generate_customer_journeys
+from parallel_journeys import generate_customer_journeys_parallel
+from journey_store import iter_journeys
+from batch_packer import pack_journey_batches
+
+def generate_journey_inputs(num_users, sessions_per_user, conversions_per_user=1, days=30, seed=42):
+    """
+    Generates random conversions and sessions DataFrames shaped like the ones
+    load_journey_inputs returns from the database.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2023-09-01")
+    channels = np.array(["Direct Traffic", "SEA - Brand", "SEA - Non-Brand", "Email", "Social"])
+
+    num_sessions = num_users * sessions_per_user
+    session_offsets = pd.to_timedelta(rng.integers(0, days * 86400, num_sessions), unit="s")
+    sessions = pd.DataFrame({
+        "session_id": [f"s{i}" for i in range(num_sessions)],
+        "user_id": [f"u{i}" for i in np.repeat(np.arange(num_users), sessions_per_user)],
+        "channel_name": rng.choice(channels, num_sessions),
+        "holder_engagement": rng.integers(0, 2, num_sessions),
+        "closer_engagement": rng.integers(0, 2, num_sessions),
+        "impression_interaction": rng.integers(0, 2, num_sessions),
+    })
+    sessions["session_timestamp"] = start + session_offsets
+    sessions["event_date"] = sessions["session_timestamp"].dt.strftime("%Y-%m-%d")
+    sessions["event_time"] = sessions["session_timestamp"].dt.strftime("%H:%M:%S")
+
+    num_conversions = num_users * conversions_per_user
+    conv_offsets = pd.to_timedelta(rng.integers(0, days * 86400, num_conversions), unit="s")
+    conversions = pd.DataFrame({
+        "conv_id": [f"c{i}" for i in range(num_conversions)],
+        "user_id": [f"u{i}" for i in np.repeat(np.arange(num_users), conversions_per_user)],
+        "revenue": rng.uniform(1, 100, num_conversions).round(2),
+    })
+    conversions["conv_timestamp"] = start + conv_offsets
+    conversions["conv_date"] = conversions["conv_timestamp"].dt.strftime("%Y-%m-%d")
+    conversions["conv_time"] = conversions["conv_timestamp"].dt.strftime("%H:%M:%S")
+
+    # Shuffle so the builders cannot rely on the generator's ordering
+    return (conversions.sample(frac=1, random_state=seed).reset_index(drop=True),
+            sessions.sample(frac=1, random_state=seed).reset_index(drop=True))
+
+def timed(builder, conversions, sessions):
+    """
+    Runs a journey builder with its progress output silenced and returns (entries, seconds).
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        entries = builder(conversions, sessions)
+        elapsed = time.perf_counter() - start
+    return entries, elapsed
+
+def check_parity(num_users=200, sessions_per_user=10, conversions_per_user=2):
+    """
+    Verifies that the vectorized builder returns exactly the entries of the iterrows builder.
+    """
+    conversions, sessions = generate_journey_inputs(num_users, sessions_per_user, conversions_per_user)
+    expected, _ = timed(build_journeys_iterrows, conversions, sessions)
+    actual, _ = timed(build_journeys_vectorized, conversions, sessions)
+
+    if expected != actual:
+        raise AssertionError(f"Journey builders disagree: {len(expected)} vs {len(actual)} entries")
+    print(f"✅ Parity check passed on {len(actual)} journey entries.")
+
+def check_batch_packing():
+    """
+    Verifies that skipping oversized journeys never drops the valid journeys after
+    them, even when a whole packing window holds only oversized journeys.
+    """
+    session_counts = {'c1': 4, 'c2': 5, 'c3': 2, 'c4': 3}
+    entries = [{'conversion_id': conv_id, 'session_id': f"{conv_id}_s{i}"}
+               for conv_id, num_sessions in session_counts.items() for i in range(num_sessions)]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        batches = list(pack_journey_batches(entries, 100, 3, 'skip', window=2))
+    packed = sorted({entry['conversion_id'] for batch in batches for entry in batch})
+
+    if packed != ['c3', 'c4']:
+        raise AssertionError(f"Batch packer kept conversions {packed}, expected ['c3', 'c4']")
+    print("✅ Batch packing check passed.")
+
+def run_scaling_benchmark(user_counts=(100, 200, 400, 800), sessions_per_user=10, legacy_limit=400):
+    """
+    Times both builders for growing session counts. The iterrows builder is
+    only run up to legacy_limit users since it grows quadratically.
+    """
+    print(f"{'sessions':>10} {'entries':>10} {'iterrows_s':>12} {'vectorized_s':>14}")
+    for num_users in user_counts:
+        conversions, sessions = generate_journey_inputs(num_users, sessions_per_user)
+        entries, vectorized_s = timed(build_journeys_vectorized, conversions, sessions)
+        if num_users <= legacy_limit:
+            _, iterrows_s = timed(build_journeys_iterrows, conversions, sessions)
+            iterrows_col = f"{iterrows_s:12.3f}"
+        else:
+            iterrows_col = f"{'-':>12}"
+        print(f"{len(sessions):>10} {len(entries):>10} {iterrows_col} {vectorized_s:14.3f}")
+
+def write_inputs_to_sqlite(conversions, sessions, db_path):
+    """
+    Stores generated conversions and sessions as the conversions and session_sources tables.
+    """
+    conn = sqlite3.connect(db_path)
+    conversions.drop(columns=["conv_timestamp"]).to_sql("conversions", conn, index=False)
+    sessions.drop(columns=["session_timestamp"]).to_sql("session_sources", conn, index=False)
+    conn.close()
+
+def run_parallel_benchmark(worker_counts=(1, 2, 4, 8), num_users=20000, sessions_per_user=10):
+    """
+    Times the multiprocessing journey builder for each worker count against the
+    single-process vectorized builder, and checks that every run writes the same store.
+    """
+    conversions, sessions = generate_journey_inputs(num_users, sessions_per_user)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        write_inputs_to_sqlite(conversions, sessions, db_path)
+
+        baseline_path = os.path.join(tmp_dir, "baseline.jsonl")
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            generate_customer_journeys(db_path, baseline_path, engine='vectorized')
+            baseline_s = time.perf_counter() - start
+        expected = list(iter_journeys(baseline_path))
+
+        print(f"{'workers':>8} {'seconds':>10} {'speedup':>10}")
+        print(f"{'single':>8} {baseline_s:10.3f} {1:10.2f}")
+        for workers in worker_counts:
+            parallel_path = os.path.join(tmp_dir, f"parallel_{workers}.jsonl")
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                generate_customer_journeys_parallel(db_path, parallel_path, workers=workers)
+                parallel_s = time.perf_counter() - start
+
+            if list(iter_journeys(parallel_path)) != expected:
+                raise AssertionError(f"Parallel builder with {workers} workers disagrees with the single-process builder")
+            print(f"{workers:>8} {parallel_s:10.3f} {baseline_s / parallel_s:10.2f}")
+
+if __name__ == "__main__":
+    check_parity()
+    check_batch_packing()
+    run_scaling_benchmark()
+    run_parallel_benchmark()
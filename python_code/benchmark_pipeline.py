@@ -0,0 +1,179 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+# The mock IHC server doesn't check the API key, but send_to_ihc_api needs one for the api backend
+os.environ.setdefault("IHC_API_KEY", "benchmark")
+
+from instrumentation import reset_metrics, get_metrics
+from synthetic_data import generate_synthetic_db
+from mock_ihc_server import start_mock_ihc_server
+from customer_journey import generate_customer_journeys
+from journey_store import iter_journeys
+from send_to_ihc_api import send_to_ihc_api_and_store_results
+from channel_reporting_table import populate_channel_reporting, check_channel_reporting_query_plan
+from channel_reporting_excel import create_channel_reporting_csv
+
+# Every benchmark run is appended here as one JSON line
+BENCHMARK_RESULTS_PATH = "benchmark_results.jsonl"
+
+# A stage is a regression when it is this much slower than in the previous comparable run
+REGRESSION_THRESHOLD = 0.2
+
+# Stages timed by run_pipeline_benchmark, in pipeline order
+BENCHMARK_STAGES = ['build_journeys', 'attribute', 'attribution_insert', 'populate_channel_reporting',
+                    'export_channel_reporting']
+
+def git_revision():
+    """
+    Returns the short hash of the checked out commit, or None outside a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_pipeline_benchmark(num_users=10000, sessions_per_user=5, conversions_per_user=0.3, days=30,
+                           seed=42, engine='sql', api_latency=0.0, api_error_rate=0.0,
+                           max_workers=4, backend='api', results_path=BENCHMARK_RESULTS_PATH, label=None):
+    """
+    Runs the whole pipeline on a freshly generated synthetic database and times every stage:
+    journey building, API submission against a local mock IHC server (attribution
+    insert time is reported on its own), populate_channel_reporting and the CSV export.
+    The mock server answers after api_latency seconds and fails api_error_rate of the
+    requests with 503, so client retries can be benchmarked too. With backend='local'
+    attributions are computed by local_attribution instead and the mock server is idle.
+    The channel_reporting query plans are checked too (see
+    check_channel_reporting_query_plan). The result (parameters, git revision,
+    per-stage seconds, rows, peak RSS and query plan problems) is appended to
+    results_path and returned.
+    """
+    params = {
+        'num_users': num_users, 'sessions_per_user': sessions_per_user,
+        'conversions_per_user': conversions_per_user, 'days': days, 'seed': seed,
+        'engine': engine, 'api_latency': api_latency, 'api_error_rate': api_error_rate,
+        'max_workers': max_workers, 'backend': backend,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "benchmark.db")
+        journeys_path = os.path.join(tmp_dir, "customer_journeys.jsonl")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_start = time.perf_counter()
+            counts = generate_synthetic_db(db_path, num_users, sessions_per_user, conversions_per_user,
+                                           days, seed=seed)
+            data_seconds = time.perf_counter() - data_start
+
+        server = start_mock_ihc_server(latency=api_latency, error_rate=api_error_rate)
+        reset_metrics()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_customer_journeys(db_path, journeys_path, engine=engine)
+                failed = send_to_ihc_api_and_store_results(
+                    iter_journeys(journeys_path), db_path, "benchmark", api_url=server.url,
+                    max_workers=max_workers, requests_per_second=10000,
+                    failed_path=os.path.join(tmp_dir, "failed_batches.jsonl"), cache_path=None,
+                    backend=backend,
+                )
+                populate_channel_reporting(db_path)
+                query_plan_problems = check_channel_reporting_query_plan(db_path)
+                create_channel_reporting_csv(db_path, tmp_dir, "channel_reporting.csv")
+        finally:
+            server.shutdown()
+
+    metrics = get_metrics()
+    stages = {record['name']: record for record in metrics['stages']}
+    insert = metrics['histograms'].get('attribution_insert_seconds')
+    if insert:
+        stages['attribution_insert'] = {'seconds': round(insert['sum'], 4),
+                                        'rows_out': metrics['counters'].get('attribution_rows_written')}
+
+    result = {
+        'label': label,
+        'run_id': metrics['run_id'],
+        'started_at': metrics['started_at'],
+        'git_revision': git_revision(),
+        'params': params,
+        'rows': counts,
+        'data_generation_seconds': round(data_seconds, 4),
+        'failed_batches': failed,
+        'query_plan_problems': query_plan_problems,
+        'stages': {name: stages[name] for name in BENCHMARK_STAGES if name in stages},
+        'counters': metrics['counters'],
+    }
+
+    with open(results_path, "a") as f:
+        f.write(json.dumps(result))
+        f.write("\n")
+
+    print(f"{'stage':<28} {'seconds':>10} {'rows':>10} {'peak_rss_mb':>12}")
+    for name, record in result['stages'].items():
+        rows = record.get('rows_out') if record.get('rows_out') is not None else record.get('rows_in')
+        print(f"{name:<28} {record['seconds']:10.3f} {str(rows):>10} {str(record.get('peak_rss_mb', '-')):>12}")
+    print(f"📈 Benchmark result appended to {results_path}")
+    return result
+
+def load_benchmark_results(results_path=BENCHMARK_RESULTS_PATH):
+    """
+    Returns every benchmark run recorded in results_path, oldest first.
+    """
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare_benchmark_runs(results_path=BENCHMARK_RESULTS_PATH, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares the latest benchmark run with the previous run that used the same
+    parameters and prints the change per stage.
+    Returns the names of the stages that got more than `threshold` slower, plus
+    'channel_reporting_query_plan' if the latest run found query plan problems.
+    """
+    runs = load_benchmark_results(results_path)
+    if not runs:
+        print(f"No benchmark runs found in {results_path}.")
+        return []
+
+    latest = runs[-1]
+    plan_regressions = []
+    if latest.get('query_plan_problems'):
+        print(f"❌ channel_reporting query plan problems: {'; '.join(latest['query_plan_problems'])}")
+        plan_regressions = ['channel_reporting_query_plan']
+
+    previous = next((run for run in reversed(runs[:-1]) if run['params'] == latest['params']), None)
+    if previous is None:
+        print("No earlier run with the same parameters to compare with.")
+        return plan_regressions
+
+    print(f"Comparing run {latest['run_id'][:8]} ({latest['git_revision']}) "
+          f"with run {previous['run_id'][:8]} ({previous['git_revision']})")
+    print(f"{'stage':<28} {'before_s':>10} {'after_s':>10} {'change':>8}")
+
+    regressions = []
+    for name in BENCHMARK_STAGES:
+        if name not in latest['stages'] or name not in previous['stages']:
+            continue
+        before = previous['stages'][name]['seconds']
+        after = latest['stages'][name]['seconds']
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = " ⚠️"
+        print(f"{name:<28} {before:10.3f} {after:10.3f} {change:+8.1%}{flag}")
+
+    if regressions:
+        print(f"❌ Regressions in: {', '.join(regressions)}")
+    else:
+        print("✅ No stage regressed.")
+    return regressions + plan_regressions
+
+if __name__ == "__main__":
+    run_pipeline_benchmark()
+    compare_benchmark_runs()
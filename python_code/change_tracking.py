@@ -0,0 +1,184 @@
+import uuid
+
+# Triggers that record changes to the source tables in change log tables, so derived
+# tables (channel_reporting, the journey store, the session index) can be brought up
+# to date from the changes instead of being rebuilt.
+
+# Per source table, the trigger statement recording the session dates whose
+# channel_reporting rows are out of date; {row} is NEW or OLD.
+# The statements use ON CONFLICT DO NOTHING rather than INSERT OR IGNORE: in a trigger
+# fired by an upsert's DO UPDATE, SQLite replaces an OR IGNORE with the upsert's
+# ABORT, so an already recorded date would fail the triggering insert.
+CHANGE_TRACKING_STATEMENTS = {
+    "session_sources": """
+        INSERT INTO channel_reporting_dirty_dates (date)
+        SELECT {row}.event_date WHERE true
+        ON CONFLICT(date) DO NOTHING;
+    """,
+    "session_costs": """
+        INSERT INTO channel_reporting_dirty_dates (date)
+        SELECT event_date FROM session_sources WHERE session_id = {row}.session_id
+        ON CONFLICT(date) DO NOTHING;
+    """,
+    "attribution_customer_journey": """
+        INSERT INTO channel_reporting_dirty_dates (date)
+        SELECT event_date FROM session_sources WHERE session_id = {row}.session_id
+        ON CONFLICT(date) DO NOTHING;
+    """,
+    "conversions": """
+        INSERT INTO channel_reporting_dirty_dates (date)
+        SELECT ss.event_date
+        FROM attribution_customer_journey acj
+        JOIN session_sources ss ON ss.session_id = acj.session_id
+        WHERE acj.conv_id = {row}.conv_id
+        ON CONFLICT(date) DO NOTHING;
+    """,
+}
+
+# An INSERT OR REPLACE deletes the row it replaces without firing the DELETE trigger,
+# so before every insert into a table whose dirty date is not part of its key the
+# date of the row about to be replaced is recorded. The other tables' replaced
+# rows dirty the same dates as the rows replacing them.
+CHANGE_TRACKING_REPLACE_STATEMENTS = {
+    "session_sources": """
+        INSERT INTO channel_reporting_dirty_dates (date)
+        SELECT event_date FROM session_sources WHERE session_id = NEW.session_id
+        ON CONFLICT(date) DO NOTHING;
+    """,
+}
+
+# Counts every write to a table in table_versions, so pipeline checkpoints can tell
+# whether a table changed without reading it
+TABLE_VERSION_STATEMENT = """
+        UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+    """
+
+def existing_tables(cursor):
+    """
+    Returns the names of the tables in the database.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    return {row[0] for row in cursor.fetchall()}
+
+def drop_outdated_triggers(cursor, prefix, triggers):
+    """
+    Drops the triggers named prefix% that are not in triggers ({name: sql}) or whose
+    stored sql differs, e.g. because an earlier version installed them.
+    Returns the triggers left installed, as {name: sql}.
+    """
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' AND name LIKE ?;", (f"{prefix}%",))
+    existing = dict(cursor.fetchall())
+
+    for name, trigger_sql in list(existing.items()):
+        if triggers.get(name) != trigger_sql:
+            cursor.execute(f"DROP TRIGGER {name};")
+            del existing[name]
+    return existing
+
+def install_triggers(cursor, prefix, triggers):
+    """
+    Makes the triggers named prefix% exactly the given ones ({name: sql}): outdated
+    triggers are replaced and missing ones created.
+    Returns True if any trigger was missing or outdated, in which case changes may
+    have gone unrecorded and whatever the triggers maintain needs a full rebuild.
+    """
+    existing = drop_outdated_triggers(cursor, prefix, triggers)
+
+    installed = False
+    for name, trigger_sql in triggers.items():
+        if name not in existing:
+            cursor.execute(f"{trigger_sql};")
+            installed = True
+    return installed
+
+def change_tracking_triggers(tables):
+    """
+    Returns the channel_reporting change tracking triggers of the given source
+    tables, as {name: sql}.
+    """
+    triggers = {}
+    for table, statement in CHANGE_TRACKING_STATEMENTS.items():
+        if table not in tables:
+            continue
+        # An UPDATE can move a row to another date, so it dirties the old and the new date
+        for event, rows in (("INSERT", ["NEW"]), ("DELETE", ["OLD"]), ("UPDATE", ["OLD", "NEW"])):
+            name = f"trg_cr_{table}_{event.lower()}"
+            body = "".join(statement.format(row=row) for row in rows)
+            triggers[name] = f"CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN {body} END"
+        if table in CHANGE_TRACKING_REPLACE_STATEMENTS:
+            name = f"trg_cr_{table}_replace"
+            body = CHANGE_TRACKING_REPLACE_STATEMENTS[table]
+            triggers[name] = f"CREATE TRIGGER {name} BEFORE INSERT ON {table} BEGIN {body} END"
+    return triggers
+
+def upgrade_change_tracking(cursor):
+    """
+    Drops channel_reporting change tracking triggers installed by earlier versions,
+    so they can't fail writes to the source tables. The next
+    install_change_tracking recreates them and, since changes may have gone
+    unrecorded in between, has the report rebuilt in full.
+    """
+    drop_outdated_triggers(cursor, "trg_cr_", change_tracking_triggers(existing_tables(cursor)))
+
+def install_change_tracking(cursor):
+    """
+    Creates the channel_reporting_dirty_dates change log and the triggers that fill it
+    on every insert, replace, update and delete in the tables channel_reporting is
+    built from.
+    Returns True if any trigger was missing or outdated, in which case changes may
+    have gone unrecorded and the report needs a full rebuild.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS channel_reporting_dirty_dates (
+            date TEXT NOT NULL,
+            PRIMARY KEY(date)
+        );
+    """)
+    return install_triggers(cursor, "trg_cr_", change_tracking_triggers(existing_tables(cursor)))
+
+def table_version_triggers(table):
+    """
+    Returns the triggers counting the writes to table in table_versions, as {name: sql}.
+    """
+    triggers = {}
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        name = f"trg_tv_{table}_{event.lower()}"
+        triggers[name] = (f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+                          f"BEGIN {TABLE_VERSION_STATEMENT.format(table=table)} END")
+    return triggers
+
+def table_versions(cursor, tables):
+    """
+    Returns a version of each of the given tables (None if it doesn't exist) that
+    changes with every insert, update and delete, without reading the table.
+    Writes are counted by triggers installed on first use. Whenever they are
+    (re)installed, e.g. because the table was recreated, writes may have gone
+    uncounted, so the table starts over under a new random epoch and never repeats
+    a version it had before.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT NOT NULL,
+            epoch TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY(table_name)
+        );
+    """)
+    existing = existing_tables(cursor)
+
+    versions = {}
+    for table in tables:
+        if table not in existing:
+            versions[table] = None
+            continue
+
+        installed = install_triggers(cursor, f"trg_tv_{table}_", table_version_triggers(table))
+        cursor.execute("SELECT epoch, version FROM table_versions WHERE table_name = ?", (table,))
+        row = cursor.fetchone()
+        if installed or row is None:
+            row = (uuid.uuid4().hex, 0)
+            cursor.execute("INSERT OR REPLACE INTO table_versions (table_name, epoch, version) VALUES (?, ?, ?)",
+                           (table, *row))
+        versions[table] = f"{row[0]}:{row[1]}"
+    cursor.connection.commit()
+    return versions
@@ -1,15 +1,72 @@
+import argparse
 import sqlite3
 import csv
 import os
 import pandas as pd
+from database import get_connection, ensure_indexes
+from instrumentation import stage
 
-def create_channel_reporting_csv(db_path, output_dir, filename, start_date=None, end_date=None):
+def add_cpo_roas(rows):
+    """
+    Adds the CPO (cost / ihc) and ROAS (ihc_revenue / cost) columns, with 0 where
+    the divisor is 0.
+    """
+    rows['CPO'] = (rows['cost'] / rows['ihc'].where(rows['ihc'] != 0)).fillna(0)
+    rows['ROAS'] = (rows['ihc_revenue'] / rows['cost'].where(rows['cost'] != 0)).fillna(0)
+    return rows
+
+def build_channel_reporting_query(start_date=None, end_date=None):
+    """
+    Returns the SELECT on channel_reporting and its parameters, with the date range
+    applied in SQL. Either bound may be omitted.
+    """
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= ?")
+        params.append(end_date)
+
+    query = "SELECT * FROM channel_reporting"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query + " ORDER BY date, channel_name;", params
+
+def write_report_chunk(rows, file_path, first_chunk, parquet_writer=None):
+    """
+    Writes one chunk of report rows to file_path. CSV chunks are appended after the
+    first one; compression follows the file extension (e.g. .csv.gz).
+    For .parquet files the chunk is written as a row group and the writer is returned.
+    """
+    if file_path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export requires pyarrow: pip install pyarrow")
+
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        if parquet_writer is None:
+            parquet_writer = pq.ParquetWriter(file_path, table.schema)
+        parquet_writer.write_table(table)
+        return parquet_writer
+
+    rows.to_csv(file_path, index=False, mode="w" if first_chunk else "a", header=first_chunk)
+    return None
+
+def create_channel_reporting_csv(db_path, output_dir, filename, start_date=None, end_date=None, chunksize=None):
     """
     Creates a .csv file for the channel_reporting table with additional columns:
     - CPO (Cost per Order)
     - ROAS (Return on Ad Spend)
     Filters the data based on the provided start_date and end_date.
+    With chunksize set, the table is read and written chunksize rows at a time.
+    A filename ending in .csv.gz (or another pandas compression suffix) is compressed,
+    one ending in .parquet is written as Parquet.
     """
+    parquet_writer = None
     try:
         # Ensure output directory exists
         if not os.path.exists(output_dir):
@@ -18,60 +75,63 @@ def create_channel_reporting_csv(db_path, output_dir, filename, start_date=None,
 
         csv_file_path = os.path.join(output_dir, filename)
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch the data from channel_reporting
-        query = "SELECT * FROM channel_reporting;"
-        rows = pd.read_sql_query(query, conn)
-
-        if rows.empty:
-            print("No data found in channel_reporting.")
-            return
+        conn = get_connection(db_path)
+        ensure_indexes(conn, ['idx_channel_reporting_date'])
+        conn.commit()
 
-        print("Data loaded from database.")
+        # Fetch the data from channel_reporting, filtered by date in SQL
+        query, params = build_channel_reporting_query(start_date, end_date)
+        if chunksize:
+            chunks = pd.read_sql_query(query, conn, params=params, chunksize=chunksize)
+        else:
+            chunks = [pd.read_sql_query(query, conn, params=params)]
 
-        # If a date range is provided, filter the rows
-        if start_date and end_date:
-            rows['date'] = pd.to_datetime(rows['date'])
-            rows = rows[(rows['date'] >= pd.to_datetime(start_date)) & (rows['date'] <= pd.to_datetime(end_date))]
+        total_rows = 0
+        with stage('export_channel_reporting') as record:
+            for rows in chunks:
+                if rows.empty:
+                    continue
+                add_cpo_roas(rows)
+                parquet_writer = write_report_chunk(rows, csv_file_path, total_rows == 0, parquet_writer)
+                total_rows += len(rows)
+            record['rows_in'] = record['rows_out'] = total_rows
 
-        if rows.empty:
-            print(f"No data found for the date range from {start_date} to {end_date}.")
+        if total_rows == 0:
+            if start_date or end_date:
+                print(f"No data found for the date range from {start_date} to {end_date}.")
+            else:
+                print("No data found in channel_reporting.")
             return
 
-        # Add new columns (CPO and ROAS)
-        rows['CPO'] = rows.apply(lambda row: row['cost'] / row['ihc'] if row['ihc'] != 0 else 0, axis=1)
-        rows['ROAS'] = rows.apply(lambda row: row['ihc_revenue'] / row['cost'] if row['cost'] != 0 else 0, axis=1)
-
-        # Save to CSV
-        rows.to_csv(csv_file_path, index=False)
-
-        print(f"✅ CSV file created successfully at {csv_file_path}")
+        print(f"✅ CSV file created successfully at {csv_file_path} ({total_rows} rows)")
 
     except sqlite3.Error as e:
         print(f"SQLite error occurred: {e}")
     except Exception as e:
         print(f"Error occurred: {e}")
     finally:
-        conn.close()
+        if parquet_writer is not None:
+            parquet_writer.close()
 
-def main():
+def main(argv=None):
+    """
+    Creates the channel_reporting CSV in the output directory, optionally for a date range:
+        python channel_reporting_excel.py --start-date 2023-09-01 --end-date 2023-09-30
+    """
     db_path = "../challenge.db"  # Adjust path if needed
     output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "output"))  # One level up
     filename = "channel_reporting.csv"
 
-    # Ask the user if they want to filter the data by date range
-    user_input = input("Do you want to provide a date range for the data? (yes/no): ").strip().lower()
-    
-    if user_input == 'yes':
-        start_date = input("Enter start date (YYYY-MM-DD): ").strip()
-        end_date = input("Enter end date (YYYY-MM-DD): ").strip()
-        print(f"Creating CSV for the date range: {start_date} to {end_date}")
-        create_channel_reporting_csv(db_path, output_dir, filename, start_date, end_date)
+    parser = argparse.ArgumentParser(description="Exports channel_reporting with CPO and ROAS to CSV.")
+    parser.add_argument("--start-date", help="first date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="last date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    if args.start_date or args.end_date:
+        print(f"Creating CSV for the date range: {args.start_date} to {args.end_date}")
     else:
         print(f"Creating CSV without data filtering.")
-        create_channel_reporting_csv(db_path, output_dir, filename)
+    create_channel_reporting_csv(db_path, output_dir, filename, args.start_date, args.end_date)
 
 if __name__ == "__main__":
     main()
@@ -1,81 +1,162 @@
+import re
 import sqlite3
+from database import get_connection, ensure_indexes
+from data_quality import validate_attribution, IHC_SUM_TOLERANCE
+from change_tracking import install_change_tracking
+from instrumentation import stage
 
-def check_ihc_sum_condition(db_path):
+def check_ihc_sum_condition(db_path, tolerance=IHC_SUM_TOLERANCE):
     """
-    Checks if the sum of 'ihc' column is equal to 1 for each 'conv_id'.
-    Also verifies if each row has a unique (conv_id, session_id) combination.
+    Checks if the sum of 'ihc' column is equal to 1 (within tolerance) for each 'conv_id',
+    along with the other checks of data_quality.validate_attribution.
     Prints:
       - Total number of rows
       - Total unique conv_id count
       - Number of conv_id where ihc sum is not 1
       - Number of affected rows
       - If each row has a unique (conv_id, session_id) combination
-      - The affected rows themselves (if any)
+      - Orphan sessions/conversions, sessions after their conversion and negative costs
+    Returns the validation report.
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        with stage('validate_attribution') as record:
+            report = validate_attribution(db_path, tolerance)
+            record['rows_in'] = report['total_rows']
+    except sqlite3.Error as e:
+        print(f"SQLite error occurred: {e}")
+        return None
 
-        # Get total number of rows in the table
-        cursor.execute("SELECT COUNT(*) FROM attribution_customer_journey;")
-        total_rows = cursor.fetchone()[0]
+    total_rows = report['total_rows']
+    print(f"📊 Total rows in table: {total_rows}")
+    print(f"🔢 Total unique conv_id: {report['total_conversions']}")
+    print(f"⚠️ conv_id where ihc sum ≠ 1 => {report['invalid_ihc_sum_conversions']}")
 
-        # Get total number of unique conv_id
-        cursor.execute("SELECT COUNT(DISTINCT conv_id) FROM attribution_customer_journey;")
-        total_unique_conv_ids = cursor.fetchone()[0]
+    # Print uniqueness check result
+    if report['duplicate_rows'] == 0:
+        print("✅ Each row has a unique (conv_id, session_id) combination.")
+    else:
+        print("❌ Duplicate (conv_id, session_id) combinations exist in the table!")
 
-        # Get conv_id where sum(ihc) != 1
-        cursor.execute("""
-            SELECT conv_id 
-            FROM attribution_customer_journey 
-            GROUP BY conv_id 
-            HAVING SUM(ihc) != 1;
-        """)
-        invalid_conv_ids = [row[0] for row in cursor.fetchall()]
-        num_invalid_conv_ids = len(invalid_conv_ids)
+    if report['invalid_ihc_sum_conversions']:
+        print(f"⚠️ Affected rows: {report['invalid_ihc_sum_rows']} out of {total_rows} total rows.\n")
+    else:
+        print(f"✅ All {total_rows} rows satisfy the ihc sum condition (sum = 1).")
 
-        # Check if (conv_id, session_id) combinations are unique
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM (
-                SELECT DISTINCT conv_id, session_id 
-                FROM attribution_customer_journey
-            );
-        """)
-        unique_combinations = cursor.fetchone()[0]
-        rows_are_unique = unique_combinations == total_rows
-
-        print(f"📊 Total rows in table: {total_rows}")
-        print(f"🔢 Total unique conv_id: {total_unique_conv_ids}")
-        print(f"⚠️ conv_id where ihc sum ≠ 1 => {num_invalid_conv_ids}")
-        
-        # Print uniqueness check result
-        if rows_are_unique:
-            print("✅ Each row has a unique (conv_id, session_id) combination.")
-        else:
-            print("❌ Duplicate (conv_id, session_id) combinations exist in the table!")
-
-        if invalid_conv_ids:
-            # Fetch all rows with invalid conv_id
-            cursor.execute("""
-                SELECT * FROM attribution_customer_journey
-                WHERE conv_id IN ({})
-            """.format(",".join("?" * len(invalid_conv_ids))), invalid_conv_ids)
-            
-            invalid_rows = cursor.fetchall()
-            print(f"⚠️ Affected rows: {len(invalid_rows)} out of {total_rows} total rows.\n")
-
-            # for row in invalid_rows:
-            #     print(row)
-        else:
-            print(f"✅ All {total_rows} rows satisfy the ihc sum condition (sum = 1).")
+    for check, label in (
+        ('ihc_out_of_range_rows', "rows with ihc outside [0, 1]"),
+        ('orphan_session_rows', "rows whose session_id is not in session_sources"),
+        ('orphan_conversions', "conv_id not in conversions"),
+        ('sessions_after_conversion', "rows with a session at or after its conversion"),
+        ('negative_cost_sessions', "sessions with a negative cost"),
+    ):
+        if report[check]:
+            print(f"❌ {label}: {report[check]}")
+
+    return report
+
+
+# Aggregates sessions into (channel_name, date) rows; {date_filter} restricts the dates.
+# Cost and attribution are first aggregated per session and then joined 1:1 onto the
+# sessions, so a session attributed to several conversions has its cost counted once.
+CHANNEL_REPORTING_QUERY = """
+    WITH sessions AS (
+        SELECT ss.session_id, ss.channel_name, ss.event_date
+        FROM session_sources ss
+        {date_filter}
+    ),
+    session_cost AS (
+        SELECT s.session_id, SUM(sc.cost) AS cost
+        FROM sessions s
+        JOIN session_costs sc ON sc.session_id = s.session_id
+        GROUP BY s.session_id
+    ),
+    session_attribution AS (
+        SELECT s.session_id, SUM(acj.ihc) AS ihc, SUM(acj.ihc * c.revenue) AS ihc_revenue
+        FROM sessions s
+        JOIN attribution_customer_journey acj ON acj.session_id = s.session_id
+        LEFT JOIN conversions c ON c.conv_id = acj.conv_id
+        GROUP BY s.session_id
+    )
+    INSERT INTO channel_reporting (channel_name, date, cost, ihc, ihc_revenue)
+    SELECT 
+        s.channel_name, 
+        s.event_date AS date, 
+        COALESCE(SUM(sco.cost), 0) AS cost, 
+        COALESCE(SUM(sa.ihc), 0) AS ihc,
+        COALESCE(SUM(sa.ihc_revenue), 0) AS ihc_revenue
+    FROM sessions s
+    LEFT JOIN session_cost sco ON sco.session_id = s.session_id
+    LEFT JOIN session_attribution sa ON sa.session_id = s.session_id
+    GROUP BY s.channel_name, s.event_date;
+"""
+
+DIRTY_DATES_FILTER = "WHERE ss.event_date IN (SELECT date FROM channel_reporting_dirty_dates)"
+
+# Aliases of the source tables in CHANNEL_REPORTING_QUERY, as they appear in its query plan
+SOURCE_TABLE_ALIASES = {"ss", "sc", "acj", "c"}
+
+def create_channel_reporting_table(cursor):
+    """
+    Creates the channel_reporting table, keyed on (channel_name, date), if it doesn't exist.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS channel_reporting (
+            channel_name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            cost REAL NOT NULL,
+            ihc REAL NOT NULL,
+            ihc_revenue REAL NOT NULL,
+            PRIMARY KEY(channel_name, date)
+        );
+    """)
+
+def ensure_channel_reporting_indexes(cursor):
+    """
+    Creates the indexes the aggregation joins and filters on, if they don't exist.
+    """
+    ensure_indexes(cursor.connection, ['idx_session_sources_event_date', 'idx_attribution_customer_journey_session'])
+
+# Aggregation modes and their date filter
+CHANNEL_REPORTING_MODES = {"full": "", "incremental": DIRTY_DATES_FILTER}
+
+def explain_channel_reporting_query(conn, mode):
+    """
+    Returns the detail lines of EXPLAIN QUERY PLAN for the full or the incremental
+    aggregation, as the database's current indexes make SQLite run it.
+    """
+    cursor = conn.execute("EXPLAIN QUERY PLAN " + CHANNEL_REPORTING_QUERY.format(date_filter=CHANNEL_REPORTING_MODES[mode]))
+    return [row[3] for row in cursor.fetchall()]
+
+def check_channel_reporting_query_plan(db_path):
+    """
+    Runs EXPLAIN QUERY PLAN on the full and the incremental aggregation and returns
+    a list of problems: source tables that are scanned, or joined through an
+    automatic index, instead of being searched through one of their own indexes.
+    Only the full rebuild may scan session_sources.
+    Nothing is created, so the plans are those of the database as it is: run it
+    after populate_channel_reporting or refresh_channel_reporting have set up the
+    indexes and change log, and a missing index is reported.
+    """
+    problems = []
+    try:
+        conn = get_connection(db_path)
+        for mode in CHANNEL_REPORTING_MODES:
+            allowed = {"SCAN ss"} if mode == "full" else set()
+            for detail in explain_channel_reporting_query(conn, mode):
+                match = re.match(r"(SCAN|SEARCH) (\w+)", detail)
+                if not match or match.group(2) not in SOURCE_TABLE_ALIASES:
+                    continue
+                if detail in allowed:
+                    continue
+                if match.group(1) == "SCAN" or "AUTOMATIC" in detail:
+                    problems.append(f"{mode}: {detail}")
 
     except sqlite3.Error as e:
-        print(f"SQLite error occurred: {e}")
-    
-    finally:
-        conn.close()
+        problems.append(f"SQLite error occurred: {e}")
 
+    for problem in problems:
+        print(f"⚠️ channel_reporting query plan: {problem}")
+    return problems
 
 def populate_channel_reporting(db_path):
     """
@@ -83,9 +164,11 @@ def populate_channel_reporting(db_path):
     session_costs, conversions, and attribution_customer_journey.
     If the table exists, it clears the contents before inserting new data.
     If the table doesn't exist, it creates the table first.
+    Also installs the change tracking used by refresh_channel_reporting.
     """
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
         # Check if the table exists
@@ -100,49 +183,84 @@ def populate_channel_reporting(db_path):
             cursor.execute("DELETE FROM channel_reporting;")
         else:
             print("📌 Creating table channel_reporting...")
-            cursor.execute("""
-                CREATE TABLE channel_reporting (
-                    channel_name TEXT,
-                    date TEXT,
-                    cost REAL,
-                    ihc REAL,
-                    ihc_revenue REAL
-                );
-            """)
+            create_channel_reporting_table(cursor)
 
-        # Insert data into channel_reporting
-        query = """
-        INSERT INTO channel_reporting (channel_name, date, cost, ihc, ihc_revenue)
-        SELECT 
-            ss.channel_name, 
-            ss.event_date AS date, 
-            COALESCE(SUM(sc.cost), 0) AS cost, 
-            COALESCE(SUM(acj.ihc), 0) AS ihc,
-            COALESCE(SUM(acj.ihc * c.revenue), 0) AS ihc_revenue
-        FROM session_sources ss
-        LEFT JOIN session_costs sc ON ss.session_id = sc.session_id
-        LEFT JOIN attribution_customer_journey acj ON ss.session_id = acj.session_id
-        LEFT JOIN conversions c ON acj.conv_id = c.conv_id
-        GROUP BY ss.channel_name, ss.event_date;
-        """
+        install_change_tracking(cursor)
+        ensure_channel_reporting_indexes(cursor)
 
-        cursor.execute(query)
-        conn.commit()
+        # Insert data into channel_reporting
+        with stage('populate_channel_reporting') as record:
+            changes = conn.total_changes
+            cursor.execute(CHANNEL_REPORTING_QUERY.format(date_filter=""))
+            record['rows_out'] = conn.total_changes - changes
+            cursor.execute("DELETE FROM channel_reporting_dirty_dates;")
+            conn.commit()
         print("✅ channel_reporting table populated successfully.")
 
     except sqlite3.Error as e:
+        if conn is not None:
+            conn.rollback()
         print(f"SQLite error occurred: {e}")
 
-    finally:
-        conn.close()
+def refresh_channel_reporting(db_path):
+    """
+    Brings channel_reporting up to date by recomputing only the dates recorded in
+    channel_reporting_dirty_dates since the last refresh: their rows are deleted
+    and re-aggregated in one transaction.
+    Falls back to populate_channel_reporting when the table or its change tracking
+    doesn't exist yet.
+    """
+    conn = None
+    try:
+        conn = get_connection(db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT name FROM sqlite_master 
+            WHERE type='table' AND name='channel_reporting';
+        """)
+        table_exists = cursor.fetchone()
+
+        needs_rebuild = install_change_tracking(cursor) or not table_exists
+        conn.commit()
+
+        if needs_rebuild:
+            print("Change tracking was not in place, rebuilding channel_reporting in full...")
+            populate_channel_reporting(db_path)
+            return
+
+        cursor.execute("SELECT COUNT(*) FROM channel_reporting_dirty_dates;")
+        num_dirty = cursor.fetchone()[0]
+
+        if num_dirty == 0:
+            print("✅ channel_reporting is up to date.")
+            return
+
+        print(f"🔄 Refreshing channel_reporting for {num_dirty} changed dates...")
+        ensure_channel_reporting_indexes(cursor)
+        with stage('refresh_channel_reporting') as record:
+            record['rows_in'] = num_dirty
+            cursor.execute("DELETE FROM channel_reporting WHERE date IN (SELECT date FROM channel_reporting_dirty_dates);")
+            changes = conn.total_changes
+            cursor.execute(CHANNEL_REPORTING_QUERY.format(date_filter=DIRTY_DATES_FILTER))
+            record['rows_out'] = conn.total_changes - changes
+            cursor.execute("DELETE FROM channel_reporting_dirty_dates;")
+            conn.commit()
+        print("✅ channel_reporting table refreshed successfully.")
+
+    except sqlite3.Error as e:
+        if conn is not None:
+            conn.rollback()
+        print(f"SQLite error occurred: {e}")
 
 def print_channel_reporting(db_path):
     """
     Prints the contents of the channel_reporting table, including column names,
     number of rows, and the actual data.
     """
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
         # Fetch and print the column names
@@ -162,14 +280,14 @@ def print_channel_reporting(db_path):
             print(row)
 
     except sqlite3.Error as e:
+        if conn is not None:
+            conn.rollback()
         print(f"SQLite error occurred: {e}")
 
-    finally:
-        conn.close()
-
 # Example usage
 if __name__ == "__main__":
     db_path = "../challenge.db"  # Adjust path if needed
     check_ihc_sum_condition(db_path)
-    populate_channel_reporting(db_path)
+    refresh_channel_reporting(db_path)
+    check_channel_reporting_query_plan(db_path)
     #print_channel_reporting(db_path)
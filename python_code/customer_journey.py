@@ -1,46 +1,50 @@
 import sqlite3
 import pandas as pd
-from send_to_ihc_api import send_to_ihc_api_and_store_results  # Importing the function from send_to_ihc.py
-import os
-import json
-from channel_reporting_excel import main as channel_reporting_main
-from channel_reporting_table import populate_channel_reporting, check_ihc_sum_condition
-
-def json_serial(obj):
-    """Custom JSON serializer for objects not serializable by default."""
-    if isinstance(obj, pd.Timestamp):
-        return obj.isoformat()  # Convert Timestamp to ISO 8601 string format
-    raise TypeError("Type not serializable")
+from database import get_connection, ensure_indexes, table_exists
+from journey_store import DEFAULT_BATCH_SIZE, iter_batches, write_journeys
+from journey_frame import journeys_to_frame, concat_journey_frames, iter_frame_entries
+from instrumentation import get_logger, stage
+
+logger = get_logger(__name__)
+
+# Attribution window applied by every journey builder (None / False disables a limit):
+#   lookback_days: only sessions at most this many days before the conversion
+#   max_sessions: only the latest max_sessions sessions of each journey
+#   exclude_previous_conversion: only sessions at or after the user's previous
+#     conversion, so no session is attributed to two conversions of the same user
+JOURNEY_WINDOW = {
+    'lookback_days': None,
+    'max_sessions': None,
+    'exclude_previous_conversion': False,
+}
+
+def resolve_journey_window(window=None):
+    """
+    Returns JOURNEY_WINDOW updated with the given settings, which may set only some keys.
+    """
+    window = {**JOURNEY_WINDOW, **(window or {})}
+    unknown = set(window) - set(JOURNEY_WINDOW)
+    if unknown:
+        raise ValueError(f"Unknown journey window settings {sorted(unknown)}. Choose from {list(JOURNEY_WINDOW)}.")
+    return window
 
 def check_table_exists(db_path, table_name):
     """
     Check if a table exists in the database.
     """
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
-            return cursor.fetchone() is not None
+        return table_exists(get_connection(db_path), table_name)
     except sqlite3.Error as e:
         print(f"SQLite error occurred: {e}")
         return False
 
-def get_customer_journeys(db_path, save_path):
-    print("Connecting to database...")
-    conn = sqlite3.connect(db_path)
-    print("Connected!")
-    
-    print("Fetching conversions data...")
-    conversions = pd.read_sql_query("SELECT * FROM conversions", conn)
-    print("Conversions data loaded!")
-    
-    print("Fetching sessions data...")
-    sessions = pd.read_sql_query("SELECT * FROM session_sources", conn)
-    print("Sessions data loaded!")
-    
-    conversions['conv_timestamp'] = pd.to_datetime(conversions['conv_date'] + ' ' + conversions['conv_time'])
-    sessions['session_timestamp'] = pd.to_datetime(sessions['event_date'] + ' ' + sessions['event_time'])
-    
+def build_journeys_iterrows(conversions, sessions, window=JOURNEY_WINDOW):
+    """
+    Builds journey entries by scanning the sessions table once per conversion.
+    This is the original implementation, kept as a reference for parity checks.
+    window limits the sessions of each journey, see JOURNEY_WINDOW.
+    """
+    window = resolve_journey_window(window)
     customer_journeys = []
 
     print(f"Total conversions to process: {len(conversions)}")
@@ -50,13 +54,25 @@ def get_customer_journeys(db_path, save_path):
         conv_id = conv['conv_id']
         conv_time = conv['conv_timestamp']
         
-        print(f"Processing conversion {idx + 1}/{len(conversions)} - conv_id: {conv_id}, user_id: {user_id}")
+        logger.debug(f"Processing conversion {idx + 1}/{len(conversions)} - conv_id: {conv_id}, user_id: {user_id}")
         
         user_sessions = sessions[(sessions['user_id'] == user_id) & (sessions['session_timestamp'] < conv_time)]
+
+        if window['lookback_days'] is not None:
+            window_start = conv_time - pd.Timedelta(days=window['lookback_days'])
+            user_sessions = user_sessions[user_sessions['session_timestamp'] >= window_start]
+
+        if window['exclude_previous_conversion']:
+            previous = conversions[(conversions['user_id'] == user_id) & (conversions['conv_timestamp'] < conv_time)]
+            if len(previous):
+                user_sessions = user_sessions[user_sessions['session_timestamp'] >= previous['conv_timestamp'].max()]
         
-        print(f"Found {len(user_sessions)} sessions for user {user_id} before conversion {conv_id}")
+        logger.debug(f"Found {len(user_sessions)} sessions for user {user_id} before conversion {conv_id}")
         
-        user_sessions = user_sessions.sort_values(by='session_timestamp')
+        user_sessions = user_sessions.sort_values(by='session_timestamp', kind='mergesort')
+
+        if window['max_sessions'] is not None:
+            user_sessions = user_sessions.tail(window['max_sessions'])
 
         for _, session in user_sessions.iterrows():
             journey_entry = {
@@ -70,46 +86,261 @@ def get_customer_journeys(db_path, save_path):
                 'impression_interaction': session['impression_interaction']
             }
             customer_journeys.append(journey_entry)
+
+    return customer_journeys
+
+def add_window_start(conv, window):
+    """
+    Adds the window_start column to conversions: the earliest session timestamp
+    their journey may include under the window, or NaT when there is no limit.
+    """
+    bounds = pd.DataFrame(index=conv.index)
+
+    if window['lookback_days'] is not None:
+        bounds['lookback'] = conv['conv_timestamp'] - pd.Timedelta(days=window['lookback_days'])
+
+    if window['exclude_previous_conversion']:
+        # Previous conversion of the same user; conversions at the same time don't count
+        times = conv[['user_id', 'conv_timestamp']].drop_duplicates().sort_values(['user_id', 'conv_timestamp'])
+        times['previous'] = times.groupby('user_id')['conv_timestamp'].shift()
+        bounds['previous'] = conv.merge(times, on=['user_id', 'conv_timestamp'], how='left')['previous'].to_numpy()
+
+    conv['window_start'] = bounds.max(axis=1) if len(bounds.columns) else pd.NaT
+    return conv
+
+def build_journeys_vectorized(conversions, sessions, window=JOURNEY_WINDOW):
+    """
+    Builds journey entries with a single join of conversions onto the sessions
+    of the same user, instead of one scan of the sessions table per conversion.
+    Produces the same entries, in the same order, as build_journeys_iterrows.
+    window limits the sessions of each journey, see JOURNEY_WINDOW.
+    """
+    window = resolve_journey_window(window)
+    print(f"Total conversions to process: {len(conversions)}")
+
+    conv = conversions[['conv_id', 'user_id', 'conv_timestamp']].reset_index(drop=True)
+    conv['conv_order'] = conv.index
+    conv = add_window_start(conv, window)
+
+    # Stable sort so sessions with equal timestamps keep their table order
+    sess = sessions.sort_values(by=['user_id', 'session_timestamp'], kind='mergesort')
+
+    merged = conv.merge(sess, on='user_id', how='inner')
+    merged = merged[(merged['session_timestamp'] < merged['conv_timestamp'])
+                    & (merged['window_start'].isna() | (merged['session_timestamp'] >= merged['window_start']))]
+    merged = merged.sort_values(by=['conv_order', 'session_timestamp'], kind='mergesort')
+
+    if window['max_sessions'] is not None:
+        merged = merged[merged.groupby('conv_order').cumcount(ascending=False) < window['max_sessions']]
+
+    journeys = pd.DataFrame({
+        'conversion_id': merged['conv_id'],
+        'session_id': merged['session_id'],
+        'timestamp': merged['session_timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'channel_label': merged['channel_name'],
+        'holder_engagement': merged['holder_engagement'],
+        'closer_engagement': merged['closer_engagement'],
+        'conversion': 0,
+        'impression_interaction': merged['impression_interaction']
+    })
+
+    print(f"Found {len(journeys)} sessions before {conv['conv_id'].nunique()} conversions")
+
+    return journeys.to_dict('records')
+
+JOURNEY_ENGINES = {
+    'iterrows': build_journeys_iterrows,
+    'vectorized': build_journeys_vectorized,
+}
+
+JOURNEY_BACKENDS = list(JOURNEY_ENGINES) + ['sql']
+
+JOURNEY_ENTRY_KEYS = ['conversion_id', 'session_id', 'timestamp', 'channel_label',
+                      'holder_engagement', 'closer_engagement', 'conversion', 'impression_interaction']
+
+def ensure_journey_indexes(conn):
+    """
+    Creates the indexes the SQL journey backend relies on, if they don't exist.
+    """
+    ensure_indexes(conn, ['idx_session_sources_user_time', 'idx_conversions_user_time'])
+    conn.commit()
+
+# Timestamp of the user's previous conversion, evaluated per conversion row `c`
+PREVIOUS_CONVERSION_SQL = """
+    (SELECT MAX(p.conv_date || ' ' || p.conv_time) FROM conversions p
+     WHERE p.user_id = c.user_id
+       AND (p.conv_date < c.conv_date
+            OR (p.conv_date = c.conv_date AND p.conv_time < c.conv_time)))
+"""
+
+def journey_window_sql(window):
+    """
+    Returns the SQL expression (and its parameters) for the earliest session
+    timestamp a conversion `c`'s journey may include under the window, or None
+    when the window has no lower bound.
+    """
+    lookback = "datetime(c.conv_date || ' ' || c.conv_time, ?)"
+    lookback_params = [f"-{window['lookback_days']} days"]
+
+    if window['lookback_days'] is not None and window['exclude_previous_conversion']:
+        return f"MAX({lookback}, COALESCE({PREVIOUS_CONVERSION_SQL}, {lookback}))", lookback_params * 2
+    if window['lookback_days'] is not None:
+        return lookback, lookback_params
+    if window['exclude_previous_conversion']:
+        # Users' first conversions have no previous one and keep all their sessions
+        return f"COALESCE({PREVIOUS_CONVERSION_SQL}, '')", []
+    return None, []
+
+def iter_journeys_sql(conn, batch_size=10000, conversions_table=None, window=JOURNEY_WINDOW):
+    """
+    Builds journey entries inside SQLite and yields them in lists of at most
+    batch_size entries, so only one batch is held in memory at a time.
+    Entries come out in the same order as the pandas engines produce them.
+    If conversions_table is given, only conversions whose conv_id appears in
+    that table are processed. window limits the sessions of each journey, see
+    JOURNEY_WINDOW.
+    """
+    window = resolve_journey_window(window)
+    ensure_journey_indexes(conn)
+
+    conditions = []
+    if conversions_table:
+        conditions.append(f"c.conv_id IN (SELECT conv_id FROM {conversions_table})")
+    conversions_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    window_start, window_params = journey_window_sql(window)
+    session_filter = ""
+    if window_start:
+        session_filter = f"AND s.event_date || ' ' || s.event_time >= {window_start}"
+
+    params = []
+    if window['max_sessions'] is not None:
+        # Keep the sessions from the max_sessions-th latest one in the journey's window on.
+        # Its (event_date, event_time, rowid) is looked up on the index and bounds the
+        # range the join searches, so it is evaluated once per conversion and the result
+        # still streams in index order. Journeys with fewer sessions have no lower bound.
+        session_filter += f"""
+            AND (s.event_date, s.event_time, s.rowid) >= (
+                SELECT COALESCE(MIN(event_date), ''), COALESCE(MIN(event_time), ''), COALESCE(MIN(rowid), 0)
+                FROM (
+                    SELECT s.event_date, s.event_time, s.rowid
+                    FROM session_sources s INDEXED BY idx_session_sources_user_time
+                    WHERE s.user_id = c.user_id
+                      AND (s.event_date < c.conv_date
+                           OR (s.event_date = c.conv_date AND s.event_time < c.conv_time))
+                      {session_filter}
+                    ORDER BY s.event_date DESC, s.event_time DESC, s.rowid DESC
+                    LIMIT 1 OFFSET ?
+                )
+            )"""
+        params += window_params + [window['max_sessions'] - 1]
+        if window['max_sessions'] <= 0:
+            session_filter += " AND 0"
+
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT c.conv_id, s.session_id, s.event_date || ' ' || s.event_time, s.channel_name, s.holder_engagement,
+               s.closer_engagement, 0, s.impression_interaction
+        FROM conversions c
+        JOIN session_sources s INDEXED BY idx_session_sources_user_time
+            ON s.user_id = c.user_id
+            AND (s.event_date < c.conv_date
+                 OR (s.event_date = c.conv_date AND s.event_time < c.conv_time))
+            {session_filter}
+        {conversions_where}
+        ORDER BY c.rowid, s.event_date, s.event_time, s.rowid
+    """, window_params + params)
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [dict(zip(JOURNEY_ENTRY_KEYS, row)) for row in rows]
+
+def load_journey_inputs(conn):
+    """
+    Loads conversions and sessions from the database and adds parsed timestamps.
+    """
+    print("Fetching conversions data...")
+    conversions = pd.read_sql_query("SELECT * FROM conversions", conn)
+    print("Conversions data loaded!")
+    
+    print("Fetching sessions data...")
+    sessions = pd.read_sql_query("SELECT * FROM session_sources", conn)
+    print("Sessions data loaded!")
+    
+    conversions['conv_timestamp'] = pd.to_datetime(conversions['conv_date'] + ' ' + conversions['conv_time'])
+    sessions['session_timestamp'] = pd.to_datetime(sessions['event_date'] + ' ' + sessions['event_time'])
+
+    return conversions, sessions
+
+def iter_customer_journeys(conn, engine='vectorized', batch_size=DEFAULT_BATCH_SIZE, window=JOURNEY_WINDOW):
+    """
+    Yields the journey entries of every conversion in lists of at most batch_size entries.
+    engine selects the journey builder: one of JOURNEY_ENGINES, which work on
+    the tables loaded into pandas, or 'sql', which builds journeys inside SQLite
+    and keeps only one batch in memory. window limits the sessions of each
+    journey, see JOURNEY_WINDOW.
+    """
+    if engine not in JOURNEY_BACKENDS:
+        raise ValueError(f"Unknown journey engine '{engine}'. Choose from {JOURNEY_BACKENDS}.")
+
+    if engine == 'sql':
+        print("Building customer journeys in SQLite...")
+        yield from iter_journeys_sql(conn, batch_size, window=window)
+    else:
+        conversions, sessions = load_journey_inputs(conn)
+        yield from iter_batches(JOURNEY_ENGINES[engine](conversions, sessions, window), batch_size)
+
+def generate_customer_journeys(db_path, save_path, engine='sql', batch_size=DEFAULT_BATCH_SIZE,
+                               window=JOURNEY_WINDOW):
+    """
+    Streams the customer journeys of every conversion into a JSON Lines store at save_path.
+    Returns the number of journey entries written.
+    """
+    print("Connecting to database...")
+    conn = get_connection(db_path)
+    print("Connected!")
+
+    with stage('build_journeys') as record:
+        written = write_journeys(iter_customer_journeys(conn, engine, batch_size, window), save_path)
+        record['rows_out'] = written
+
+    print(f"✅ {written} customer journey entries saved to {save_path}")
+    return written
+
+def get_customer_journeys(db_path, save_path, engine='vectorized', as_frame=False, window=JOURNEY_WINDOW):
+    """
+    Builds the customer journey of every conversion, saves it to save_path
+    and returns all journey entries as one list.
+    With as_frame=True they are returned as a compact journey frame instead
+    (see journey_frame.py), converted batch by batch as they are built.
+    """
+    print("Connecting to database...")
+    conn = get_connection(db_path)
+    print("Connected!")
+    
+    with stage('build_journeys') as record:
+        if as_frame:
+            customer_journeys = concat_journey_frames(
+                journeys_to_frame(batch) for batch in iter_customer_journeys(conn, engine, window=window)
+            )
+        else:
+            customer_journeys = [entry for batch in iter_customer_journeys(conn, engine, window=window)
+                                 for entry in batch]
+        record['rows_out'] = len(customer_journeys)
     
     print("Processing complete!")
     
-    with open(save_path, "w") as f:
-        json.dump(customer_journeys, f, indent=4, default=json_serial)
+    if as_frame:
+        write_journeys(iter_batches(iter_frame_entries(customer_journeys)), save_path)
+    else:
+        write_journeys([customer_journeys], save_path)
 
     print(f"✅ Customer journeys saved to {save_path}")
-    
-    conn.close()    
     return customer_journeys
 
 if __name__ == "__main__":
-    db_path = "../challenge.db"
-    save_path = "customer_journeys.json"
-
-    if os.path.exists(save_path):
-        print(f"Customer journeys already exist in {save_path}, proceeding with next steps...")
-        with open(save_path, "r") as f:
-            journeys = json.load(f)
-        
-        if check_table_exists(db_path, 'channel_reporting'):
-            print("Channel Reporting table exists, proceeding with CSV file generation...")
-            check_ihc_sum_condition(db_path)
-            user_input = input("Do you want to prepare the CSV file? (yes/no): ").strip().lower()
-            
-            if user_input == 'yes':
-                print("📝 Continuing with preparing the CSV file...")
-                channel_reporting_main()
-            else:
-                print("❌ CSV preparation skipped.")
-        else:
-            if not check_table_exists(db_path, 'attribution_customer_journey'):
-                print("Attribution customer journey table does not exist, sending customer data to IHC API...")
-                send_to_ihc_api_and_store_results(journeys, db_path, conv_type_id="ihc_challenge")
-                populate_channel_reporting(db_path)
-            else:
-                print("Attribution customer journey table exists, populating channel reporting table...")
-                populate_channel_reporting(db_path)
-                check_ihc_sum_condition(db_path)
-                channel_reporting_main()
-    else:
-        print("Customer journeys not found. Generating journeys first...")
-        journeys = get_customer_journeys(db_path, save_path)
+    # The pipeline is run non-interactively, with checkpoints, by pipeline_runner.py
+    from pipeline_runner import main
+    raise SystemExit(main())
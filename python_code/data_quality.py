@@ -0,0 +1,98 @@
+from database import get_connection
+
+# Default allowed deviation of a conversion's summed ihc from 1
+IHC_SUM_TOLERANCE = 1e-6
+
+# One row per conversion in attribution_customer_journey, with everything the
+# attribution checks need, computed in a single grouped pass
+ATTRIBUTION_CHECKS_QUERY = """
+    SELECT
+        acj.conv_id,
+        COUNT(*) AS num_rows,
+        COUNT(DISTINCT acj.session_id) AS num_sessions,
+        SUM(acj.ihc) AS ihc_sum,
+        SUM(acj.ihc < 0 OR acj.ihc > 1) AS ihc_out_of_range,
+        SUM(ss.session_id IS NULL) AS orphan_sessions,
+        MAX(c.conv_id IS NULL) AS orphan_conversion,
+        SUM(ss.event_date || ' ' || ss.event_time >= c.conv_date || ' ' || c.conv_time) AS sessions_after_conversion
+    FROM attribution_customer_journey acj
+    LEFT JOIN session_sources ss ON ss.session_id = acj.session_id
+    LEFT JOIN conversions c ON c.conv_id = acj.conv_id
+    GROUP BY acj.conv_id
+"""
+
+def validate_attribution(db_path, tolerance=IHC_SUM_TOLERANCE, max_examples=10):
+    """
+    Runs the data-quality checks of the pipeline and returns a structured report:
+      - total_rows, total_conversions
+      - invalid_ihc_sum_conversions / invalid_ihc_sum_rows: conversions whose ihc
+        does not sum to 1 within `tolerance`, and their rows
+      - duplicate_rows: rows repeating a (conv_id, session_id) pair
+      - ihc_out_of_range_rows: rows with ihc outside [0, 1]
+      - orphan_session_rows: rows whose session_id is not in session_sources
+      - orphan_conversions: conv_ids not in conversions
+      - sessions_after_conversion: rows whose session starts at or after its conversion
+      - negative_cost_sessions: session_costs rows with cost < 0
+      - examples: up to max_examples conv_ids per failed check
+      - passed: True if every check passed
+    All attribution checks come from one grouped scan of attribution_customer_journey,
+    so the cost doesn't depend on how many conversions fail.
+    """
+    report = {
+        'total_rows': 0,
+        'total_conversions': 0,
+        'invalid_ihc_sum_conversions': 0,
+        'invalid_ihc_sum_rows': 0,
+        'duplicate_rows': 0,
+        'ihc_out_of_range_rows': 0,
+        'orphan_session_rows': 0,
+        'orphan_conversions': 0,
+        'sessions_after_conversion': 0,
+        'negative_cost_sessions': 0,
+        'examples': {},
+        'tolerance': tolerance,
+    }
+
+    def add_example(check, conv_id):
+        examples = report['examples'].setdefault(check, [])
+        if len(examples) < max_examples:
+            examples.append(conv_id)
+
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute(ATTRIBUTION_CHECKS_QUERY)
+
+    for (conv_id, num_rows, num_sessions, ihc_sum, ihc_out_of_range,
+         orphan_sessions, orphan_conversion, sessions_after) in cursor:
+        report['total_rows'] += num_rows
+        report['total_conversions'] += 1
+
+        if abs(ihc_sum - 1) > tolerance:
+            report['invalid_ihc_sum_conversions'] += 1
+            report['invalid_ihc_sum_rows'] += num_rows
+            add_example('invalid_ihc_sum', conv_id)
+        if num_rows != num_sessions:
+            report['duplicate_rows'] += num_rows - num_sessions
+            add_example('duplicate_rows', conv_id)
+        if ihc_out_of_range:
+            report['ihc_out_of_range_rows'] += ihc_out_of_range
+            add_example('ihc_out_of_range', conv_id)
+        if orphan_sessions:
+            report['orphan_session_rows'] += orphan_sessions
+            add_example('orphan_sessions', conv_id)
+        if orphan_conversion:
+            report['orphan_conversions'] += 1
+            add_example('orphan_conversions', conv_id)
+        if sessions_after:
+            report['sessions_after_conversion'] += sessions_after
+            add_example('sessions_after_conversion', conv_id)
+
+    cursor.execute("SELECT COUNT(*) FROM session_costs WHERE cost < 0")
+    report['negative_cost_sessions'] = cursor.fetchone()[0]
+
+    report['passed'] = not any(report[check] for check in (
+        'invalid_ihc_sum_conversions', 'duplicate_rows', 'ihc_out_of_range_rows',
+        'orphan_session_rows', 'orphan_conversions', 'sessions_after_conversion',
+        'negative_cost_sessions',
+    ))
+    return report
@@ -0,0 +1,162 @@
+import atexit
+import os
+import sqlite3
+import threading
+from itertools import islice
+
+# Pragmas applied to every connection. WAL lets readers run while a stage writes
+# and, with synchronous=NORMAL, commits don't wait for a full fsync; cache_size
+# (negative: KiB) and mmap_size keep hot pages in memory between statements.
+# temp_store is left at its default, so large sorts and temporary tables spill to
+# disk instead of growing the process's memory.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -256 * 1024,
+    'mmap_size': 1024 ** 3,
+    'busy_timeout': 30000,
+}
+
+# Prepared statements kept per connection, so statements run once per batch are
+# compiled once per run
+STATEMENT_CACHE_SIZE = 256
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Indexes on the join and filter keys of the pipeline's queries: name -> (table, columns)
+PIPELINE_INDEXES = {
+    'idx_session_sources_user_time': ('session_sources', 'user_id, event_date, event_time'),
+    'idx_session_sources_event_date': ('session_sources', 'event_date'),
+    'idx_conversions_user_time': ('conversions', 'user_id, conv_date, conv_time'),
+    'idx_attribution_customer_journey_session': ('attribution_customer_journey', 'session_id'),
+    'idx_channel_reporting_date': ('channel_reporting', 'date'),
+    'idx_user_session_index_session': ('user_session_index', 'session_id'),
+}
+
+_local = threading.local()
+
+def connect(db_path, pragmas=SQLITE_PRAGMAS, read_only=False):
+    """
+    Opens a new connection with the given pragmas. read_only connections
+    (e.g. for worker processes) can't change the database or its journal mode.
+    """
+    if read_only:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+        pragmas = {name: value for name, value in pragmas.items() if name != 'journal_mode'}
+    else:
+        conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE)
+
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+def file_identity(db_path):
+    """
+    Identifies the database file, so a cached connection to a file that was since
+    deleted or replaced is not reused.
+    """
+    try:
+        stat = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+def thread_connections():
+    """
+    Returns this thread's cached connections. A forked worker process starts with
+    an empty cache instead of its parent's connections.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    return _local.connections
+
+def get_connection(db_path):
+    """
+    Returns this thread's long-lived connection to db_path, opening it on first use.
+    Every module shares it instead of opening and closing its own, so the page cache
+    and prepared statements stay warm across stages. Don't close it; callers commit
+    their own writes and roll back on errors.
+    """
+    path = os.path.abspath(db_path)
+    connections = thread_connections()
+
+    cached = connections.get(path)
+    if cached is not None:
+        conn, identity = cached
+        if identity == file_identity(path):
+            return conn
+        conn.close()
+
+    conn = connect(path)
+    connections[path] = (conn, file_identity(path))
+    return conn
+
+def close_connection(db_path):
+    """
+    Closes this thread's connection to db_path, e.g. before the file is removed.
+    """
+    cached = thread_connections().pop(os.path.abspath(db_path), None)
+    if cached is not None:
+        cached[0].close()
+
+def close_connections():
+    """
+    Closes all of this thread's connections.
+    """
+    connections = thread_connections()
+    for conn, _ in connections.values():
+        conn.close()
+    connections.clear()
+
+atexit.register(close_connections)
+
+def table_exists(conn, table_name):
+    """
+    Returns True if the table exists in the database.
+    """
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+    return cursor.fetchone() is not None
+
+def ensure_indexes(conn, names=None):
+    """
+    Creates the given PIPELINE_INDEXES (all by default) that are missing, skipping
+    those whose table doesn't exist yet. The indexes are created in the caller's
+    transaction; commit it to keep them.
+    """
+    for name in names or PIPELINE_INDEXES:
+        table, columns = PIPELINE_INDEXES[name]
+        if table_exists(conn, table):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+def iter_query_batches(conn, query, params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Runs a query and yields its rows in lists of at most batch_size rows.
+    """
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def execute_batches(conn, statement, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Runs statement for every row of an iterable, batch_size rows per executemany
+    call, in one transaction. Rolls back and re-raises on error.
+    Returns the number of rows processed.
+    """
+    iterator = iter(rows)
+    processed = 0
+    try:
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            conn.executemany(statement, batch)
+            processed += len(batch)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return processed
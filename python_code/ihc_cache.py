@@ -0,0 +1,124 @@
+import hashlib
+import json
+import time
+from database import connect
+
+def open_ihc_cache(cache_path):
+    """
+    Opens (and creates if needed) the persistent cache of IHC API results.
+    Each row holds the API result rows of one journey, keyed by a hash of the
+    normalized journey payload and the conv_type_id it was attributed with.
+    """
+    conn = connect(cache_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ihc_cache (
+            cache_key TEXT NOT NULL,
+            conv_type_id TEXT NOT NULL,
+            results TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY(cache_key)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ihc_cache_last_used ON ihc_cache (last_used)")
+    conn.commit()
+    return conn
+
+def journey_cache_key(journey, conv_type_id):
+    """
+    Hashes a journey (the entries of one conversion) together with conv_type_id.
+    Entries are ordered and serialized with sorted keys, so the same journey
+    always gets the same key regardless of entry or field order.
+    """
+    normalized = sorted(journey, key=lambda entry: (entry['timestamp'], entry['session_id']))
+    payload = json.dumps([conv_type_id, normalized], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_cached_results(conn, cache_key):
+    """
+    Returns the cached API result rows for cache_key, or None on a miss.
+    Entries without result rows (stored by earlier versions) count as misses.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT results FROM ihc_cache WHERE cache_key = ?", (cache_key,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    results = json.loads(row[0])
+    if not results:
+        return None
+
+    cursor.execute("UPDATE ihc_cache SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key))
+    return results
+
+def put_cached_results(conn, items, conv_type_id):
+    """
+    Stores API result rows in the cache. items is an iterable of (cache_key, results).
+    """
+    now = time.time()
+    rows = []
+    for cache_key, results in items:
+        serialized = json.dumps(results)
+        rows.append((cache_key, conv_type_id, serialized, len(serialized), now, now))
+
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT OR REPLACE INTO ihc_cache
+            (cache_key, conv_type_id, results, size_bytes, created_at, last_used)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+
+def evict_ihc_cache(conn, max_age_days=None, max_bytes=None):
+    """
+    Removes cache entries created more than max_age_days ago, then removes the
+    least recently used entries until the cached results fit in max_bytes.
+    Returns the number of entries removed.
+    """
+    cursor = conn.cursor()
+    removed = 0
+
+    if max_age_days is not None:
+        cursor.execute("DELETE FROM ihc_cache WHERE created_at < ?", (time.time() - max_age_days * 86400,))
+        removed += cursor.rowcount
+
+    if max_bytes is not None:
+        cursor.execute("""
+            DELETE FROM ihc_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key,
+                           SUM(size_bytes) OVER (ORDER BY last_used DESC, cache_key) AS running_bytes
+                    FROM ihc_cache
+                )
+                WHERE running_bytes > ?
+            )
+        """, (max_bytes,))
+        removed += cursor.rowcount
+
+    conn.commit()
+    return removed
+
+def invalidate_ihc_cache(cache_path, conv_type_id=None):
+    """
+    Explicitly drops cached results: all of them, or only those of conv_type_id.
+    Returns the number of entries removed.
+    """
+    conn = open_ihc_cache(cache_path)
+    cursor = conn.cursor()
+
+    if conv_type_id is None:
+        cursor.execute("DELETE FROM ihc_cache")
+    else:
+        cursor.execute("DELETE FROM ihc_cache WHERE conv_type_id = ?", (conv_type_id,))
+    removed = cursor.rowcount
+
+    conn.commit()
+    conn.close()
+    print(f"🗑️ Removed {removed} entries from the IHC cache.")
+    return removed
+
+if __name__ == "__main__":
+    invalidate_ihc_cache("ihc_cache.db")
@@ -0,0 +1,157 @@
+import json
+import random
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from instrumentation import count, observe
+
+# HTTP status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+
+            time.sleep(wait_time)
+
+class BatchFailed(Exception):
+    """Raised when a batch could not be sent after all retries."""
+
+def create_session(pool_size):
+    """
+    Creates a requests.Session whose connection pool keeps pool_size connections
+    to the API host alive, so batches don't each pay for a new TLS handshake.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def backoff_delay(attempt, base=1.0, maximum=60.0):
+    """
+    Exponential backoff with full jitter for the given (0-based) retry attempt.
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+def post_batch(session, api_url, headers, batch, rate_limiter=None, max_retries=5,
+               backoff_base=1.0, backoff_max=60.0, timeout=60):
+    """
+    Posts one batch of journey entries and returns the decoded response.
+    Retries on connection errors, 429 and 5xx responses and responses that are not
+    valid JSON with exponential backoff and jitter, honoring Retry-After when the
+    API sends it.
+    Raises BatchFailed once max_retries is exhausted or on any other HTTP error.
+    """
+    body = json.dumps({'customer_journeys': batch})
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+
+        if attempt:
+            count('ihc_api_retries')
+
+        start = time.perf_counter()
+        try:
+            response = session.post(api_url, data=body, headers=headers, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            observe('ihc_api_latency_seconds', time.perf_counter() - start)
+            count('ihc_api_connection_errors')
+            error = f"Request failed: {e}"
+            retry_after = None
+        else:
+            observe('ihc_api_latency_seconds', time.perf_counter() - start)
+            count(f'ihc_api_status_{response.status_code}')
+            if response.status_code == 200:
+                # A truncated or non-JSON body (e.g. a proxy's error page) is retried
+                try:
+                    return response.json()
+                except ValueError as e:
+                    count('ihc_api_invalid_responses')
+                    error = f"Invalid JSON response: {e}"
+                    retry_after = None
+            else:
+                error = f"{response.status_code} - {response.text}"
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise BatchFailed(error)
+                retry_after = response.headers.get("Retry-After")
+
+        if attempt == max_retries:
+            break
+
+        delay = backoff_delay(attempt, backoff_base, backoff_max)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        time.sleep(delay)
+
+    raise BatchFailed(f"Giving up after {max_retries + 1} attempts: {error}")
+
+def send_batches_concurrently(batches, api_url, headers, on_result, max_workers=4,
+                              requests_per_second=5, max_retries=5, backoff_base=1.0):
+    """
+    Sends batches to the API from a pool of max_workers threads sharing one
+    pooled session and one rate limiter. on_result(batch_idx, batch, response_data)
+    is called from the calling thread for every successful batch, so it can
+    safely write to SQLite. Batches are read lazily from the iterable and at most
+    2 * max_workers are in flight at once.
+    Returns a list of (batch_idx, batch, error) for the batches that failed.
+    """
+    session = create_session(max_workers)
+    rate_limiter = TokenBucket(requests_per_second)
+    failed = []
+    in_flight = {}
+
+    def collect(done):
+        for future in done:
+            batch_idx, batch = in_flight.pop(future)
+            try:
+                response_data = future.result()
+            except BatchFailed as e:
+                print(f"❌ Batch {batch_idx + 1} failed: {e}")
+                failed.append((batch_idx, batch, str(e)))
+            else:
+                on_result(batch_idx, batch, response_data)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_idx, batch in enumerate(batches):
+            if len(in_flight) >= 2 * max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            future = executor.submit(post_batch, session, api_url, headers, batch,
+                                     rate_limiter, max_retries, backoff_base)
+            in_flight[future] = (batch_idx, batch)
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    session.close()
+    return failed
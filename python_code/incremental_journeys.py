@@ -0,0 +1,268 @@
+import json
+import os
+from customer_journey import (ensure_journey_indexes, iter_journeys_sql, JOURNEY_WINDOW, PREVIOUS_CONVERSION_SQL,
+                              resolve_journey_window)
+from journey_store import DEFAULT_BATCH_SIZE, append_journeys, iter_journeys, iter_batches, write_journeys
+from database import get_connection
+from change_tracking import install_triggers
+from instrumentation import stage
+
+# Number of sessions a user had before a conversion, evaluated per conversion row `c`
+PRIOR_SESSION_COUNT_SQL = """
+    (SELECT COUNT(*) FROM session_sources s
+     WHERE s.user_id = c.user_id
+       AND (s.event_date < c.conv_date
+            OR (s.event_date = c.conv_date AND s.event_time < c.conv_time)))
+"""
+
+# Trigger statement recording the user and timestamp of a changed session row; {row} is NEW or OLD
+JOURNEY_CHANGE_STATEMENT = """
+    INSERT INTO journey_changed_sessions (user_id, timestamp)
+    SELECT {row}.user_id, {row}.event_date || ' ' || {row}.event_time WHERE true
+    ON CONFLICT(user_id, timestamp) DO NOTHING;
+"""
+
+# An INSERT OR REPLACE deletes the row it replaces without firing the DELETE trigger,
+# so the row about to be replaced is recorded before every insert. When the insert
+# doesn't replace it after all (OR IGNORE, errors) its journeys are only rebuilt needlessly.
+JOURNEY_REPLACE_STATEMENT = """
+    INSERT INTO journey_changed_sessions (user_id, timestamp)
+    SELECT user_id, event_date || ' ' || event_time FROM session_sources WHERE session_id = NEW.session_id
+    ON CONFLICT(user_id, timestamp) DO NOTHING;
+"""
+
+def journey_change_triggers():
+    """
+    Returns the triggers that record changed sessions for the journey store, as {name: sql}.
+    """
+    triggers = {
+        "trg_jc_session_sources_replace":
+            f"CREATE TRIGGER trg_jc_session_sources_replace BEFORE INSERT ON session_sources "
+            f"BEGIN {JOURNEY_REPLACE_STATEMENT} END",
+    }
+    for event, rows in (("INSERT", ["NEW"]), ("DELETE", ["OLD"]), ("UPDATE", ["OLD", "NEW"])):
+        name = f"trg_jc_session_sources_{event.lower()}"
+        body = "".join(JOURNEY_CHANGE_STATEMENT.format(row=row) for row in rows)
+        triggers[name] = f"CREATE TRIGGER {name} AFTER {event} ON session_sources BEGIN {body} END"
+    return triggers
+
+def add_missing_column(cursor, table, column, column_type):
+    """
+    Adds a column to a table created by an older version of this module.
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+def create_journey_manifest_tables(conn):
+    """
+    Creates the tables that track which conversions are already in the journey store:
+    - journey_manifest: one row per processed conversion, with the conversion
+      timestamp, the number of sessions before it and the timestamp of the user's
+      previous conversion when its journey was built
+    - journey_store_state: the size of the store file as of the last completed run,
+      and the journey window (see customer_journey.JOURNEY_WINDOW) it was built with
+    - journey_changed_sessions: the change log of session_sources, the (user_id,
+      timestamp) of every session row inserted, updated or deleted since the last
+      run, filled by triggers
+    Returns True if the change log triggers were missing, in which case session
+    changes may have gone unrecorded and every journey needs a rebuild.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journey_manifest (
+            conv_id TEXT NOT NULL,
+            conv_date TEXT NOT NULL,
+            conv_time TEXT NOT NULL,
+            session_count INTEGER NOT NULL,
+            previous_conversion TEXT,
+            PRIMARY KEY(conv_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journey_store_state (
+            save_path TEXT NOT NULL,
+            committed_bytes INTEGER NOT NULL,
+            journey_window TEXT,
+            PRIMARY KEY(save_path)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journey_changed_sessions (
+            user_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            PRIMARY KEY(user_id, timestamp)
+        ) WITHOUT ROWID
+    """)
+    add_missing_column(cursor, "journey_manifest", "previous_conversion", "TEXT")
+    add_missing_column(cursor, "journey_store_state", "journey_window", "TEXT")
+    installed = install_triggers(cursor, "trg_jc_", journey_change_triggers())
+    conn.commit()
+    return installed
+
+def reset_journey_manifest(conn, save_path):
+    """
+    Forgets every processed conversion, e.g. because the store file was removed.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM journey_manifest")
+    cursor.execute("DELETE FROM journey_store_state WHERE save_path = ?", (save_path,))
+    conn.commit()
+
+def truncate_uncommitted_tail(conn, save_path):
+    """
+    Cuts off entries appended to the store by a run that crashed before it
+    could record them in the manifest.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT committed_bytes FROM journey_store_state WHERE save_path = ?", (save_path,))
+    row = cursor.fetchone()
+    committed_bytes = row[0] if row else 0
+
+    if os.path.getsize(save_path) > committed_bytes:
+        print(f"⚠️ Removing uncommitted entries from the end of {save_path}")
+        os.truncate(save_path, committed_bytes)
+
+def journey_window_changed(conn, save_path, window_key):
+    """
+    Tells whether the store at save_path was built with a different journey window.
+    Stores from before windows were recorded were built without one.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT journey_window FROM journey_store_state WHERE save_path = ?", (save_path,))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    built_with = row[0] or json.dumps(resolve_journey_window({}), sort_keys=True)
+    return built_with != window_key
+
+def find_stale_conversions(conn, window=JOURNEY_WINDOW):
+    """
+    Returns the conv_ids in the manifest whose journeys no longer match the database:
+    the conversion was deleted, its timestamp changed, or journey_changed_sessions
+    recorded a session of its user before it that was added, removed or changed
+    (e.g. late-arriving or corrected session data). When the window excludes
+    sessions of previous conversions, a conversion is also stale when its user's
+    previous conversion changed.
+    """
+    previous_changed = ""
+    if resolve_journey_window(window)['exclude_previous_conversion']:
+        previous_changed = f"OR m.previous_conversion IS NOT {PREVIOUS_CONVERSION_SQL}"
+
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT m.conv_id
+        FROM journey_manifest m
+        LEFT JOIN conversions c ON c.conv_id = m.conv_id
+        WHERE c.conv_id IS NULL
+           OR c.conv_date != m.conv_date
+           OR c.conv_time != m.conv_time
+           OR EXISTS (SELECT 1 FROM journey_changed_sessions j
+                      WHERE j.user_id = c.user_id AND j.timestamp < c.conv_date || ' ' || c.conv_time)
+           {previous_changed}
+    """)
+    return {row[0] for row in cursor.fetchall()}
+
+def remove_stale_journeys(conn, save_path, stale_conv_ids):
+    """
+    Rewrites the store without the entries of stale conversions and drops them from the manifest.
+    """
+    kept_entries = (entry for entry in iter_journeys(save_path)
+                    if entry['conversion_id'] not in stale_conv_ids)
+    write_journeys(iter_batches(kept_entries), save_path)
+
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM journey_manifest WHERE conv_id = ?",
+                       [(conv_id,) for conv_id in stale_conv_ids])
+    cursor.execute("""
+        INSERT INTO journey_store_state (save_path, committed_bytes) VALUES (?, ?)
+        ON CONFLICT(save_path) DO UPDATE SET committed_bytes = excluded.committed_bytes
+    """, (save_path, os.path.getsize(save_path)))
+    conn.commit()
+
+def update_customer_journeys(db_path, save_path, batch_size=DEFAULT_BATCH_SIZE, window=JOURNEY_WINDOW):
+    """
+    Brings the journey store at save_path up to date with the database without
+    rebuilding it: journeys of conversions that became stale are removed, and
+    journeys are built and appended only for conversions not yet in the store.
+    Journeys are built with the SQL backend, limited by window (see
+    customer_journey.JOURNEY_WINDOW); a store built with another window is rebuilt.
+    Returns a dict with the number of stale and built conversions and entries appended.
+    """
+    window = resolve_journey_window(window)
+    window_key = json.dumps(window, sort_keys=True)
+    conn = get_connection(db_path)
+
+    try:
+        tracking_installed = create_journey_manifest_tables(conn)
+        ensure_journey_indexes(conn)
+
+        if not os.path.exists(save_path):
+            print(f"No journey store at {save_path}, building all journeys...")
+            reset_journey_manifest(conn, save_path)
+            open(save_path, "w").close()
+        elif tracking_installed:
+            print(f"Session changes were not tracked since {save_path} was built, rebuilding all journeys...")
+            reset_journey_manifest(conn, save_path)
+            open(save_path, "w").close()
+        elif journey_window_changed(conn, save_path, window_key):
+            print(f"Journey window changed since {save_path} was built, rebuilding all journeys...")
+            reset_journey_manifest(conn, save_path)
+            open(save_path, "w").close()
+        else:
+            truncate_uncommitted_tail(conn, save_path)
+
+        stale_conv_ids = find_stale_conversions(conn, window)
+        if stale_conv_ids:
+            print(f"🔄 {len(stale_conv_ids)} conversions have changed since their journeys were built.")
+            remove_stale_journeys(conn, save_path, stale_conv_ids)
+
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS temp.pending_conversions")
+        cursor.execute(f"""
+            CREATE TEMP TABLE pending_conversions AS
+            SELECT c.conv_id, c.conv_date, c.conv_time, {PRIOR_SESSION_COUNT_SQL} AS session_count,
+                   {PREVIOUS_CONVERSION_SQL} AS previous_conversion
+            FROM conversions c
+            WHERE NOT EXISTS (SELECT 1 FROM journey_manifest m WHERE m.conv_id = c.conv_id)
+        """)
+        cursor.execute("SELECT COUNT(*) FROM pending_conversions")
+        num_pending = cursor.fetchone()[0]
+        print(f"Building journeys for {num_pending} new conversions...")
+
+        with stage('update_journeys') as record:
+            record['rows_in'] = num_pending
+            appended = append_journeys(
+                iter_journeys_sql(conn, batch_size, conversions_table="temp.pending_conversions", window=window),
+                save_path
+            )
+            record['rows_out'] = appended
+
+        # Record the new conversions and the new store size together, so a crash
+        # before this commit is undone by truncate_uncommitted_tail on the next run
+        cursor.execute("""
+            INSERT INTO journey_manifest (conv_id, conv_date, conv_time, session_count, previous_conversion)
+            SELECT conv_id, conv_date, conv_time, session_count, previous_conversion FROM pending_conversions
+        """)
+        cursor.execute("""
+            INSERT OR REPLACE INTO journey_store_state (save_path, committed_bytes, journey_window) VALUES (?, ?, ?)
+        """, (save_path, os.path.getsize(save_path), window_key))
+        cursor.execute("DROP TABLE temp.pending_conversions")
+        cursor.execute("DELETE FROM journey_changed_sessions")
+        conn.commit()
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    print(f"✅ Appended {appended} journey entries to {save_path}")
+    return {
+        'stale_conversions': len(stale_conv_ids),
+        'built_conversions': num_pending,
+        'appended_entries': appended,
+    }
+
+if __name__ == "__main__":
+    db_path = "../challenge.db"
+    save_path = "customer_journeys.jsonl"
+    update_customer_journeys(db_path, save_path)
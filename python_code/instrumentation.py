@@ -0,0 +1,146 @@
+import atexit
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+LOG_LEVEL = os.getenv("PIPELINE_LOG_LEVEL", "INFO")
+
+_lock = threading.Lock()
+_metrics = {}
+
+def reset_metrics():
+    """
+    Starts a new run: clears all recorded stages, counters and histograms.
+    """
+    with _lock:
+        _metrics.clear()
+        _metrics.update({
+            'run_id': uuid.uuid4().hex,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stages': [],
+            'counters': {},
+            'histograms': {},
+        })
+
+reset_metrics()
+
+def get_logger(name):
+    """
+    Returns the logger of a pipeline module. Per-row and per-batch output is logged
+    at DEBUG, so it is off unless PIPELINE_LOG_LEVEL (or configure_logging) asks for it.
+    """
+    return logging.getLogger(f"pipeline.{name}")
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Sends pipeline log records to stdout at the given level.
+    """
+    logger = logging.getLogger("pipeline")
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size so far, in MB, of this process and of its
+    finished child processes (e.g. journey builder workers).
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+@contextmanager
+def stage(name):
+    """
+    Records one pipeline stage: wall time, peak RSS at its end, and the rows_in /
+    rows_out the caller sets on the yielded dict.
+
+        with stage('build_journeys') as record:
+            record['rows_out'] = write_journeys(...)
+    """
+    record = {'rows_in': None, 'rows_out': None}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['peak_rss_mb'], record['peak_rss_children_mb'] = peak_rss_mb()
+        with _lock:
+            _metrics['stages'].append({'name': name, **record})
+        get_logger("instrumentation").info(
+            f"stage {name}: {record['seconds']}s, rows in {record['rows_in']}, "
+            f"rows out {record['rows_out']}, peak RSS {record['peak_rss_mb']} MB"
+        )
+
+def count(name, value=1):
+    """
+    Adds value to the counter called name.
+    """
+    with _lock:
+        _metrics['counters'][name] = _metrics['counters'].get(name, 0) + value
+
+def observe(name, value):
+    """
+    Records one observation (e.g. a request latency in seconds) in the histogram called name.
+    """
+    with _lock:
+        histogram = _metrics['histograms'].get(name)
+        if histogram is None:
+            histogram = {
+                'count': 0, 'sum': 0.0, 'min': value, 'max': value,
+                'buckets': {str(bound): 0 for bound in LATENCY_BUCKETS + ['inf']},
+            }
+            _metrics['histograms'][name] = histogram
+
+        histogram['count'] += 1
+        histogram['sum'] += value
+        histogram['min'] = min(histogram['min'], value)
+        histogram['max'] = max(histogram['max'], value)
+        for bound in LATENCY_BUCKETS:
+            if value <= bound:
+                histogram['buckets'][str(bound)] += 1
+                break
+        else:
+            histogram['buckets']['inf'] += 1
+
+def get_metrics():
+    """
+    Returns a snapshot of everything recorded in this run.
+    """
+    with _lock:
+        return json.loads(json.dumps(_metrics))
+
+def write_metrics(path=None):
+    """
+    Writes this run's metrics as JSON, by default to pipeline_metrics_<run_id>.json.
+    Returns the path written.
+    """
+    metrics = get_metrics()
+    metrics['finished_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    metrics['peak_rss_mb'], metrics['peak_rss_children_mb'] = peak_rss_mb()
+    path = path or f"pipeline_metrics_{metrics['run_id']}.json"
+
+    with open(path, "w") as f:
+        json.dump(metrics, f, indent=2)
+
+    print(f"📈 Pipeline metrics written to {path}")
+    return path
+
+def write_metrics_on_exit(path=None):
+    """
+    Makes the process write its metrics file when it exits.
+    """
+    atexit.register(write_metrics, path)
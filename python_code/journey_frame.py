@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from journey_store import DEFAULT_BATCH_SIZE
+
+# Column types of a journey frame: ids and channels are integer-coded categoricals,
+# flags are int8 and timestamps are int64 seconds since the epoch
+JOURNEY_FRAME_DTYPES = {
+    'conversion_id': 'category',
+    'session_id': 'category',
+    'timestamp': 'int64',
+    'channel_label': 'category',
+    'holder_engagement': 'int8',
+    'closer_engagement': 'int8',
+    'conversion': 'int8',
+    'impression_interaction': 'int8',
+}
+
+CATEGORY_COLUMNS = [column for column, dtype in JOURNEY_FRAME_DTYPES.items() if dtype == 'category']
+
+EPOCH = pd.Timestamp("1970-01-01")
+
+def journeys_to_frame(entries):
+    """
+    Converts journey entries (a list of dicts in the API payload format, or a DataFrame
+    with the same columns) to a compact journey frame with JOURNEY_FRAME_DTYPES.
+    """
+    if isinstance(entries, pd.DataFrame):
+        journeys = entries[list(JOURNEY_FRAME_DTYPES)].copy()
+    else:
+        journeys = pd.DataFrame.from_records(entries, columns=list(JOURNEY_FRAME_DTYPES))
+
+    timestamps = pd.to_datetime(journeys['timestamp'], format='ISO8601')
+    journeys['timestamp'] = (timestamps - EPOCH) // pd.Timedelta(seconds=1)
+    return journeys.astype(JOURNEY_FRAME_DTYPES)
+
+def concat_journey_frames(frames):
+    """
+    Concatenates journey frames, merging their categories instead of falling back
+    to object columns as pd.concat does when the categories differ.
+    """
+    frames = list(frames)
+    if not frames:
+        return journeys_to_frame([])
+
+    columns = {}
+    for column in JOURNEY_FRAME_DTYPES:
+        if column in CATEGORY_COLUMNS:
+            columns[column] = union_categoricals([frame[column] for frame in frames])
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+    return pd.DataFrame(columns)
+
+def frame_to_payload(frame):
+    """
+    Converts a journey frame (or a slice of one) back to journey entries in the API
+    payload format, with string ids and 'YYYY-MM-DD HH:MM:SS' timestamps.
+    """
+    payload = frame.astype({column: object for column in CATEGORY_COLUMNS})
+    payload['timestamp'] = pd.to_datetime(frame['timestamp'], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
+    return payload.to_dict('records')
+
+def journey_boundaries(frame):
+    """
+    Returns the row positions where each conversion's journey starts, plus the
+    frame length. Journeys must be contiguous, as every journey builder writes them.
+    """
+    codes = frame['conversion_id'].cat.codes.to_numpy()
+    starts = np.flatnonzero(np.diff(codes)) + 1
+    return np.concatenate(([0], starts, [len(frame)])) if len(frame) else np.array([0])
+
+def iter_frame_batches(frame, max_journeys, max_sessions):
+    """
+    Slices a journey frame into consecutive batches of whole journeys, each with at
+    most max_journeys journeys and max_sessions sessions (a longer journey is a
+    batch of its own). Slicing only computes row positions; no entries are copied
+    until a batch is converted with frame_to_payload.
+    """
+    boundaries = journey_boundaries(frame)
+    start = 0
+    while start < len(boundaries) - 1:
+        # Furthest journey end within both limits, and at least one journey
+        last = min(start + max_journeys, len(boundaries) - 1)
+        last = max(start + 1, int(np.searchsorted(boundaries[start + 1:last + 1],
+                                                  boundaries[start] + max_sessions, side='right')) + start)
+        yield frame.iloc[boundaries[start]:boundaries[last]]
+        start = last
+
+def iter_frame_entries(frame, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields the entries of a journey frame in the API payload format, converting
+    batch_size rows at a time.
+    """
+    for start in range(0, len(frame), batch_size):
+        yield from frame_to_payload(frame.iloc[start:start + batch_size])
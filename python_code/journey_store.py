@@ -0,0 +1,99 @@
+import json
+import os
+import pandas as pd
+from itertools import islice
+
+DEFAULT_BATCH_SIZE = 10000
+
+def json_serial(obj):
+    """Custom JSON serializer for objects not serializable by default."""
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()  # Convert Timestamp to ISO 8601 string format
+    if hasattr(obj, 'item'):
+        return obj.item()  # numpy scalars, e.g. int64 engagement flags
+    raise TypeError("Type not serializable")
+
+def iter_batches(entries, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Splits any iterable of journey entries into lists of at most batch_size entries.
+    """
+    iterator = iter(entries)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def write_journeys(batches, save_path):
+    """
+    Writes batches of journey entries to save_path as JSON Lines, one entry per line.
+    The file is written under a temporary name and moved into place once complete,
+    so an interrupted run never leaves a truncated store behind.
+    Returns the number of entries written.
+    """
+    written = 0
+    for batch in tee_journeys(batches, save_path):
+        written += len(batch)
+    return written
+
+def tee_journeys(batches, save_path):
+    """
+    Writes batches of journey entries to save_path like write_journeys, yielding
+    every batch once it is written, so the journeys can be processed further while
+    the store is being written. The store is moved into place once every batch
+    has been consumed.
+    """
+    tmp_path = f"{save_path}.tmp"
+
+    with open(tmp_path, "w") as f:
+        for batch in batches:
+            for entry in batch:
+                f.write(json.dumps(entry, default=json_serial))
+                f.write("\n")
+            yield batch
+
+    os.replace(tmp_path, save_path)
+
+def append_journeys(batches, save_path):
+    """
+    Appends batches of journey entries to a JSON Lines store, creating it if needed.
+    Returns the number of entries appended.
+    """
+    written = 0
+
+    with open(save_path, "a") as f:
+        for batch in batches:
+            for entry in batch:
+                f.write(json.dumps(entry, default=json_serial))
+                f.write("\n")
+            written += len(batch)
+        f.flush()
+        os.fsync(f.fileno())
+
+    return written
+
+def iter_journeys(save_path):
+    """
+    Yields journey entries one at a time from a journey store.
+    JSON Lines files are streamed; legacy files holding one indented JSON list
+    are loaded whole.
+    """
+    with open(save_path, "r") as f:
+        first_char = f.read(1)
+        while first_char.isspace():
+            first_char = f.read(1)
+        f.seek(0)
+
+        if first_char == "[":
+            yield from json.load(f)
+            return
+
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_journey_batches(save_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields journey entries from a journey store in lists of at most batch_size entries.
+    """
+    yield from iter_batches(iter_journeys(save_path), batch_size)
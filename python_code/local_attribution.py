@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# Sessions per batch computed locally; there are no API limits, so batches are only
+# bounded to keep memory flat
+LOCAL_BATCH_SESSIONS = 100000
+
+# Score of a session before its conversion's scores are normalized to sum to 1:
+#   base + initializer (first session) + closer (last session)
+#   + holder_engagement * holder + closer_engagement * closer_engagement
+# multiplied by impression when the session was an impression rather than a visit
+LOCAL_ATTRIBUTION_WEIGHTS = {
+    'base': 1.0,
+    'initializer': 1.0,
+    'closer': 1.0,
+    'holder': 0.5,
+    'closer_engagement': 0.5,
+    'impression': 0.5,
+}
+
+def compute_local_attribution(entries, weights=LOCAL_ATTRIBUTION_WEIGHTS):
+    """
+    Computes a position- and engagement-based fractional attribution for a batch of
+    journey entries, in the response format of the IHC API:
+    {'statusCode': 200, 'value': [{'conversion_id', 'session_id', 'ihc'}, ...]}.
+    The first session of a journey gets the initializer bonus, the last one the
+    closer bonus, and holder_engagement, closer_engagement and impression_interaction
+    adjust every session's score; each conversion's scores are then normalized to
+    sum to 1. Entries of a conversion must be contiguous and in time order, as
+    every journey builder writes them.
+    """
+    if not entries:
+        return {'statusCode': 200, 'value': []}
+
+    journeys = pd.DataFrame.from_records(entries, columns=[
+        'conversion_id', 'session_id', 'holder_engagement', 'closer_engagement', 'impression_interaction',
+    ])
+    by_conversion = journeys.groupby('conversion_id', sort=False)
+    position = by_conversion.cumcount().to_numpy()
+    is_first = position == 0
+    is_last = position == by_conversion['session_id'].transform('size').to_numpy() - 1
+
+    score = (
+        weights['base']
+        + weights['initializer'] * is_first
+        + weights['closer'] * is_last
+        + weights['holder'] * journeys['holder_engagement'].to_numpy()
+        + weights['closer_engagement'] * journeys['closer_engagement'].to_numpy()
+    ) * np.where(journeys['impression_interaction'].to_numpy() == 1, weights['impression'], 1.0)
+
+    journeys['ihc'] = score / pd.Series(score).groupby(journeys['conversion_id'], sort=False).transform('sum').to_numpy()
+
+    return {'statusCode': 200, 'value': journeys[['conversion_id', 'session_id', 'ihc']].to_dict('records')}
+
+def iter_local_batches(journeys, max_sessions=LOCAL_BATCH_SESSIONS):
+    """
+    Groups whole journeys (lists of entries, e.g. from iter_conversion_journeys)
+    into batches of up to max_sessions entries; a longer journey is a batch of its own.
+    """
+    batch = []
+    for journey in journeys:
+        if batch and len(batch) + len(journey) > max_sessions:
+            yield batch
+            batch = []
+        batch.extend(journey)
+
+    if batch:
+        yield batch
+
+def attribute_batches_locally(batches, on_result, weights=LOCAL_ATTRIBUTION_WEIGHTS):
+    """
+    Local counterpart of ihc_client.send_batches_concurrently: computes every batch
+    with compute_local_attribution and passes it to on_result(batch_idx, batch,
+    response_data). Nothing can fail transiently, so the returned list of failed
+    batches is always empty.
+    """
+    for batch_idx, batch in enumerate(batches):
+        on_result(batch_idx, batch, compute_local_attribution(batch, weights))
+    return []
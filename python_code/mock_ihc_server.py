@@ -0,0 +1,77 @@
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Request limits enforced by the API (same as in send_to_ihc_api.py)
+MAX_JOURNEYS_PER_REQUEST = 100
+MAX_SESSIONS_PER_REQUEST = 2000
+
+class MockIHCHandler(BaseHTTPRequestHandler):
+    """
+    Answers compute_ihc requests like the IHC API does: checks the request limits
+    and returns, for every session, an ihc share of its conversion. Shares are split
+    equally within each conversion, so they sum to 1.
+    The server's latency and error_rate make requests slower or fail with 503.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        entries = body.get("customer_journeys", [])
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self.send_json(503, {'statusCode': 503, 'message': "Service unavailable"})
+            return
+
+        journeys = {}
+        for entry in entries:
+            journeys.setdefault(entry['conversion_id'], []).append(entry['session_id'])
+
+        if len(journeys) > MAX_JOURNEYS_PER_REQUEST or len(entries) > MAX_SESSIONS_PER_REQUEST:
+            self.send_json(400, {'statusCode': 400, 'message': "Request exceeds the journey or session limit"})
+            return
+
+        self.server.requests += 1
+        self.send_json(200, {'statusCode': 200, 'value': [
+            {'conversion_id': conv_id, 'session_id': session_id, 'ihc': 1 / len(session_ids)}
+            for conv_id, session_ids in journeys.items()
+            for session_id in session_ids
+        ]})
+
+def start_mock_ihc_server(host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+    """
+    Starts a mock IHC API in a background thread and returns the server; port=0
+    picks a free port. Its endpoint is server.url, requests answered so far are in
+    server.requests. Stop it with server.shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), MockIHCHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.requests = 0
+    server.url = f"http://{host}:{server.server_port}/v1/compute_ihc"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    server = start_mock_ihc_server(port=8080, latency=0.05)
+    print(f"Mock IHC API listening on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
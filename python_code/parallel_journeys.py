@@ -0,0 +1,143 @@
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from customer_journey import build_journeys_vectorized, JOURNEY_WINDOW
+from journey_store import iter_batches, write_journeys, json_serial
+from database import connect, get_connection, ensure_indexes
+from instrumentation import stage
+
+def partition_users(db_path, num_shards):
+    """
+    Splits the users into at most num_shards ranges of user ids with about the same
+    number of sessions each, in one pass over the (user_id, ...) index of
+    session_sources. A range is (start, end): users with start <= user_id < end,
+    None for an open end; together the ranges cover every user id, so all
+    conversions of a user fall into the same range.
+    """
+    conn = get_connection(db_path)
+    # Workers read the ranges through these indexes over read-only connections
+    ensure_indexes(conn, ['idx_session_sources_user_time', 'idx_conversions_user_time'])
+    conn.commit()
+
+    counts = conn.execute("SELECT user_id, COUNT(*) FROM session_sources GROUP BY user_id ORDER BY user_id").fetchall()
+    total = sum(sessions for _, sessions in counts)
+
+    starts = [None]
+    seen = 0
+    for user_id, sessions in counts:
+        if len(starts) < num_shards and seen >= total * len(starts) / num_shards:
+            starts.append(user_id)
+        seen += sessions
+    return list(zip(starts, starts[1:] + [None]))
+
+def user_range_filter(user_range, column="user_id"):
+    """
+    Returns the WHERE condition and parameters selecting the rows whose column is
+    in user_range (see partition_users).
+    """
+    start, end = user_range
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{column} < ?")
+        params.append(end)
+    return " AND ".join(conditions) or "1", params
+
+def build_shard_journeys(db_path, user_range, shard_path, window=JOURNEY_WINDOW):
+    """
+    Worker: reads the conversions and sessions of the users in user_range (see
+    partition_users) straight from SQLite, through the user_id indexes, builds
+    their journeys and writes them to shard_path as JSON Lines of
+    [conversion rowid, entry], in conversion table order. All conversions of a
+    user are in the same range, so the window's exclude_previous_conversion works per shard.
+    Returns the number of entries written.
+    """
+    conn = connect(db_path, read_only=True)
+    condition, params = user_range_filter(user_range)
+
+    try:
+        conversions = pd.read_sql_query(f"""
+            SELECT rowid AS conv_rowid, * FROM conversions
+            WHERE {condition}
+            ORDER BY rowid
+        """, conn, params=params)
+        sessions = pd.read_sql_query(f"""
+            SELECT * FROM session_sources
+            WHERE {condition}
+            ORDER BY rowid
+        """, conn, params=params)
+    finally:
+        conn.close()
+
+    conversions['conv_timestamp'] = pd.to_datetime(conversions['conv_date'] + ' ' + conversions['conv_time'])
+    sessions['session_timestamp'] = pd.to_datetime(sessions['event_date'] + ' ' + sessions['event_time'])
+
+    entries = build_journeys_vectorized(conversions, sessions, window)
+    conv_rowids = dict(zip(conversions['conv_id'], conversions['conv_rowid']))
+
+    with open(shard_path, "w") as f:
+        for entry in entries:
+            f.write(json.dumps([conv_rowids[entry['conversion_id']], entry], default=json_serial))
+            f.write("\n")
+
+    return len(entries)
+
+def iter_shard_file(shard_path):
+    """
+    Yields (conversion rowid, entry) pairs from a worker's shard file.
+    """
+    with open(shard_path, "r") as f:
+        for line in f:
+            conv_rowid, entry = json.loads(line)
+            yield conv_rowid, entry
+
+def generate_customer_journeys_parallel(db_path, save_path, workers=None, num_shards=None, window=JOURNEY_WINDOW):
+    """
+    Builds the customer journeys of every conversion in parallel and streams them
+    to the JSON Lines store at save_path.
+    Users are split once into num_shards ranges of user ids (default: one per
+    worker, see partition_users), each built in its own process from its own
+    indexed read of SQLite. The shard outputs
+    are merged by conversion rowid, so the store has the same entries in the same
+    order as generate_customer_journeys produces, whatever the worker count.
+    window limits the sessions of each journey, see customer_journey.JOURNEY_WINDOW.
+    Returns the number of journey entries written.
+    """
+    workers = workers or os.cpu_count() or 1
+    num_shards = num_shards or workers
+
+    user_ranges = partition_users(db_path, num_shards)
+    shard_dir = tempfile.mkdtemp(prefix="journey_shards_", dir=os.path.dirname(os.path.abspath(save_path)))
+    shard_paths = [os.path.join(shard_dir, f"shard_{shard}.jsonl") for shard in range(len(user_ranges))]
+
+    try:
+        with stage('build_journeys_parallel') as record:
+            print(f"Building customer journeys in {len(user_ranges)} shards with {workers} workers...")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(build_shard_journeys, db_path, user_range, shard_path, window)
+                    for user_range, shard_path in zip(user_ranges, shard_paths)
+                ]
+                for shard, future in enumerate(futures):
+                    print(f"Shard {shard + 1}/{len(user_ranges)} done: {future.result()} entries")
+
+            merged = heapq.merge(*(iter_shard_file(path) for path in shard_paths), key=lambda pair: pair[0])
+            written = write_journeys(iter_batches(entry for _, entry in merged), save_path)
+            record['rows_out'] = written
+
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    print(f"✅ {written} customer journey entries saved to {save_path}")
+    return written
+
+if __name__ == "__main__":
+    db_path = "../challenge.db"
+    save_path = "customer_journeys.jsonl"
+    generate_customer_journeys_parallel(db_path, save_path)
@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from customer_journey import (generate_customer_journeys, iter_customer_journeys, JOURNEY_BACKENDS, JOURNEY_WINDOW,
+                              resolve_journey_window)
+from journey_store import iter_journeys, tee_journeys
+from database import get_connection, table_exists
+from change_tracking import table_versions
+from pipelining import iter_in_background, PIPELINE_QUEUE_SIZE
+from send_to_ihc_api import send_to_ihc_api_and_store_results, ATTRIBUTION_BACKENDS, ATTRIBUTION_BACKEND
+from channel_reporting_table import refresh_channel_reporting, check_ihc_sum_condition, check_channel_reporting_query_plan
+from report_export import export_channel_reports, EXPORT_FORMATS
+from instrumentation import configure_logging, write_metrics_on_exit
+
+# Stages of the pipeline, in the order they run
+PIPELINE_STAGES = ['build_journeys', 'attribute', 'report', 'export']
+
+# Progress of every stage, so a rerun skips completed stages whose inputs are unchanged
+CHECKPOINT_PATH = "pipeline_checkpoint.json"
+
+DB_PATH = "../challenge.db"
+JOURNEYS_PATH = "customer_journeys.jsonl"
+OUTPUT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "output"))
+CONV_TYPE_ID = "ihc_challenge"
+
+# Tables each stage reads from the database
+SOURCE_TABLES = ['conversions', 'session_sources']
+REPORT_TABLES = ['conversions', 'session_sources', 'session_costs', 'attribution_customer_journey']
+
+def load_checkpoint(checkpoint_path):
+    """
+    Returns the saved stage states, or an empty checkpoint if there is none yet.
+    """
+    if not os.path.exists(checkpoint_path):
+        return {'stages': {}}
+    with open(checkpoint_path, "r") as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint, checkpoint_path):
+    """
+    Writes the checkpoint under a temporary name and moves it into place, so a crash
+    never leaves a half-written checkpoint behind.
+    """
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+def hash_file(path):
+    """
+    Returns a content hash of a file, or None if it doesn't exist.
+    """
+    if not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def remove_failed_batches(output_dir):
+    """
+    Removes the journeys saved by failed attempts of the attribute stage, once it
+    has completed and every one of them is attributed.
+    """
+    failed_path = os.path.join(output_dir, "failed_batches.jsonl")
+    if os.path.exists(failed_path):
+        os.remove(failed_path)
+
+def hash_inputs(**inputs):
+    """
+    Combines the hashes and settings a stage depends on into one hash.
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def hash_tables(db_path, tables):
+    """
+    Returns the version of each of the given tables (see change_tracking.table_versions),
+    which changes with every write to it. Unlike a content hash it costs nothing on
+    large tables, but a write that leaves the content as it was still counts as a change.
+    """
+    conn = get_connection(db_path)
+    return table_versions(conn.cursor(), tables)
+
+def count_attributed_conversions(db_path):
+    """
+    Returns the number of conversions that already have attribution rows.
+    """
+    conn = get_connection(db_path)
+    if not table_exists(conn, 'attribution_customer_journey'):
+        return 0
+    return conn.execute("SELECT COUNT(DISTINCT conv_id) FROM attribution_customer_journey").fetchone()[0]
+
+def build_and_attribute_journeys(db_path, journeys_path, conv_type_id, engine='sql', window=JOURNEY_WINDOW,
+                                 queue_size=PIPELINE_QUEUE_SIZE, **send_options):
+    """
+    Builds the journeys and attributes them at the same time instead of one stage
+    after the other: journey batches are built (and written to the store at
+    journeys_path) in a background thread and handed over through a queue of
+    queue_size batches, so they are sent while later ones are still being built,
+    and results are committed by send_to_ihc_api's background writer while
+    requests are in flight. send_options are passed on to
+    send_to_ihc_api_and_store_results.
+    Returns the number of journey entries built and the number of failed batches and journeys.
+    """
+    def build_batches():
+        # Runs in the producer thread, over that thread's own connection to db_path
+        conn = get_connection(db_path)
+        yield from tee_journeys(iter_customer_journeys(conn, engine, window=window), journeys_path)
+
+    built = 0
+
+    def built_entries():
+        nonlocal built
+        for batch in iter_in_background(build_batches, queue_size):
+            built += len(batch)
+            yield from batch
+
+    failed = send_to_ihc_api_and_store_results(built_entries(), db_path, conv_type_id, pipelined=True,
+                                               **send_options)
+    print(f"✅ {built} customer journey entries saved to {journeys_path}")
+    return built, failed
+
+def run_stage(checkpoint, checkpoint_path, name, inputs, action, force=False):
+    """
+    Runs one stage unless it already completed with the same inputs and its outputs
+    still exist. action(resuming) does the work and returns the stage outputs (a
+    dict; 'paths' lists the files it wrote). resuming is True when the last run of
+    the stage with the same inputs was interrupted, so it can continue where it stopped.
+    Returns 'skipped', 'resumed' or 'completed'.
+    """
+    state = checkpoint['stages'].get(name)
+    same_inputs = state is not None and state['inputs'] == inputs
+
+    if not force and same_inputs and state['status'] == 'completed':
+        paths = state.get('outputs', {}).get('paths', [])
+        if all(os.path.exists(path) for path in paths):
+            print(f"⏭️ Stage {name}: inputs unchanged since {state['finished_at']}, skipping.")
+            return 'skipped'
+
+    resuming = not force and same_inputs and state['status'] == 'running'
+    print(f"▶️ Stage {name}: {'resuming' if resuming else 'running'}...")
+
+    checkpoint['stages'][name] = {'status': 'running', 'inputs': inputs,
+                                  'started_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    save_checkpoint(checkpoint, checkpoint_path)
+
+    outputs = action(resuming)
+
+    checkpoint['stages'][name].update({'status': 'completed', 'outputs': outputs or {},
+                                       'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    save_checkpoint(checkpoint, checkpoint_path)
+    print(f"✅ Stage {name} completed.")
+    return 'resumed' if resuming else 'completed'
+
+def run_pipeline(db_path=DB_PATH, journeys_path=JOURNEYS_PATH, output_dir=OUTPUT_DIR, stages=PIPELINE_STAGES,
+                 checkpoint_path=CHECKPOINT_PATH, force=False, engine='sql', window=JOURNEY_WINDOW,
+                 conv_type_id=CONV_TYPE_ID, backend=ATTRIBUTION_BACKEND, formats=('csv.gz',),
+                 start_date=None, end_date=None, pipelined=False):
+    """
+    Runs the pipeline stages without prompts:
+      - build_journeys: builds the journey store at journeys_path
+      - attribute: attributes every journey (IHC API or local backend)
+      - report: refreshes channel_reporting, fails on data-quality errors and flags
+        regressions of the aggregation's query plan
+      - export: writes the channel reports to output_dir
+    Each stage is checkpointed in checkpoint_path together with a content hash of
+    its inputs (the tables and files it reads and its settings). A completed stage
+    whose inputs are unchanged is skipped. An interrupted attribute stage resumes
+    batch by batch: conversions that already have attribution rows are not sent again.
+    force=True reruns every selected stage from scratch.
+    With pipelined=True, build_journeys and attribute (if both are selected) run
+    overlapped as one checkpointed step, see build_and_attribute_journeys.
+    Returns the outcome of every selected stage.
+    """
+    for name in stages:
+        if name not in PIPELINE_STAGES:
+            raise ValueError(f"Unknown pipeline stage '{name}'. Choose from {PIPELINE_STAGES}.")
+
+    window = resolve_journey_window(window)
+    checkpoint = load_checkpoint(checkpoint_path)
+    outcomes = {}
+
+    if pipelined and 'build_journeys' in stages and 'attribute' in stages:
+        def build_and_attribute(resuming):
+            built, failed = build_and_attribute_journeys(
+                db_path, journeys_path, conv_type_id, engine, window,
+                failed_path=os.path.join(output_dir, "failed_batches.jsonl"),
+                oversized_path=os.path.join(output_dir, "oversized_journeys.jsonl"),
+                write_mode='upsert' if resuming else 'replace', resume=resuming, backend=backend,
+            )
+            if failed:
+                raise RuntimeError(f"{failed} batches or journeys failed; rerun the pipeline to resume the build_and_attribute stage.")
+            remove_failed_batches(output_dir)
+            return {'entries': built, 'attributed_conversions': count_attributed_conversions(db_path),
+                    'paths': [journeys_path]}
+
+        os.makedirs(output_dir, exist_ok=True)
+        inputs = hash_inputs(tables=hash_tables(db_path, SOURCE_TABLES), window=window,
+                             conv_type_id=conv_type_id, backend=backend)
+        outcome = run_stage(checkpoint, checkpoint_path, 'build_and_attribute', inputs, build_and_attribute, force)
+        outcomes['build_journeys'] = outcomes['attribute'] = outcome
+        stages = [name for name in stages if name not in ('build_journeys', 'attribute')]
+
+    if 'build_journeys' in stages:
+        def build(resuming):
+            written = generate_customer_journeys(db_path, journeys_path, engine=engine, window=window)
+            return {'entries': written, 'paths': [journeys_path]}
+
+        inputs = hash_inputs(tables=hash_tables(db_path, SOURCE_TABLES), window=window)
+        outcomes['build_journeys'] = run_stage(checkpoint, checkpoint_path, 'build_journeys', inputs, build, force)
+
+    if 'attribute' in stages:
+        def attribute(resuming):
+            if resuming:
+                print(f"{count_attributed_conversions(db_path)} conversions were attributed before the interruption.")
+            failed = send_to_ihc_api_and_store_results(
+                iter_journeys(journeys_path), db_path, conv_type_id,
+                failed_path=os.path.join(output_dir, "failed_batches.jsonl"),
+                oversized_path=os.path.join(output_dir, "oversized_journeys.jsonl"),
+                write_mode='upsert' if resuming else 'replace', resume=resuming, backend=backend,
+            )
+            if failed:
+                raise RuntimeError(f"{failed} batches or journeys failed; rerun the pipeline to resume the attribute stage.")
+            remove_failed_batches(output_dir)
+            return {'attributed_conversions': count_attributed_conversions(db_path)}
+
+        os.makedirs(output_dir, exist_ok=True)
+        inputs = hash_inputs(journeys=hash_file(journeys_path), conv_type_id=conv_type_id, backend=backend)
+        outcomes['attribute'] = run_stage(checkpoint, checkpoint_path, 'attribute', inputs, attribute, force)
+
+    if 'report' in stages:
+        def report(resuming):
+            refresh_channel_reporting(db_path)
+            validation = check_ihc_sum_condition(db_path)
+            if validation is None or not validation['passed']:
+                raise ValueError("Attribution data-quality checks failed, see the report above.")
+            # A slower plan doesn't make the report wrong, so plan problems are flagged, not fatal
+            plan_problems = check_channel_reporting_query_plan(db_path)
+            return {'total_rows': validation['total_rows'], 'query_plan_problems': plan_problems}
+
+        inputs = hash_inputs(tables=hash_tables(db_path, REPORT_TABLES))
+        outcomes['report'] = run_stage(checkpoint, checkpoint_path, 'report', inputs, report, force)
+
+    if 'export' in stages:
+        def export(resuming):
+            paths = export_channel_reports(db_path, output_dir, formats=formats,
+                                           start_date=start_date, end_date=end_date)
+            return {'paths': paths}
+
+        inputs = hash_inputs(tables=hash_tables(db_path, ['channel_reporting']), formats=list(formats),
+                             start_date=start_date, end_date=end_date, output_dir=os.path.abspath(output_dir))
+        outcomes['export'] = run_stage(checkpoint, checkpoint_path, 'export', inputs, export, force)
+
+    return outcomes
+
+def main(argv=None):
+    """
+    Command line entry point, e.g.
+        python pipeline_runner.py --stages attribute report --backend local
+    """
+    parser = argparse.ArgumentParser(description="Runs the attribution pipeline with checkpoints.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database")
+    parser.add_argument("--journeys", default=JOURNEYS_PATH, help="journey store (JSON Lines)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="directory for reports and failed batches")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="checkpoint file")
+    parser.add_argument("--stages", nargs="+", default=PIPELINE_STAGES, choices=PIPELINE_STAGES)
+    parser.add_argument("--force", action="store_true", help="rerun the selected stages from scratch")
+    parser.add_argument("--engine", default='sql', choices=JOURNEY_BACKENDS)
+    parser.add_argument("--lookback-days", type=float, default=JOURNEY_WINDOW['lookback_days'])
+    parser.add_argument("--max-sessions", type=int, default=JOURNEY_WINDOW['max_sessions'])
+    parser.add_argument("--exclude-previous-conversion", action="store_true",
+                        default=JOURNEY_WINDOW['exclude_previous_conversion'])
+    parser.add_argument("--conv-type-id", default=CONV_TYPE_ID)
+    parser.add_argument("--backend", default=ATTRIBUTION_BACKEND, choices=ATTRIBUTION_BACKENDS)
+    parser.add_argument("--formats", nargs="+", default=['csv.gz'], choices=EXPORT_FORMATS)
+    parser.add_argument("--start-date", help="first report date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="last report date (YYYY-MM-DD)")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="build and attribute journeys overlapped, with bounded queues in between")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    write_metrics_on_exit()
+
+    window = {
+        'lookback_days': args.lookback_days,
+        'max_sessions': args.max_sessions,
+        'exclude_previous_conversion': args.exclude_previous_conversion,
+    }
+    try:
+        outcomes = run_pipeline(args.db, args.journeys, args.output_dir, args.stages, args.checkpoint,
+                                args.force, args.engine, window, args.conv_type_id, args.backend,
+                                tuple(args.formats), args.start_date, args.end_date, args.pipelined)
+    except Exception as e:
+        print(f"❌ Pipeline stopped: {e}")
+        return 1
+
+    print("🏁 Pipeline finished: " + ", ".join(f"{name} {outcome}" for name, outcome in outcomes.items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import queue
+import threading
+
+# Items (journey batches or API responses) held between two overlapping steps.
+# A full queue blocks the faster step, so memory stays bounded.
+PIPELINE_QUEUE_SIZE = 8
+
+_DONE = object()
+
+def iter_in_background(produce, max_items=PIPELINE_QUEUE_SIZE):
+    """
+    Calls produce() in a background thread and yields the items of the iterable it
+    returns, with at most max_items of them waiting in between. produce runs in the
+    background thread, so it can use its own SQLite connection (see
+    database.get_connection). An error of the producer is re-raised in the consumer;
+    a consumer that stops early stops the producer.
+    """
+    items = queue.Queue(max_items)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in produce():
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+
+    thread = threading.Thread(target=run, name="pipeline-producer", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+class BackgroundWriter:
+    """
+    Calls write(item) from one background thread for every item put on it, with at
+    most max_items waiting, so the caller can go on while items are written. write
+    runs in the writer thread and should use that thread's SQLite connection.
+    After a failed write the remaining items are dropped and the error is re-raised
+    by the next put or by close.
+    """
+
+    def __init__(self, write, max_items=PIPELINE_QUEUE_SIZE):
+        self.write = write
+        self.items = queue.Queue(max_items)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="pipeline-writer", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is _DONE:
+                return
+            if self.error is None:
+                try:
+                    self.write(item)
+                except BaseException as e:
+                    self.error = e
+
+    def put(self, item):
+        """
+        Queues an item, blocking while max_items are already waiting.
+        """
+        if self.error is not None:
+            raise self.error
+        self.items.put(item)
+
+    def close(self):
+        """
+        Waits until every queued item is written and stops the writer thread.
+        """
+        self.items.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
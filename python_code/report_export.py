@@ -0,0 +1,138 @@
+import os
+import shutil
+import pandas as pd
+from database import get_connection, ensure_indexes
+from channel_reporting_excel import add_cpo_roas, build_channel_reporting_query
+from instrumentation import stage
+
+GRANULARITIES = ('day', 'week', 'month')
+EXPORT_FORMATS = ('parquet', 'csv.gz', 'excel')
+METRICS = ['cost', 'ihc', 'ihc_revenue']
+
+def period_start(dates, granularity):
+    """
+    Maps 'YYYY-MM-DD' date strings to the first day of their day, week (Monday) or month.
+    """
+    if granularity == 'day':
+        return dates
+    if granularity == 'month':
+        return dates.str[:7] + '-01'
+
+    parsed = pd.to_datetime(dates)
+    return (parsed - pd.to_timedelta(parsed.dt.dayofweek, unit='D')).dt.strftime('%Y-%m-%d')
+
+def rollup(rows, granularity):
+    """
+    Sums the daily report rows per channel and period. The period start is stored in `date`.
+    """
+    rows = rows.assign(date=period_start(rows['date'], granularity))
+    if granularity == 'day':
+        return rows[['channel_name', 'date'] + METRICS]
+    return rows.groupby(['channel_name', 'date'], as_index=False)[METRICS].sum()
+
+def write_parquet_partitioned(rows, root_path):
+    """
+    Appends rows to a Parquet dataset at root_path, partitioned by month.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow: pip install pyarrow")
+
+    table = pa.Table.from_pandas(rows.assign(month=rows['date'].str[:7]), preserve_index=False)
+    pq.write_to_dataset(table, root_path, partition_cols=['month'])
+
+def write_report(rows, output_dir, granularity, formats, started):
+    """
+    Writes (a chunk of) a finished rollup in every requested file format.
+    started holds the CSV paths already written to, so later chunks are appended.
+    """
+    if 'parquet' in formats:
+        write_parquet_partitioned(rows, os.path.join(output_dir, f"channel_reporting_{granularity}"))
+
+    if 'csv.gz' in formats:
+        csv_path = os.path.join(output_dir, f"channel_reporting_{granularity}.csv.gz")
+        first_chunk = csv_path not in started
+        rows.to_csv(csv_path, index=False, mode="w" if first_chunk else "a", header=first_chunk)
+        started.add(csv_path)
+
+def export_channel_reports(db_path, output_dir, formats=('csv.gz',), granularities=GRANULARITIES,
+                           start_date=None, end_date=None, chunksize=100000):
+    """
+    Exports channel_reporting as channel x day/week/month rollups in one pass over the table.
+    The daily rows are read chunksize at a time: daily output is written as it is
+    read, while week and month partial sums are collected per chunk and combined
+    at the end, so only the (small) rollups are held in memory. CPO and ROAS are
+    computed from the summed cost, ihc and ihc_revenue of each period.
+    formats: 'parquet' (one dataset per granularity, partitioned by month),
+    'csv.gz' (one file per granularity) and 'excel' (one workbook, one sheet per
+    granularity; keeps the daily rows in memory).
+    Returns the list of written paths.
+    """
+    for name in formats:
+        if name not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{name}'. Choose from {EXPORT_FORMATS}.")
+    for granularity in granularities:
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}'. Choose from {GRANULARITIES}.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    excel = 'excel' in formats
+
+    # Parquet datasets are appended to chunk by chunk, so start from empty ones
+    if 'parquet' in formats:
+        for granularity in granularities:
+            shutil.rmtree(os.path.join(output_dir, f"channel_reporting_{granularity}"), ignore_errors=True)
+
+    conn = get_connection(db_path)
+    ensure_indexes(conn, ['idx_channel_reporting_date'])
+    conn.commit()
+
+    query, params = build_channel_reporting_query(start_date, end_date)
+    partials = {granularity: [] for granularity in granularities if granularity != 'day'}
+    excel_days = []
+    started = set()
+
+    with stage('export_reports') as record:
+        record['rows_in'] = 0
+        for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+            record['rows_in'] += len(chunk)
+            for granularity in partials:
+                partials[granularity].append(rollup(chunk, granularity))
+
+            if 'day' in granularities:
+                days = add_cpo_roas(rollup(chunk, 'day'))
+                write_report(days, output_dir, 'day', formats, started)
+                if excel:
+                    excel_days.append(days)
+
+    reports = {'day': pd.concat(excel_days, ignore_index=True)} if excel_days else {}
+    for granularity, frames in partials.items():
+        if not frames:
+            continue
+        combined = pd.concat(frames, ignore_index=True)
+        combined = add_cpo_roas(combined.groupby(['channel_name', 'date'], as_index=False)[METRICS].sum())
+        write_report(combined, output_dir, granularity, formats, started)
+        reports[granularity] = combined
+
+    written = sorted(started)
+    if 'parquet' in formats:
+        written += [os.path.join(output_dir, f"channel_reporting_{g}") for g in granularities]
+
+    if excel and reports:
+        excel_path = os.path.join(output_dir, "channel_reporting.xlsx")
+        with pd.ExcelWriter(excel_path) as writer:
+            for granularity in granularities:
+                if granularity in reports:
+                    reports[granularity].to_excel(writer, sheet_name=granularity, index=False)
+        written.append(excel_path)
+
+    for path in written:
+        print(f"✅ Report written to {path}")
+    return written
+
+if __name__ == "__main__":
+    db_path = "../challenge.db"  # Adjust path if needed
+    output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "output"))
+    export_channel_reports(db_path, output_dir, formats=('csv.gz',))
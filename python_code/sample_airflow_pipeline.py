@@ -1,12 +1,27 @@
-import sqlite3
 import os
-import json
-from send_to_ihc_api import send_to_ihc_api_and_store_results  # Importing the function from send_to_ihc.py
-from channel_reporting_excel import main as channel_reporting_main
-from channel_reporting_table import populate_channel_reporting, check_ihc_sum_condition, check_channel_reporting_table_exists, check_table_exists, get_customer_journeys
 from airflow import DAG
 from airflow.operators.python import PythonOperator
 from datetime import datetime
+from parallel_journeys import partition_users, build_shard_journeys, iter_shard_file
+from send_to_ihc_api import send_to_ihc_api_and_store_results
+from attribution_customer_journey import delete_unlisted_attributions
+from channel_reporting_table import refresh_channel_reporting, check_ihc_sum_condition
+from report_export import export_channel_reports
+
+DB_PATH = "../challenge.db"
+CONV_TYPE_ID = "ihc_challenge"
+
+# Journeys are built into one JSON Lines file per user shard in JOURNEY_STORE_DIR.
+# Users are split into NUM_SHARDS ranges of user ids once, by the partition task.
+# Tasks only exchange shard ids, user id ranges and file paths; the journeys never
+# go through XCom.
+JOURNEY_STORE_DIR = "journey_store"
+NUM_SHARDS = 8
+
+# Shards sent to the API at the same time; every send task writes to the same SQLite file
+MAX_PARALLEL_SENDS = 2
+
+REPORT_OUTPUT_DIR = "../output"
 
 # Set up the DAG
 default_args = {
@@ -22,76 +37,117 @@ dag = DAG(
     schedule_interval=None,  # Set to None or a schedule as needed
 )
 
-def load_customer_journeys(**kwargs):
-    save_path = "customer_journeys.json"
-    db_path = "../challenge.db"
-    
-    if os.path.exists(save_path):
-        print(f"Customer journeys already exist in {save_path}, proceeding with next steps...")
-        with open(save_path, "r") as f:
-            journeys = json.load(f)
-        kwargs['ti'].xcom_push(key='journeys', value=journeys)  # Push to XCom for next tasks
-    else:
-        print("Customer journeys not found. Generating journeys first...")
-        journeys = get_customer_journeys(db_path, save_path)
-        kwargs['ti'].xcom_push(key='journeys', value=journeys)  # Push to XCom for next tasks
-
-def check_channel_reporting_table(db_path, **kwargs):
-    if check_channel_reporting_table_exists(db_path):
-        print("Channel Reporting table exists, proceeding with CSV file generation...")
-        check_ihc_sum_condition(db_path)  # Check the IHC sum condition after populating the channel_reporting table
-        return 'prepare_csv_file'
-    else:
-        if not check_table_exists(db_path, 'attribution_customer_journey'):
-            print("Attribution customer journey table does not exist, sending customer data to IHC API...")
-            journeys = kwargs['ti'].xcom_pull(key='journeys', task_ids='load_customer_journeys')
-            send_to_ihc_api_and_store_results(journeys, db_path, conv_type_id="ihc_challenge")
-            populate_channel_reporting(db_path)
-            return 'populate_channel_reporting'
-        else:
-            print("Attribution customer journey table exists, populating channel reporting table...")
-            populate_channel_reporting(db_path)
-            check_ihc_sum_condition(db_path)
-            return 'prepare_csv_file'
-
-def prepare_csv_file(**kwargs):
-    print("📝 Continuing with preparing the CSV file...")
-    channel_reporting_main()  # Execute the main function from channel_reporting_excel.py  
-
-def populate_channel_reporting_table(**kwargs):
-    print("Populating channel reporting table...")
-    populate_channel_reporting("../challenge.db")
-
-# Define the tasks
-load_journeys_task = PythonOperator(
-    task_id='load_customer_journeys',
-    python_callable=load_customer_journeys,
-    provide_context=True,
+def shard_path(shard):
+    """
+    Path of the journey store file of one user shard.
+    """
+    return os.path.join(JOURNEY_STORE_DIR, f"shard_{shard}_of_{NUM_SHARDS}.jsonl")
+
+def partition_journey_shards(**kwargs):
+    """
+    Splits the users into NUM_SHARDS ranges of user ids and returns the arguments
+    of every build task.
+    """
+    return [{'shard': shard, 'user_range': list(user_range)}
+            for shard, user_range in enumerate(partition_users(DB_PATH, NUM_SHARDS))]
+
+def build_journey_shard(shard, user_range, **kwargs):
+    """
+    Builds the journeys of the users in one shard and returns the path of its store
+    file and its user range, which are the only things passed on to the send task.
+    """
+    os.makedirs(JOURNEY_STORE_DIR, exist_ok=True)
+    path = shard_path(shard)
+    tmp_path = f"{path}.tmp"
+
+    written = build_shard_journeys(DB_PATH, user_range, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"✅ Shard {shard}: {written} journey entries saved to {path}")
+    return [path, user_range]
+
+def send_journey_shard(path, user_range, **kwargs):
+    """
+    Streams one shard's journeys from its store file to the IHC API and upserts
+    the results of every conversion, so journeys changed by late sessions are
+    attributed again. Only a retry of the task skips conversions already
+    attributed, so it just sends what the failed try left.
+    Once every journey is attributed, the attributions of the shard's conversions
+    that no longer have a journey are deleted, and so are the journeys saved by
+    failed tries.
+    """
+    ti = kwargs.get('ti')
+    retrying = ti is not None and ti.try_number > 1
+    failed_path = f"{path}.failed"
+    conv_ids = set()
+
+    def journeys():
+        for _, entry in iter_shard_file(path):
+            conv_ids.add(entry['conversion_id'])
+            yield entry
+
+    failed = send_to_ihc_api_and_store_results(journeys(), DB_PATH, conv_type_id=CONV_TYPE_ID,
+                                               write_mode='upsert', resume=retrying,
+                                               failed_path=failed_path)
+    if failed:
+        raise RuntimeError(f"{failed} batches or journeys of {path} failed, see {failed_path}")
+
+    deleted = delete_unlisted_attributions(DB_PATH, conv_ids, user_range)
+    if deleted:
+        print(f"🗑️ Deleted {deleted} attribution rows of conversions without a journey in {path}")
+    if os.path.exists(failed_path):
+        os.remove(failed_path)
+
+def refresh_channel_reporting_table(**kwargs):
+    print("Refreshing channel reporting table...")
+    refresh_channel_reporting(DB_PATH)
+
+def check_attribution(**kwargs):
+    report = check_ihc_sum_condition(DB_PATH)
+    if report is None or not report['passed']:
+        raise ValueError("Attribution data-quality checks failed.")
+
+def export_reports(**kwargs):
+    print("📝 Exporting channel reports...")
+    export_channel_reports(DB_PATH, REPORT_OUTPUT_DIR, formats=('csv.gz',))
+
+# Define the tasks: the users are partitioned once, then one mapped build and send
+# task runs per user shard
+partition_shards_task = PythonOperator(
+    task_id='partition_journey_shards',
+    python_callable=partition_journey_shards,
     dag=dag,
 )
 
-check_channel_reporting_task = PythonOperator(
-    task_id='check_channel_reporting_table',
-    python_callable=check_channel_reporting_table,
-    op_args=["../challenge.db"],
-    provide_context=True,
+build_journeys_task = PythonOperator.partial(
+    task_id='build_journey_shard',
+    python_callable=build_journey_shard,
+    dag=dag,
+).expand(op_kwargs=partition_shards_task.output)
+
+send_journeys_task = PythonOperator.partial(
+    task_id='send_journey_shard',
+    python_callable=send_journey_shard,
+    max_active_tis_per_dag=MAX_PARALLEL_SENDS,
+    dag=dag,
+).expand(op_args=build_journeys_task.output)
+
+refresh_channel_reporting_task = PythonOperator(
+    task_id='refresh_channel_reporting',
+    python_callable=refresh_channel_reporting_table,
     dag=dag,
 )
 
-prepare_csv_task = PythonOperator(
-    task_id='prepare_csv_file',
-    python_callable=prepare_csv_file,
-    provide_context=True,
+check_attribution_task = PythonOperator(
+    task_id='check_attribution',
+    python_callable=check_attribution,
     dag=dag,
 )
 
-populate_channel_reporting_task = PythonOperator(
-    task_id='populate_channel_reporting',
-    python_callable=populate_channel_reporting_table,
-    provide_context=True,
+export_reports_task = PythonOperator(
+    task_id='export_reports',
+    python_callable=export_reports,
     dag=dag,
 )
 
 # Set task dependencies
-load_journeys_task >> check_channel_reporting_task
-check_channel_reporting_task >> [prepare_csv_task, populate_channel_reporting_task]
+send_journeys_task >> refresh_channel_reporting_task >> check_attribution_task >> export_reports_task
@@ -1,9 +1,15 @@
-import json
-import requests
-import time
 import os
 import dotenv
-from attribution_customer_journey import create_attribution_customer_journey_table, clear_attribution_customer_journey_table, insert_ihc_results
+import pandas as pd
+from journey_store import iter_journeys, append_journeys
+from instrumentation import get_logger, stage, count
+from database import get_connection
+from pipelining import BackgroundWriter, PIPELINE_QUEUE_SIZE
+from batch_packer import iter_conversion_journeys
+from attribution_backends import ApiBackend, LocalBackend
+from attribution_batches import iter_attribution_batches
+from ihc_cache import open_ihc_cache, journey_cache_key, get_cached_results, put_cached_results, evict_ihc_cache
+from attribution_customer_journey import create_attribution_customer_journey_table, clear_attribution_customer_journey_table, insert_ihc_results, conversion_is_attributed
 
 # Load environment variables from .env file
 dotenv.load_dotenv()
@@ -11,90 +17,312 @@ dotenv.load_dotenv()
 # Retrieve API key from environment variables
 API_KEY = os.getenv("IHC_API_KEY")
 
-if not API_KEY:
-    raise ValueError("API key not found. Set IHC_API_KEY in .env file.")
-
-print("API key loaded successfully!")  # Optional debugging
+logger = get_logger(__name__)
 
 # Define the API endpoint
 API_URL = "https://api.ihc-attribution.com/v1/compute_ihc"
 
+# Where attributions are computed: 'api' (the IHC API) or 'local' (local_attribution.py,
+# a position/engagement-based model computed offline, for backfills and what-if analyses)
+ATTRIBUTION_BACKENDS = ('api', 'local')
+ATTRIBUTION_BACKEND = 'api'
+
 # Define the maximum size of chunks to send to the API (based on API limits)
 MAX_JOURNEYS_PER_REQUEST = 100  # Maximum 100 customer journeys per request
 MAX_SESSIONS_PER_REQUEST = 2000  # Maximum 200 sessions per request (to comply with free-tier limit)
 
-def send_to_ihc_api_and_store_results(journeys, db_path, conv_type_id):
+# Client settings: parallel requests, request rate and retries on 429/5xx
+MAX_CONCURRENT_REQUESTS = 4
+REQUESTS_PER_SECOND = 5
+MAX_RETRIES = 5
+
+# Journey entries of batches that still failed after all retries, for a later rerun
+FAILED_BATCHES_PATH = "failed_batches.jsonl"
+
+# Journeys with more sessions than MAX_SESSIONS_PER_REQUEST: 'skip', 'truncate' or 'raise'.
+# They are saved to OVERSIZED_JOURNEYS_PATH in the directory of the failed batches.
+OVERSIZED_JOURNEY_POLICY = 'skip'
+OVERSIZED_JOURNEYS_PATH = "oversized_journeys.jsonl"
+
+# Local cache of API results per journey; set IHC_CACHE_PATH to None to always call the API
+IHC_CACHE_PATH = "ihc_cache.db"
+IHC_CACHE_MAX_AGE_DAYS = 30
+IHC_CACHE_MAX_BYTES = 1024 ** 3
+
+# Read every row back after inserting
+VERIFY_INSERTS = False
+
+# Write results from a background thread while the next requests are in flight
+PIPELINED_WRITES = False
+
+def create_attribution_backend(backend, conv_type_id, api_url=API_URL, max_workers=MAX_CONCURRENT_REQUESTS,
+                               requests_per_second=REQUESTS_PER_SECOND):
+    """
+    Returns the attribution backend (see attribution_backends.py) named `backend`:
+    'api' sends requests of at most MAX_JOURNEYS_PER_REQUEST journeys and
+    MAX_SESSIONS_PER_REQUEST sessions to api_url with API_KEY, 'local' computes
+    attributions offline.
+    """
+    if backend not in ATTRIBUTION_BACKENDS:
+        raise ValueError(f"Unknown attribution backend '{backend}'. Choose from {ATTRIBUTION_BACKENDS}.")
+
+    if backend == 'local':
+        return LocalBackend()
+
+    api_backend = ApiBackend(api_url, conv_type_id, API_KEY, MAX_JOURNEYS_PER_REQUEST, MAX_SESSIONS_PER_REQUEST,
+                             max_workers, requests_per_second, MAX_RETRIES)
+    print("API key loaded successfully!")  # Optional debugging
+    return api_backend
+
+class ResultWriter:
+    """
+    Stores attribution responses with insert_ihc_results. With pipelined=True they
+    are handed to a background writer through a queue of PIPELINE_QUEUE_SIZE
+    responses and committed by it, so storing one batch doesn't hold up sending
+    the next ones; a full queue slows sending down to the write rate.
+    """
+
+    def __init__(self, db_path, pipelined=False):
+        self.db_path = db_path
+        self.conn = get_connection(db_path)
+        self.writer = BackgroundWriter(self.write, PIPELINE_QUEUE_SIZE) if pipelined else None
+
+    def write(self, response_data):
+        # Runs in the writer thread, over that thread's own connection to db_path
+        insert_ihc_results(response_data, self.db_path, verify=VERIFY_INSERTS)
+
+    def put(self, response_data):
+        if self.writer is not None:
+            self.writer.put(response_data)
+        else:
+            insert_ihc_results(response_data, conn=self.conn, verify=VERIFY_INSERTS)
+
+    def close(self):
+        """
+        Waits until every response is stored.
+        """
+        if self.writer is not None:
+            self.writer.close()
+
+def send_to_ihc_api_and_store_results(journeys, db_path, conv_type_id, api_url=API_URL,
+                                      max_workers=MAX_CONCURRENT_REQUESTS,
+                                      requests_per_second=REQUESTS_PER_SECOND,
+                                      failed_path=FAILED_BATCHES_PATH, write_mode='upsert', resume=False,
+                                      oversized=OVERSIZED_JOURNEY_POLICY, cache_path=IHC_CACHE_PATH,
+                                      backend=ATTRIBUTION_BACKEND, pipelined=PIPELINED_WRITES,
+                                      oversized_path=None):
+    """
+    Sends journey entries to the IHC API in batches, or with backend='local'
+    computes their attributions offline, and stores the results.
+    api_url, max_workers and requests_per_second configure the API backend (see
+    create_attribution_backend); the other options are those of attribute_journeys.
+    Returns the number of failed batches plus the number of journeys without results.
+    """
+    attribution_backend = create_attribution_backend(backend, conv_type_id, api_url, max_workers,
+                                                     requests_per_second)
+    return attribute_journeys(journeys, db_path, conv_type_id, attribution_backend, failed_path=failed_path,
+                              write_mode=write_mode, resume=resume, oversized=oversized,
+                              cache_path=cache_path, pipelined=pipelined, oversized_path=oversized_path)
+
+def attribute_journeys(journeys, db_path, conv_type_id, backend, failed_path=FAILED_BATCHES_PATH,
+                       write_mode='upsert', resume=False, oversized=OVERSIZED_JOURNEY_POLICY,
+                       cache_path=IHC_CACHE_PATH, pipelined=PIPELINED_WRITES, oversized_path=None):
+    """
+    Attributes journey entries with backend (attribution_backends.py) and stores the
+    results in attribution_customer_journey.
+    journeys can be a list or any iterable, e.g. journey_store.iter_journeys, in which
+    case only the batches in flight are held in memory, or a compact journey frame
+    (journey_frame.py). They are split into batches of whole journeys within the
+    backend's limits by attribution_batches.iter_attribution_batches; journeys over
+    the session limit are handled according to `oversized` and saved to
+    oversized_path (by default OVERSIZED_JOURNEYS_PATH next to failed_path).
+    Journeys whose results are in the cache at cache_path are stored without
+    attributing them again, and the results of a cacheable backend are added to
+    the cache. Entries of batches that fail are appended to failed_path for a
+    later rerun.
+    With write_mode='upsert' results are upserted on (conv_id, session_id), so a
+    rerun only rewrites the conversions it reprocesses; write_mode='replace' clears
+    the table first. With resume=True, conversions that already have attribution
+    rows are skipped, so a rerun after a crash only sends the remaining work.
+    With pipelined=True results are committed by a background writer (see ResultWriter).
+    Conversions missing from a successful response count as failed too: their
+    journeys are not cached and are appended to failed_path.
+    Returns the number of failed batches plus the number of journeys without results,
+    including the oversized journeys that were skipped.
+    """
+    if write_mode not in ('upsert', 'replace'):
+        raise ValueError(f"Unknown write mode '{write_mode}'. Choose 'upsert' or 'replace'.")
+
+    if not backend.cacheable:
+        cache_path = None
+
     # Create table if it doesn't exist
     create_attribution_customer_journey_table(db_path)
 
     # Clear the table before inserting new data
-    clear_attribution_customer_journey_table(db_path)
+    if write_mode == 'replace':
+        clear_attribution_customer_journey_table(db_path)
 
-    if not journeys:
-        print("No customer journeys found to process.")
-        return
+    print("Sending customer journeys to IHC API..." if backend.name == 'api' else "Computing attributions locally...")
+
+    if oversized_path is None:
+        oversized_path = os.path.join(os.path.dirname(failed_path), OVERSIZED_JOURNEYS_PATH)
+
+    counts = {'batches': 0, 'sessions': 0, 'cached': 0, 'resumed': 0, 'skipped': 0}
+
+    cache = open_ihc_cache(cache_path) if cache_path else None
+    conn = get_connection(db_path)
+    results = ResultWriter(db_path, pipelined)
+    cache_hits = []
+
+    def is_attributed(journey):
+        if conversion_is_attributed(conn, journey[0]['conversion_id']):
+            counts['resumed'] += len(journey)
+            return True
+        return False
 
-    print(f"Sending {len(journeys)} customer journeys to IHC API...")
+    # Cache keys of the journeys sent, by conversion. They are computed from the journey
+    # as read, so results of a journey truncated to fit a request are stored under the
+    # key the next run looks up.
+    cache_keys = {}
 
-    # Prepare the data in the required format
-    data_to_send = []
+    def is_cached(journey):
+        cache_key = journey_cache_key(journey, conv_type_id)
+        cached_results = get_cached_results(cache, cache_key)
+        if cached_results is None:
+            cache_keys[journey[0]['conversion_id']] = cache_key
+            return False
 
-    for journey in journeys:
-        # Removing any unnecessary fields (e.g., 'impression_interaction') from the journey
-        data_to_send.append(journey)
+        counts['cached'] += len(journey)
+        cache_hits.extend(cached_results)
+        if len(cache_hits) >= MAX_SESSIONS_PER_REQUEST:
+            results.put({'value': cache_hits[:]})
+            cache_hits.clear()
+        return True
 
-    # Ensure the body is a list of dictionaries
-    if not isinstance(data_to_send, list) or not all(isinstance(item, dict) for item in data_to_send):
-        print("Error: Data must be a list of dictionaries.")
-        return
+    checks = []
+    if resume:
+        if isinstance(journeys, pd.DataFrame):
+            # Skips attributed conversions on the whole frame, so its batches are sliced full
+            attributed = [conversion_id for conversion_id in journeys['conversion_id'].unique()
+                          if conversion_is_attributed(conn, conversion_id)]
+            skipped = journeys['conversion_id'].isin(attributed)
+            counts['resumed'] += int(skipped.sum())
+            journeys = journeys[~skipped]
+        else:
+            checks.append(is_attributed)
+    if cache is not None:
+        checks.append(is_cached)
 
-    api_url = f"https://api.ihc-attribution.com/v1/compute_ihc?conv_type_id={conv_type_id}"
+    def skip_journey(journey):
+        return any(check(journey) for check in checks)
 
-    # Send requests in batches
-    customer_journey_batches = [data_to_send[i:i + MAX_JOURNEYS_PER_REQUEST]
-                                for i in range(0, len(data_to_send), MAX_JOURNEYS_PER_REQUEST)]
+    def save_oversized(journey):
+        if oversized == 'skip':
+            counts['skipped'] += 1
+        append_journeys([journey], oversized_path)
 
-    for batch_idx, batch in enumerate(customer_journey_batches):
-        print(f"Processing batch {batch_idx + 1}/{len(customer_journey_batches)} - Total journeys: {len(batch)}")
+    def counted_batches():
+        for batch in iter_attribution_batches(journeys, backend.limits, oversized, save_oversized,
+                                              skip_journey if checks else None):
+            counts['batches'] += 1
+            counts['sessions'] += len(batch)
+            yield batch
+        # Cache hits of the last journeys, stored before the backend reports back
+        if cache_hits:
+            results.put({'value': cache_hits[:]})
+            cache_hits.clear()
 
-        # Body with customer journeys
-        body = {
-            'customer_journeys': batch
-        }
+    # Journeys of successful batches that got no result rows, as (batch_idx, journey, error)
+    unattributed = []
 
-        headers = {
-            'Content-Type': 'application/json',
-            'x-api-key': API_KEY
-        }
+    def store_result(batch_idx, batch, response_data):
+        logger.debug(f"Successfully sent batch {batch_idx + 1} - Total sessions: {len(batch)}")
+        results.put(response_data)
 
-        # Send the request
+        results_by_conversion = {}
+        for result in response_data.get("value", []):
+            results_by_conversion.setdefault(result.get("conversion_id"), []).append(result)
+
+        cached = []
+        for journey in iter_conversion_journeys(batch):
+            conversion_id = journey[0]['conversion_id']
+            cache_key = cache_keys.pop(conversion_id, None)
+            if conversion_id not in results_by_conversion:
+                # Not cached either, so the journey is sent again on the next run
+                unattributed.append((batch_idx, journey, f"No results for conversion {conversion_id}"))
+            elif cache_key is not None:
+                cached.append((cache_key, results_by_conversion[conversion_id]))
+
+        if cache is not None:
+            put_cached_results(cache, cached, conv_type_id)
+
+    with stage('attribute') as record:
         try:
-            response = requests.post(api_url, data=json.dumps(body), headers=headers)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-
-            if response.status_code == 200:
-                print(f"Successfully sent batch {batch_idx + 1} of {len(customer_journey_batches)} to IHC API")
-                response_data = response.json()
-                insert_ihc_results(response_data, db_path)
-            else:
-                print(f"Error sending data: {response.status_code} - {response.text}")
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {e}")
-        
-        # Optional: Add delay to avoid rate-limiting
-        #time.sleep(5)  
-
-    print("All customer journeys sent to IHC API!")
+            failed = backend.send(counted_batches(), store_result)
+        finally:
+            results.close()
+        record['rows_in'] = counts['sessions'] + counts['cached'] + counts['resumed']
+        record['rows_out'] = (counts['sessions'] + counts['cached']
+                              - sum(len(batch) for _, batch, _ in failed + unattributed))
+
+    count('ihc_api_batches' if backend.name == 'api' else 'local_attribution_batches', counts['batches'])
+    count('ihc_api_batches_failed', len(failed))
+    count('unattributed_journeys', len(unattributed))
+    count('ihc_cache_hit_sessions', counts['cached'])
+    count('resumed_sessions', counts['resumed'])
+    count('oversized_journeys_skipped', counts['skipped'])
+
+    if cache is not None:
+        cache.commit()
+        evict_ihc_cache(cache, IHC_CACHE_MAX_AGE_DAYS, IHC_CACHE_MAX_BYTES)
+        cache.close()
+
+    return report_attribution(backend, counts, failed, unattributed, failed_path, oversized_path)
+
+def report_attribution(backend, counts, failed, unattributed, failed_path, oversized_path):
+    """
+    Prints a summary of an attribution run and appends the journeys of failed
+    batches and of conversions without results to failed_path.
+    Returns the number of failed batches plus the number of journeys without results
+    or skipped as oversized.
+    """
+    if counts['cached']:
+        print(f"♻️ {counts['cached']} sessions were attributed from the IHC cache.")
+
+    if counts['resumed']:
+        print(f"⏭️ {counts['resumed']} sessions of already attributed conversions were skipped.")
+
+    if counts['sessions'] + counts['cached'] + counts['resumed'] + counts['skipped'] == 0:
+        print("No customer journeys found to process.")
+        return 0
+
+    if failed:
+        append_journeys((batch for _, batch, _ in failed), failed_path)
+        print(f"⚠️ {len(failed)} of {counts['batches']} batches failed, their journeys were saved to {failed_path}")
+    if unattributed:
+        append_journeys((journey for _, journey, _ in unattributed), failed_path)
+        print(f"⚠️ {len(unattributed)} journeys got no results, they were saved to {failed_path}")
+    if counts['skipped']:
+        print(f"⚠️ {counts['skipped']} oversized journeys were skipped, they were saved to {oversized_path}")
+    if not failed and not unattributed and not counts['skipped'] and counts['batches']:
+        if backend.name == 'local':
+            print(f"All {counts['sessions']} sessions attributed locally in {counts['batches']} batches!")
+        else:
+            print(f"All {counts['sessions']} sessions sent to IHC API in {counts['batches']} batches!")
+
+    return len(failed) + len(unattributed) + counts['skipped']
 
 # Example usage
 if __name__ == "__main__":
     db_path = "../challenge.db"  # Adjust path if needed
     conv_type_id = 'ihc_challenge'  # Insert your conversion type ID here
 
-    # Assuming you fetch the customer journeys somehow (not defined in this code)
-    journeys = []  # Put your actual method to fetch customer journeys here
-
-    if journeys:
-        send_to_ihc_api_and_store_results(journeys, db_path, conv_type_id)
+    # Resend the journeys of batches that failed in an earlier run
+    if os.path.exists(FAILED_BATCHES_PATH):
+        retry_path = f"{FAILED_BATCHES_PATH}.retry"
+        os.replace(FAILED_BATCHES_PATH, retry_path)
+        send_to_ihc_api_and_store_results(iter_journeys(retry_path), db_path, conv_type_id)
+        os.remove(retry_path)
     else:
-        print("No journeys to process.")
+        print("No failed batches to resend.")
@@ -0,0 +1,176 @@
+import argparse
+import json
+from customer_journey import JOURNEY_ENTRY_KEYS, JOURNEY_WINDOW, resolve_journey_window, journey_window_sql
+from database import get_connection, ensure_indexes
+from change_tracking import install_triggers
+from instrumentation import stage
+
+# Copy of session_sources stored clustered on (user_id, timestamp), so the sessions
+# of one user before a point in time are one contiguous range of the table.
+# session_rowid orders sessions with equal timestamps like the journey builders do.
+SESSION_INDEX_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS user_session_index (
+        user_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        session_rowid INTEGER NOT NULL,
+        session_id TEXT NOT NULL,
+        channel_label TEXT NOT NULL,
+        holder_engagement INTEGER NOT NULL,
+        closer_engagement INTEGER NOT NULL,
+        impression_interaction INTEGER NOT NULL,
+        PRIMARY KEY(user_id, timestamp, session_rowid)
+    ) WITHOUT ROWID
+"""
+
+SESSION_INDEX_KEYS = ['session_id', 'timestamp', 'channel_label', 'holder_engagement',
+                      'closer_engagement', 'impression_interaction']
+
+# Statements the triggers on session_sources run for the OLD and/or NEW row.
+# Rows are removed by session_id: an INSERT OR REPLACE deletes the session it
+# replaces without firing the DELETE trigger, so the insert removes it instead.
+SESSION_INDEX_STATEMENTS = {
+    "OLD": """
+        DELETE FROM user_session_index WHERE session_id = OLD.session_id;
+    """,
+    "NEW": """
+        DELETE FROM user_session_index WHERE session_id = NEW.session_id;
+        INSERT OR REPLACE INTO user_session_index
+        VALUES (NEW.user_id, NEW.event_date || ' ' || NEW.event_time, NEW.rowid, NEW.session_id,
+                NEW.channel_name, NEW.holder_engagement, NEW.closer_engagement, NEW.impression_interaction);
+    """,
+}
+
+def install_session_index_triggers(cursor):
+    """
+    Creates the triggers that keep user_session_index in step with every insert,
+    replace, update and delete in session_sources, replacing those of earlier versions.
+    Returns True if any trigger was missing or outdated, in which case changes may
+    have gone unrecorded and the index needs a full rebuild.
+    """
+    triggers = {}
+    for event, rows in (("INSERT", ["NEW"]), ("DELETE", ["OLD"]), ("UPDATE", ["OLD", "NEW"])):
+        name = f"trg_usi_session_sources_{event.lower()}"
+        body = "".join(SESSION_INDEX_STATEMENTS[row] for row in rows)
+        triggers[name] = f"CREATE TRIGGER {name} AFTER {event} ON session_sources BEGIN {body} END"
+
+    return install_triggers(cursor, "trg_usi_", triggers)
+
+def ensure_session_index(conn, rebuild=False):
+    """
+    Creates user_session_index and its triggers if needed. The index is filled from
+    session_sources when it is new, when a trigger was missing or with rebuild=True;
+    after that the triggers keep it up to date as sessions arrive, at the cost of
+    one extra row write per session written.
+    Returns True if the index was (re)built.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SESSION_INDEX_TABLE_SQL)
+        ensure_indexes(conn, ['idx_user_session_index_session'])
+        if not install_session_index_triggers(cursor) and not rebuild:
+            conn.commit()
+            return False
+
+        with stage('build_session_index') as record:
+            cursor.execute("DELETE FROM user_session_index")
+            changes = conn.total_changes
+            cursor.execute("""
+                INSERT INTO user_session_index
+                SELECT user_id, event_date || ' ' || event_time, rowid, session_id, channel_name,
+                       holder_engagement, closer_engagement, impression_interaction
+                FROM session_sources
+            """)
+            record['rows_out'] = conn.total_changes - changes
+        conn.commit()
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    print(f"✅ user_session_index built with {record['rows_out']} sessions.")
+    return True
+
+def get_user_sessions(db_path, user_id, before=None):
+    """
+    Returns the sessions of a user in time order, only those strictly before the
+    timestamp `before` ('YYYY-MM-DD HH:MM:SS') if given, as dicts with the keys of
+    SESSION_INDEX_KEYS.
+    """
+    conn = get_connection(db_path)
+    ensure_session_index(conn)
+
+    columns = ", ".join(SESSION_INDEX_KEYS)
+    if before is None:
+        cursor = conn.execute(f"""
+            SELECT {columns} FROM user_session_index
+            WHERE user_id = ?
+            ORDER BY timestamp, session_rowid
+        """, (user_id,))
+    else:
+        cursor = conn.execute(f"""
+            SELECT {columns} FROM user_session_index
+            WHERE user_id = ? AND timestamp < ?
+            ORDER BY timestamp, session_rowid
+        """, (user_id, str(before)))
+
+    return [dict(zip(SESSION_INDEX_KEYS, row)) for row in cursor.fetchall()]
+
+def get_journey(db_path, conv_id, window=JOURNEY_WINDOW):
+    """
+    Returns the journey entries of one conversion, as the journey builders produce
+    them, from a point query on user_session_index instead of a full rebuild.
+    window limits the sessions as in customer_journey.JOURNEY_WINDOW.
+    Returns None if there is no such conversion.
+    """
+    window = resolve_journey_window(window)
+    conn = get_connection(db_path)
+    ensure_session_index(conn)
+
+    window_start, window_params = journey_window_sql(window)
+    cursor = conn.execute(f"""
+        SELECT c.user_id, c.conv_date || ' ' || c.conv_time, {window_start or 'NULL'}
+        FROM conversions c
+        WHERE c.conv_id = ?
+    """, window_params + [conv_id])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    user_id, conv_timestamp, earliest = row
+
+    sessions = get_user_sessions(db_path, user_id, before=conv_timestamp)
+    if earliest is not None:
+        sessions = [session for session in sessions if session['timestamp'] >= earliest]
+    if window['max_sessions'] is not None:
+        sessions = sessions[max(len(sessions) - window['max_sessions'], 0):]
+
+    return [
+        dict(zip(JOURNEY_ENTRY_KEYS, (conv_id, session['session_id'], session['timestamp'], session['channel_label'],
+                                      session['holder_engagement'], session['closer_engagement'], 0,
+                                      session['impression_interaction'])))
+        for session in sessions
+    ]
+
+def main(argv=None):
+    """
+    Command line lookups, e.g.
+        python session_index.py --conv-id <conv_id>
+        python session_index.py --user-id <user_id> --before "2023-09-01 00:00:00"
+    """
+    parser = argparse.ArgumentParser(description="Looks up journeys and user sessions in the session index.")
+    parser.add_argument("--db", default="../challenge.db", help="SQLite database")
+    lookup = parser.add_mutually_exclusive_group(required=True)
+    lookup.add_argument("--conv-id", help="print the journey of this conversion")
+    lookup.add_argument("--user-id", help="print the sessions of this user")
+    lookup.add_argument("--rebuild", action="store_true", help="rebuild the index from session_sources")
+    parser.add_argument("--before", help="only sessions before this timestamp (with --user-id)")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        ensure_session_index(get_connection(args.db), rebuild=True)
+    elif args.conv_id:
+        print(json.dumps(get_journey(args.db, args.conv_id), indent=2))
+    else:
+        print(json.dumps(get_user_sessions(args.db, args.user_id, args.before), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import pandas as pd
+from database import connect, close_connection
+
+# Schema of the challenge database
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "challenge_db_create.sql")
+
+CHANNELS = ["Direct Traffic", "SEA - Brand", "SEA - Non-Brand", "Email", "Social", "Display", "Affiliate"]
+CHANNEL_WEIGHTS = [0.30, 0.20, 0.20, 0.10, 0.10, 0.05, 0.05]
+
+def read_schema(schema_path=SCHEMA_PATH):
+    """
+    Returns the CREATE TABLE statements of challenge_db_create.sql, without the
+    header docstring the file starts with.
+    """
+    with open(schema_path, "r", encoding="utf-8") as f:
+        schema = f.read()
+    return schema.split('"""')[-1]
+
+def random_ids(rng, n):
+    """
+    Returns n random 32 character hex ids, like the hashed ids of the challenge data.
+    """
+    return [raw.hex() for raw in np.frombuffer(rng.bytes(16 * n), dtype="S16")]
+
+def generate_user_chunk(rng, num_users, sessions_per_user, conversions_per_user, start, days, cost_share):
+    """
+    Generates the session_sources, session_costs and conversions rows of num_users users.
+    Session counts per user are 1 + Poisson(sessions_per_user - 1) and conversion counts
+    Poisson(conversions_per_user). Each conversion happens some time after one of its
+    user's sessions, so most conversions have a journey.
+    """
+    span = days * 86400
+    user_ids = np.array(random_ids(rng, num_users), dtype=object)
+
+    session_counts = 1 + rng.poisson(max(sessions_per_user - 1, 0), num_users)
+    num_sessions = int(session_counts.sum())
+    session_offsets = rng.integers(0, span, num_sessions)
+    session_timestamps = start + pd.to_timedelta(session_offsets, unit="s")
+
+    sessions = pd.DataFrame({
+        "session_id": random_ids(rng, num_sessions),
+        "user_id": np.repeat(user_ids, session_counts),
+        "event_date": session_timestamps.strftime("%Y-%m-%d"),
+        "event_time": session_timestamps.strftime("%H:%M:%S"),
+        "channel_name": rng.choice(CHANNELS, num_sessions, p=CHANNEL_WEIGHTS),
+        "holder_engagement": rng.integers(0, 2, num_sessions),
+        "closer_engagement": rng.integers(0, 2, num_sessions),
+        "impression_interaction": rng.integers(0, 2, num_sessions),
+    })
+
+    has_cost = rng.random(num_sessions) < cost_share
+    costs = pd.DataFrame({
+        "session_id": sessions["session_id"][has_cost],
+        "cost": rng.lognormal(-1, 1, int(has_cost.sum())).round(4),
+    })
+
+    # Each conversion follows a random session of its user by an exponential delay (mean 2h)
+    conversion_counts = rng.poisson(conversions_per_user, num_users)
+    num_conversions = int(conversion_counts.sum())
+    first_session = np.concatenate(([0], np.cumsum(session_counts)[:-1]))
+    picked = np.repeat(first_session, conversion_counts) + (
+        rng.random(num_conversions) * np.repeat(session_counts, conversion_counts)
+    ).astype(np.int64)
+    conv_offsets = np.minimum(session_offsets[picked] + 1 + rng.exponential(7200, num_conversions).astype(np.int64), span - 1)
+    conv_timestamps = start + pd.to_timedelta(conv_offsets, unit="s")
+
+    conversions = pd.DataFrame({
+        "conv_id": random_ids(rng, num_conversions),
+        "user_id": np.repeat(user_ids, conversion_counts),
+        "conv_date": conv_timestamps.strftime("%Y-%m-%d"),
+        "conv_time": conv_timestamps.strftime("%H:%M:%S"),
+        "revenue": rng.lognormal(4, 0.8, num_conversions).round(2),
+    })
+
+    return sessions, costs, conversions
+
+def generate_synthetic_db(db_path, num_users=10000, sessions_per_user=5, conversions_per_user=0.3,
+                          days=30, start_date="2023-09-01", cost_share=0.6, seed=42,
+                          users_per_chunk=50000, overwrite=False):
+    """
+    Creates a SQLite database with the schema of challenge_db_create.sql and fills
+    conversions, session_sources and session_costs with random data:
+      - num_users users with on average sessions_per_user sessions and
+        conversions_per_user conversions each
+      - sessions spread uniformly over `days` days from start_date
+      - a cost for a cost_share fraction of the sessions
+    The same arguments and seed always produce the same database. Users are generated
+    users_per_chunk at a time, so memory stays bounded for large databases.
+    Returns the number of rows written per table.
+    """
+    if os.path.exists(db_path):
+        if not overwrite:
+            raise FileExistsError(f"{db_path} already exists. Pass overwrite=True to replace it.")
+        close_connection(db_path)
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start_date)
+    counts = {'session_sources': 0, 'session_costs': 0, 'conversions': 0}
+
+    conn = connect(db_path)
+    try:
+        conn.executescript(read_schema())
+
+        for chunk_start in range(0, num_users, users_per_chunk):
+            chunk_users = min(users_per_chunk, num_users - chunk_start)
+            sessions, costs, conversions = generate_user_chunk(
+                rng, chunk_users, sessions_per_user, conversions_per_user, start, days, cost_share
+            )
+
+            for table, rows in (('session_sources', sessions), ('session_costs', costs), ('conversions', conversions)):
+                placeholders = ", ".join("?" * len(rows.columns))
+                conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})",
+                                 rows.itertuples(index=False, name=None))
+                counts[table] += len(rows)
+
+            conn.commit()
+            print(f"Generated {chunk_start + chunk_users}/{num_users} users...")
+
+    finally:
+        conn.close()
+
+    print(f"✅ Synthetic database written to {db_path}: " +
+          ", ".join(f"{rows} {table}" for table, rows in counts.items()))
+    return counts
+
+if __name__ == "__main__":
+    generate_synthetic_db("synthetic.db", num_users=100000, overwrite=True)
@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import pytest
+
+# The pipeline modules import each other by bare name, as when run from python_code/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_data import generate_synthetic_db
+from database import close_connections
+
+# Small enough to build every journey engine in well under a second, large enough
+# that users have several sessions and conversions
+SYNTHETIC_DB_PARAMS = {
+    'num_users': 80,
+    'sessions_per_user': 6,
+    'conversions_per_user': 1.2,
+    'days': 10,
+    'seed': 7,
+}
+
+@pytest.fixture(scope="session")
+def synthetic_template(tmp_path_factory):
+    """
+    Generates the synthetic database once per test session.
+    """
+    db_path = str(tmp_path_factory.mktemp("template") / "synthetic.db")
+    generate_synthetic_db(db_path, **SYNTHETIC_DB_PARAMS)
+    return db_path
+
+@pytest.fixture
+def db_path(synthetic_template, tmp_path):
+    """
+    A fresh copy of the synthetic database for one test. Connections the test
+    opened are closed afterwards, so the next copy is not served a stale one.
+    """
+    path = str(tmp_path / "challenge.db")
+    shutil.copy(synthetic_template, path)
+    yield path
+    close_connections()
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs the test inside tmp_path, for code that writes files relative to the
+    working directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
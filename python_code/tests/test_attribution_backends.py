@@ -0,0 +1,44 @@
+import pytest
+from attribution_backends import ApiBackend, LocalBackend
+from mock_ihc_server import start_mock_ihc_server
+
+BATCHES = [
+    [{'conversion_id': 'c1', 'session_id': 's1', 'timestamp': '2023-09-01 10:00:00', 'channel_label': 'Email',
+      'holder_engagement': 1, 'closer_engagement': 0, 'conversion': 0, 'impression_interaction': 0},
+     {'conversion_id': 'c1', 'session_id': 's2', 'timestamp': '2023-09-01 11:00:00', 'channel_label': 'SEA',
+      'holder_engagement': 0, 'closer_engagement': 1, 'conversion': 1, 'impression_interaction': 0}],
+    [{'conversion_id': 'c2', 'session_id': 's3', 'timestamp': '2023-09-02 10:00:00', 'channel_label': 'Email',
+      'holder_engagement': 1, 'closer_engagement': 1, 'conversion': 1, 'impression_interaction': 0}],
+]
+
+def attribute(backend):
+    results = {}
+    failed = backend.send(iter(BATCHES), lambda batch_idx, batch, response_data: results.update(
+        {(row['conversion_id'], row['session_id']): row['ihc'] for row in response_data['value']}))
+    return failed, results
+
+def assert_shares_sum_to_one(results):
+    for conversion_id in ('c1', 'c2'):
+        assert sum(ihc for (conv_id, _), ihc in results.items() if conv_id == conversion_id) == pytest.approx(1)
+
+def test_local_backend_attributes_every_batch():
+    failed, results = attribute(LocalBackend())
+
+    assert failed == []
+    assert set(results) == {('c1', 's1'), ('c1', 's2'), ('c2', 's3')}
+    assert_shares_sum_to_one(results)
+
+def test_api_backend_sends_every_batch():
+    server = start_mock_ihc_server()
+    try:
+        failed, results = attribute(ApiBackend(server.url, 'conv', 'test-key', 100, 200, requests_per_second=1000))
+    finally:
+        server.shutdown()
+
+    assert failed == []
+    assert server.requests == len(BATCHES)
+    assert set(results) == {('c1', 's1'), ('c1', 's2'), ('c2', 's3')}
+
+def test_api_backend_needs_an_api_key():
+    with pytest.raises(ValueError, match="API key"):
+        ApiBackend("http://localhost", 'conv', None, 100, 200)
@@ -0,0 +1,59 @@
+import pytest
+from attribution_batches import iter_attribution_batches
+from batch_packer import iter_conversion_journeys
+from customer_journey import get_customer_journeys
+
+def make_entries(session_counts):
+    return [{'conversion_id': conv_id, 'session_id': f"{conv_id}_s{i}"}
+            for conv_id, num_sessions in session_counts.items() for i in range(num_sessions)]
+
+def conversion_ids(batches):
+    return [journey[0]['conversion_id'] for batch in batches for journey in iter_conversion_journeys(batch)]
+
+def test_batches_stay_within_the_limits():
+    session_counts = {f"c{i}": 1 + i % 5 for i in range(40)}
+    batches = list(iter_attribution_batches(make_entries(session_counts), limits=(3, 8)))
+
+    for batch in batches:
+        assert len(list(iter_conversion_journeys(batch))) <= 3
+        assert len(batch) <= 8
+    assert sorted(conversion_ids(batches)) == sorted(session_counts)
+
+def test_unlimited_batches_keep_journey_order():
+    entries = make_entries({f"c{i}": 3 for i in range(10)})
+
+    assert [entry for batch in iter_attribution_batches(entries) for entry in batch] == entries
+
+def test_skipped_journeys_are_left_out():
+    entries = make_entries({'c1': 2, 'c2': 3, 'c3': 1})
+    skip_journey = lambda journey: journey[0]['conversion_id'] == 'c2'
+
+    assert sorted(conversion_ids(iter_attribution_batches(entries, (10, 10), skip_journey=skip_journey))) == ['c1', 'c3']
+    assert conversion_ids(iter_attribution_batches(entries, skip_journey=skip_journey)) == ['c1', 'c3']
+
+def test_oversized_journeys_follow_the_policy():
+    entries = make_entries({'c1': 5, 'c2': 2})
+    oversized = []
+
+    batches = list(iter_attribution_batches(entries, (10, 3), 'truncate', oversized.append))
+    assert sorted(len(batch) for batch in batches) == [2, 3]
+    assert [journey[0]['conversion_id'] for journey in oversized] == ['c1']
+
+    with pytest.raises(ValueError):
+        list(iter_attribution_batches(entries, (10, 3), 'raise'))
+
+def test_entries_must_be_dictionaries():
+    with pytest.raises(ValueError):
+        list(iter_attribution_batches(["not an entry"], (10, 10)))
+
+@pytest.mark.parametrize("limits", [(5, 20), None])
+def test_frames_are_batched_like_entries(db_path, tmp_path, limits):
+    frame = get_customer_journeys(db_path, str(tmp_path / "frame.jsonl"), engine='sql', as_frame=True)
+    entries = get_customer_journeys(db_path, str(tmp_path / "entries.jsonl"), engine='sql')
+    skip_journey = lambda journey: journey[0]['conversion_id'] == entries[0]['conversion_id']
+
+    from_frame = list(iter_attribution_batches(frame, limits, skip_journey=skip_journey))
+    for batch in from_frame:
+        assert limits is None or len(batch) <= limits[1]
+    assert sorted(conversion_ids(from_frame)) == \
+        sorted(conversion_ids(iter_attribution_batches(entries, limits, skip_journey=skip_journey)))
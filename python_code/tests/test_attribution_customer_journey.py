@@ -0,0 +1,71 @@
+import pytest
+from attribution_customer_journey import (create_attribution_customer_journey_table, insert_ihc_results,
+                                          conversion_is_attributed, delete_unlisted_attributions)
+from database import get_connection
+
+def results(conv_id, shares):
+    return {'value': [{'conversion_id': conv_id, 'session_id': session_id, 'ihc': ihc}
+                      for session_id, ihc in shares.items()]}
+
+def attribution_rows(db_path):
+    conn = get_connection(db_path)
+    return set(conn.execute("SELECT conv_id, session_id, ihc FROM attribution_customer_journey"))
+
+@pytest.fixture
+def attribution_db(db_path):
+    create_attribution_customer_journey_table(db_path)
+    return db_path
+
+def test_insert_is_idempotent(attribution_db):
+    insert_ihc_results(results('c1', {'s1': 0.5, 's2': 0.5}), attribution_db)
+    insert_ihc_results(results('c1', {'s1': 0.5, 's2': 0.5}), attribution_db)
+
+    assert attribution_rows(attribution_db) == {('c1', 's1', 0.5), ('c1', 's2', 0.5)}
+
+def test_upsert_updates_shares_and_drops_stale_sessions(attribution_db):
+    insert_ihc_results(results('c1', {'s1': 0.5, 's2': 0.5}), attribution_db)
+    insert_ihc_results(results('c2', {'s3': 1.0}), attribution_db)
+    insert_ihc_results(results('c1', {'s1': 0.2, 's4': 0.8}), attribution_db)
+
+    assert attribution_rows(attribution_db) == {('c1', 's1', 0.2), ('c1', 's4', 0.8), ('c2', 's3', 1.0)}
+
+def test_row_by_row_fallback_drops_stale_sessions(attribution_db):
+    insert_ihc_results(results('c1', {'s1': 0.5, 's2': 0.5}), attribution_db)
+    insert_ihc_results(results('c2', {'s3': 1.0}), attribution_db)
+
+    # The missing share fails the bulk upsert, so the batch is stored row by row
+    response = results('c1', {'s1': 0.2, 's4': 0.8})
+    response['value'] += results('c2', {'s5': None})['value']
+    assert insert_ihc_results(response, attribution_db) == 2
+
+    assert attribution_rows(attribution_db) == {('c1', 's1', 0.2), ('c1', 's4', 0.8)}
+
+def test_conversion_is_attributed(attribution_db):
+    insert_ihc_results(results('c1', {'s1': 1.0}), attribution_db)
+    conn = get_connection(attribution_db)
+
+    assert conversion_is_attributed(conn, 'c1')
+    assert not conversion_is_attributed(conn, 'c2')
+
+def test_unlisted_attributions_of_the_range_are_deleted(attribution_db):
+    conversions = get_connection(attribution_db).execute("SELECT conv_id, user_id FROM conversions ORDER BY user_id").fetchall()
+    (listed, _), (unlisted, _), (outside, last_user) = conversions[0], conversions[1], conversions[-1]
+    for conv_id in (listed, unlisted, outside, 'deleted_conv'):
+        insert_ihc_results(results(conv_id, {'s1': 1.0}), attribution_db)
+
+    assert delete_unlisted_attributions(attribution_db, {listed}, (None, last_user)) == 2
+    assert {row[0] for row in attribution_rows(attribution_db)} == {listed, outside}
+
+def test_table_without_primary_key_is_rebuilt(db_path):
+    conn = get_connection(db_path)
+    conn.execute("DROP TABLE attribution_customer_journey")
+    conn.execute("CREATE TABLE attribution_customer_journey (conv_id TEXT, session_id TEXT, ihc REAL)")
+    conn.executemany("INSERT INTO attribution_customer_journey VALUES (?, ?, ?)",
+                     [('c1', 's1', 0.1), ('c1', 's1', 1.0)])
+    conn.commit()
+
+    create_attribution_customer_journey_table(db_path)
+
+    assert attribution_rows(db_path) == {('c1', 's1', 1.0)}
+    insert_ihc_results(results('c1', {'s1': 0.5, 's2': 0.5}), db_path)
+    assert attribution_rows(db_path) == {('c1', 's1', 0.5), ('c1', 's2', 0.5)}
@@ -0,0 +1,37 @@
+import pytest
+from batch_packer import pack_journey_batches, iter_conversion_journeys
+
+def make_entries(session_counts):
+    return [{'conversion_id': conv_id, 'session_id': f"{conv_id}_s{i}"}
+            for conv_id, num_sessions in session_counts.items() for i in range(num_sessions)]
+
+def test_batches_hold_whole_journeys_within_limits():
+    session_counts = {f"c{i}": 1 + i % 7 for i in range(50)}
+    batches = list(pack_journey_batches(make_entries(session_counts), 4, 10, window=12))
+
+    seen = []
+    for batch in batches:
+        journeys = list(iter_conversion_journeys(batch))
+        assert len(journeys) <= 4
+        assert len(batch) <= 10
+        for journey in journeys:
+            assert len(journey) == session_counts[journey[0]['conversion_id']]
+            seen.append(journey[0]['conversion_id'])
+    assert sorted(seen) == sorted(session_counts)
+
+def test_skip_keeps_journeys_after_a_window_of_oversized_ones():
+    entries = make_entries({'c1': 4, 'c2': 5, 'c3': 2, 'c4': 3})
+    batches = list(pack_journey_batches(entries, 100, 3, 'skip', window=2))
+
+    assert sorted({entry['conversion_id'] for batch in batches for entry in batch}) == ['c3', 'c4']
+
+def test_truncate_keeps_the_latest_sessions():
+    skipped = []
+    batches = list(pack_journey_batches(make_entries({'c1': 5}), 100, 3, 'truncate', skipped.append))
+
+    assert [entry['session_id'] for entry in batches[0]] == ['c1_s2', 'c1_s3', 'c1_s4']
+    assert len(skipped[0]) == 5
+
+def test_raise_on_oversized():
+    with pytest.raises(ValueError, match="c1"):
+        list(pack_journey_batches(make_entries({'c1': 5}), 100, 3, 'raise'))
@@ -0,0 +1,139 @@
+import pytest
+from customer_journey import iter_customer_journeys
+from local_attribution import compute_local_attribution
+from attribution_customer_journey import create_attribution_customer_journey_table, insert_ihc_results
+from channel_reporting_table import (
+    populate_channel_reporting, refresh_channel_reporting, check_ihc_sum_condition,
+    check_channel_reporting_query_plan, explain_channel_reporting_query,
+)
+from database import get_connection
+
+def channel_reporting_rows(db_path):
+    conn = get_connection(db_path)
+    return {
+        (channel, date): (round(cost, 9), round(ihc, 9), round(ihc_revenue, 9))
+        for channel, date, cost, ihc, ihc_revenue in conn.execute("SELECT * FROM channel_reporting")
+    }
+
+def assert_refresh_matches_full_rebuild(db_path):
+    refresh_channel_reporting(db_path)
+    refreshed = channel_reporting_rows(db_path)
+    populate_channel_reporting(db_path)
+    assert refreshed == channel_reporting_rows(db_path)
+
+def execute(db_path, statement, params=()):
+    conn = get_connection(db_path)
+    conn.execute(statement, params)
+    conn.commit()
+
+def attributed_session(db_path):
+    return get_connection(db_path).execute("""
+        SELECT ss.session_id, ss.user_id, ss.event_date, acj.conv_id
+        FROM attribution_customer_journey acj JOIN session_sources ss ON ss.session_id = acj.session_id
+        ORDER BY acj.rowid LIMIT 1
+    """).fetchone()
+
+@pytest.fixture
+def reporting_db(db_path):
+    """
+    The synthetic database with local attributions and a populated channel_reporting.
+    """
+    create_attribution_customer_journey_table(db_path)
+    for batch in iter_customer_journeys(get_connection(db_path), 'sql'):
+        insert_ihc_results(compute_local_attribution(batch), db_path)
+    populate_channel_reporting(db_path)
+    return db_path
+
+def test_attributions_pass_the_data_quality_checks(reporting_db):
+    assert check_ihc_sum_condition(reporting_db)['passed']
+
+def test_refresh_without_changes_keeps_the_report(reporting_db):
+    before = channel_reporting_rows(reporting_db)
+    refresh_channel_reporting(reporting_db)
+    assert channel_reporting_rows(reporting_db) == before
+
+def test_refresh_after_new_session_and_cost(reporting_db):
+    execute(reporting_db, "INSERT INTO session_sources VALUES ('new_s', 'u', '2023-09-04', '12:00:00', 'Email', 0, 0, 0)")
+    execute(reporting_db, "INSERT INTO session_costs VALUES ('new_s', 3.5)")
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_refresh_after_updated_cost_and_moved_session(reporting_db):
+    session_id = attributed_session(reporting_db)[0]
+    execute(reporting_db, "UPDATE session_costs SET cost = cost + 10")
+    execute(reporting_db, "UPDATE session_sources SET event_date = '2023-09-09' WHERE session_id = ?", (session_id,))
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_refresh_after_changed_attribution_and_revenue(reporting_db):
+    session_id, _, _, conv_id = attributed_session(reporting_db)
+    execute(reporting_db, "DELETE FROM attribution_customer_journey WHERE session_id = ?", (session_id,))
+    execute(reporting_db, "UPDATE conversions SET revenue = revenue * 2 WHERE conv_id = ?", (conv_id,))
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_refresh_after_upserted_attribution(reporting_db):
+    session_id, _, _, conv_id = attributed_session(reporting_db)
+    insert_ihc_results({'value': [{'conversion_id': conv_id, 'session_id': session_id, 'ihc': 1.0}]}, reporting_db)
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_refresh_rebuilds_when_change_tracking_is_missing(reporting_db):
+    execute(reporting_db, "DROP TRIGGER trg_cr_session_costs_update")
+    execute(reporting_db, "UPDATE session_costs SET cost = cost + 1")
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_outdated_triggers_are_replaced_before_attribution_upserts(reporting_db):
+    # Change tracking of an earlier version: OR IGNORE turns into ABORT inside an upsert
+    execute(reporting_db, "DROP TRIGGER trg_cr_attribution_customer_journey_update")
+    execute(reporting_db, """
+        CREATE TRIGGER trg_cr_attribution_customer_journey_update AFTER UPDATE ON attribution_customer_journey
+        BEGIN
+            INSERT OR IGNORE INTO channel_reporting_dirty_dates (date)
+            SELECT event_date FROM session_sources WHERE session_id = NEW.session_id;
+        END
+    """)
+    session_id, _, _, conv_id = attributed_session(reporting_db)
+    execute(reporting_db, "INSERT INTO channel_reporting_dirty_dates SELECT event_date FROM session_sources "
+                          "WHERE session_id = ?", (session_id,))
+
+    create_attribution_customer_journey_table(reporting_db)
+    assert insert_ihc_results({'value': [{'conversion_id': conv_id, 'session_id': session_id, 'ihc': 1.0}]},
+                              reporting_db) == 1
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_refresh_after_replaced_session(reporting_db):
+    session_id, user_id, event_date, _ = attributed_session(reporting_db)
+    execute(reporting_db, "INSERT OR IGNORE INTO session_costs VALUES (?, 2.0)", (session_id,))
+    populate_channel_reporting(reporting_db)
+
+    # The replace moves the session, with its cost and attribution, to another date
+    execute(reporting_db, "INSERT OR REPLACE INTO session_sources VALUES (?, ?, '2023-09-20', '12:00:00', 'Email', 0, 0, 0)",
+            (session_id, user_id))
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+def test_refresh_after_replaced_cost_attribution_and_conversion(reporting_db):
+    session_id, user_id, _, conv_id = attributed_session(reporting_db)
+    execute(reporting_db, "INSERT OR REPLACE INTO session_costs VALUES (?, 7.0)", (session_id,))
+    execute(reporting_db, "INSERT OR REPLACE INTO attribution_customer_journey VALUES (?, ?, 0.5)", (conv_id, session_id))
+    execute(reporting_db, "INSERT OR REPLACE INTO conversions SELECT conv_id, user_id, conv_date, conv_time, revenue + 1 "
+                          "FROM conversions WHERE conv_id = ?", (conv_id,))
+    assert_refresh_matches_full_rebuild(reporting_db)
+
+@pytest.mark.parametrize("mode", ["full", "incremental"])
+def test_aggregation_searches_the_source_tables_through_their_indexes(reporting_db, mode):
+    plan = explain_channel_reporting_query(get_connection(reporting_db), mode)
+
+    assert "SEARCH acj USING INDEX idx_attribution_customer_journey_session (session_id=?)" in plan
+    if mode == "incremental":
+        assert "SEARCH ss USING INDEX idx_session_sources_event_date (event_date=?)" in plan
+    assert check_channel_reporting_query_plan(reporting_db) == []
+
+@pytest.mark.parametrize("index, alias", [
+    ("idx_session_sources_event_date", "ss"),
+    ("idx_attribution_customer_journey_session", "acj"),
+])
+def test_query_plan_check_reports_a_missing_index(reporting_db, index, alias):
+    execute(reporting_db, f"DROP INDEX {index}")
+
+    problems = check_channel_reporting_query_plan(reporting_db)
+    assert any(f" {alias} " in problem or problem.endswith(f" {alias}") for problem in problems)
+    # The check only explains the query, it must not create what it checks for
+    assert get_connection(reporting_db).execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).fetchone() is None
@@ -0,0 +1,44 @@
+import pytest
+from customer_journey import generate_customer_journeys, get_customer_journeys, JOURNEY_ENGINES
+from parallel_journeys import generate_customer_journeys_parallel
+from journey_store import iter_journeys
+from journey_frame import iter_frame_entries
+
+WINDOWS = {
+    'default': {},
+    'lookback': {'lookback_days': 2},
+    'max_sessions': {'max_sessions': 3},
+    'previous_conversion': {'exclude_previous_conversion': True},
+    'combined': {'lookback_days': 3, 'max_sessions': 2, 'exclude_previous_conversion': True},
+}
+
+def build_store(db_path, tmp_path, engine, window):
+    save_path = str(tmp_path / f"{engine}.jsonl")
+    if engine == 'parallel':
+        generate_customer_journeys_parallel(db_path, save_path, workers=2, num_shards=3, window=window)
+    else:
+        generate_customer_journeys(db_path, save_path, engine=engine, window=window)
+    return list(iter_journeys(save_path))
+
+@pytest.mark.parametrize("window", WINDOWS.values(), ids=WINDOWS.keys())
+@pytest.mark.parametrize("engine", ['vectorized', 'sql', 'parallel'])
+def test_engine_matches_iterrows_reference(db_path, tmp_path, engine, window):
+    expected = build_store(db_path, tmp_path, 'iterrows', window)
+    assert expected
+    assert build_store(db_path, tmp_path, engine, window) == expected
+
+def test_windows_limit_journeys(db_path, tmp_path):
+    full = build_store(db_path, tmp_path, 'sql', {})
+    capped = build_store(db_path, tmp_path, 'sql', {'max_sessions': 1})
+
+    assert len(capped) < len(full)
+    conversion_ids = [entry['conversion_id'] for entry in capped]
+    assert len(conversion_ids) == len(set(conversion_ids))
+
+@pytest.mark.parametrize("engine", list(JOURNEY_ENGINES) + ['sql'])
+def test_frame_round_trips_to_entries(db_path, tmp_path, engine):
+    entries = get_customer_journeys(db_path, str(tmp_path / "list.jsonl"), engine=engine)
+    frame = get_customer_journeys(db_path, str(tmp_path / "frame.jsonl"), engine=engine, as_frame=True)
+
+    assert list(iter_journeys(str(tmp_path / "frame.jsonl"))) == list(iter_journeys(str(tmp_path / "list.jsonl")))
+    assert [entry['session_id'] for entry in iter_frame_entries(frame)] == [entry['session_id'] for entry in entries]
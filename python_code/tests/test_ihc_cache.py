@@ -0,0 +1,59 @@
+import time
+from ihc_cache import (open_ihc_cache, journey_cache_key, get_cached_results, put_cached_results,
+                       evict_ihc_cache, invalidate_ihc_cache)
+
+JOURNEY = [
+    {'conversion_id': 'c1', 'session_id': 's1', 'timestamp': '2023-09-01 10:00:00', 'channel_label': 'Email'},
+    {'conversion_id': 'c1', 'session_id': 's2', 'timestamp': '2023-09-02 10:00:00', 'channel_label': 'Social'},
+]
+RESULTS = [{'conversion_id': 'c1', 'session_id': 's1', 'ihc': 0.25},
+           {'conversion_id': 'c1', 'session_id': 's2', 'ihc': 0.75}]
+
+def test_key_ignores_entry_and_field_order():
+    reordered = [dict(reversed(list(entry.items()))) for entry in reversed(JOURNEY)]
+    assert journey_cache_key(reordered, 'conv') == journey_cache_key(JOURNEY, 'conv')
+
+def test_key_depends_on_journey_and_conv_type():
+    changed = [JOURNEY[0], {**JOURNEY[1], 'channel_label': 'Display'}]
+    assert journey_cache_key(changed, 'conv') != journey_cache_key(JOURNEY, 'conv')
+    assert journey_cache_key(JOURNEY, 'other') != journey_cache_key(JOURNEY, 'conv')
+
+def test_stored_results_are_returned(tmp_path):
+    cache = open_ihc_cache(str(tmp_path / "cache.db"))
+    key = journey_cache_key(JOURNEY, 'conv')
+
+    assert get_cached_results(cache, key) is None
+    put_cached_results(cache, [(key, RESULTS)], 'conv')
+    assert get_cached_results(cache, key) == RESULTS
+
+def test_empty_results_are_a_miss(tmp_path):
+    cache = open_ihc_cache(str(tmp_path / "cache.db"))
+    key = journey_cache_key(JOURNEY, 'conv')
+
+    put_cached_results(cache, [(key, [])], 'conv')
+    assert get_cached_results(cache, key) is None
+
+def test_eviction_by_age_and_size(tmp_path):
+    cache = open_ihc_cache(str(tmp_path / "cache.db"))
+    put_cached_results(cache, [(f"key{i}", RESULTS) for i in range(4)], 'conv')
+    cache.execute("UPDATE ihc_cache SET created_at = ? WHERE cache_key = 'key0'", (time.time() - 10 * 86400,))
+    cache.execute("UPDATE ihc_cache SET last_used = last_used - 100 WHERE cache_key = 'key1'")
+    cache.commit()
+
+    assert evict_ihc_cache(cache, max_age_days=5) == 1
+    entry_size = cache.execute("SELECT size_bytes FROM ihc_cache LIMIT 1").fetchone()[0]
+
+    # Least recently used entries go first
+    assert evict_ihc_cache(cache, max_bytes=2 * entry_size) == 1
+    remaining = {row[0] for row in cache.execute("SELECT cache_key FROM ihc_cache")}
+    assert remaining == {"key2", "key3"}
+
+def test_invalidate_by_conv_type(tmp_path):
+    cache_path = str(tmp_path / "cache.db")
+    cache = open_ihc_cache(cache_path)
+    put_cached_results(cache, [("a", RESULTS)], 'conv')
+    put_cached_results(cache, [("b", RESULTS)], 'other')
+    cache.close()
+
+    assert invalidate_ihc_cache(cache_path, 'other') == 1
+    assert invalidate_ihc_cache(cache_path) == 1
@@ -0,0 +1,112 @@
+import pytest
+import requests
+import ihc_client
+from ihc_client import post_batch, send_batches_concurrently, backoff_delay, BatchFailed
+from mock_ihc_server import start_mock_ihc_server
+
+BATCH = [{'conversion_id': 'c1', 'session_id': 's1'}, {'conversion_id': 'c1', 'session_id': 's2'}]
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None, text=""):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.text = text
+
+    def json(self):
+        if isinstance(self.body, Exception):
+            raise self.body
+        return self.body
+
+class FakeSession:
+    """
+    Answers posts with the given responses in turn; an exception is raised instead of returned.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = 0
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.posts += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(ihc_client.time, "sleep", delays.append)
+    return delays
+
+def test_backoff_grows_and_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base=1.0, maximum=8.0) <= min(8.0, 2 ** attempt)
+
+def test_retries_transient_errors_until_success(sleeps):
+    session = FakeSession(FakeResponse(503), requests.ConnectionError("reset"), FakeResponse(200, {'value': []}))
+
+    assert post_batch(session, "url", {}, BATCH, max_retries=3, backoff_base=0.01) == {'value': []}
+    assert session.posts == 3
+    assert len(sleeps) == 2
+
+def test_honors_retry_after(sleeps):
+    session = FakeSession(FakeResponse(429, headers={"Retry-After": "7"}), FakeResponse(200, {'value': []}))
+
+    post_batch(session, "url", {}, BATCH, max_retries=1, backoff_base=0.01)
+    assert sleeps == [7]
+
+def test_retries_invalid_json(sleeps):
+    session = FakeSession(FakeResponse(200, ValueError("Expecting value")), FakeResponse(200, {'value': []}))
+
+    assert post_batch(session, "url", {}, BATCH, max_retries=1, backoff_base=0.01) == {'value': []}
+    assert session.posts == 2
+
+def test_invalid_json_fails_the_batch_after_max_retries(sleeps):
+    session = FakeSession(*[FakeResponse(200, ValueError("Expecting value"))] * 2)
+
+    with pytest.raises(BatchFailed, match="Invalid JSON response"):
+        post_batch(session, "url", {}, BATCH, max_retries=1, backoff_base=0.01)
+
+def test_gives_up_after_max_retries(sleeps):
+    session = FakeSession(*[FakeResponse(500, text="boom")] * 3)
+
+    with pytest.raises(BatchFailed, match="after 3 attempts"):
+        post_batch(session, "url", {}, BATCH, max_retries=2, backoff_base=0.01)
+    assert session.posts == 3
+
+def test_client_errors_are_not_retried(sleeps):
+    session = FakeSession(FakeResponse(400, text="bad request"))
+
+    with pytest.raises(BatchFailed, match="400"):
+        post_batch(session, "url", {}, BATCH, max_retries=5)
+    assert session.posts == 1
+    assert sleeps == []
+
+def test_send_batches_concurrently_collects_results_and_failures():
+    batches = [[{'conversion_id': f"c{i}", 'session_id': f"s{i}"}] for i in range(6)]
+
+    server = start_mock_ihc_server()
+    results = {}
+    try:
+        failed = send_batches_concurrently(iter(batches), server.url, {},
+                                           lambda idx, batch, data: results.setdefault(idx, data),
+                                           max_workers=3, requests_per_second=1000)
+    finally:
+        server.shutdown()
+
+    assert failed == []
+    assert sorted(results) == list(range(6))
+    assert results[2]['value'] == [{'conversion_id': 'c2', 'session_id': 's2', 'ihc': 1.0}]
+
+def test_failed_batches_are_returned_not_raised():
+    batches = [[{'conversion_id': f"c{i}", 'session_id': f"s{i}"}] for i in range(3)]
+
+    server = start_mock_ihc_server(error_rate=1.0)
+    try:
+        failed = send_batches_concurrently(batches, server.url, {}, lambda *args: None,
+                                           max_workers=2, requests_per_second=1000, max_retries=0)
+    finally:
+        server.shutdown()
+
+    assert sorted(batch_idx for batch_idx, _, _ in failed) == [0, 1, 2]
@@ -0,0 +1,211 @@
+import pytest
+from customer_journey import generate_customer_journeys
+from incremental_journeys import update_customer_journeys
+from journey_store import iter_journeys
+from database import get_connection
+
+WINDOWS = {
+    'default': {},
+    'lookback': {'lookback_days': 2},
+    'max_sessions': {'max_sessions': 3},
+    'previous_conversion': {'exclude_previous_conversion': True},
+}
+
+def journeys_by_conversion(save_path):
+    """
+    Groups a store's entries by conversion: incremental updates append journeys
+    out of conversion order, but each journey must match the full rebuild.
+    """
+    journeys = {}
+    for entry in iter_journeys(save_path):
+        journeys.setdefault(entry['conversion_id'], []).append(entry)
+    return journeys
+
+def assert_matches_full_rebuild(db_path, tmp_path, save_path, window):
+    full_path = str(tmp_path / "full.jsonl")
+    generate_customer_journeys(db_path, full_path, window=window)
+    assert journeys_by_conversion(save_path) == journeys_by_conversion(full_path)
+
+def execute(db_path, statement, params=()):
+    conn = get_connection(db_path)
+    conn.execute(statement, params)
+    conn.commit()
+
+def some_conversion(db_path):
+    """
+    Returns (conv_id, user_id, conv_date, conv_time) of a conversion with prior sessions.
+    """
+    return get_connection(db_path).execute("""
+        SELECT c.conv_id, c.user_id, c.conv_date, c.conv_time FROM conversions c
+        WHERE EXISTS (SELECT 1 FROM session_sources s WHERE s.user_id = c.user_id
+                      AND s.event_date || ' ' || s.event_time < c.conv_date || ' ' || c.conv_time)
+        ORDER BY c.rowid LIMIT 1
+    """).fetchone()
+
+def prior_session(db_path, conv):
+    conv_id, user_id, conv_date, conv_time = conv
+    return get_connection(db_path).execute("""
+        SELECT session_id, event_date, event_time FROM session_sources
+        WHERE user_id = ? AND event_date || ' ' || event_time < ?
+        ORDER BY event_date DESC, event_time DESC LIMIT 1
+    """, (user_id, f"{conv_date} {conv_time}")).fetchone()
+
+def insert_session(db_path, session_id, user_id, date, time, channel="Email"):
+    execute(db_path, "INSERT INTO session_sources VALUES (?, ?, ?, ?, ?, 1, 0, 1)",
+            (session_id, user_id, date, time, channel))
+
+@pytest.mark.parametrize("window", WINDOWS.values(), ids=WINDOWS.keys())
+def test_first_run_matches_full_rebuild(db_path, tmp_path, window):
+    save_path = str(tmp_path / "journeys.jsonl")
+    result = update_customer_journeys(db_path, save_path, window=window)
+
+    assert result['stale_conversions'] == 0
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, window)
+
+def test_unchanged_database_builds_nothing(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    assert update_customer_journeys(db_path, save_path) == {
+        'stale_conversions': 0, 'built_conversions': 0, 'appended_entries': 0,
+    }
+
+@pytest.mark.parametrize("window", WINDOWS.values(), ids=WINDOWS.keys())
+def test_new_conversion_is_appended(db_path, tmp_path, window):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path, window=window)
+
+    _, user_id, conv_date, conv_time = some_conversion(db_path)
+    execute(db_path, "INSERT INTO conversions VALUES ('new_conv', ?, ?, '23:59:59', 10.0)", (user_id, conv_date))
+
+    result = update_customer_journeys(db_path, save_path, window=window)
+    assert result['built_conversions'] == 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, window)
+
+def test_deleted_conversion_is_removed(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    conv_id = some_conversion(db_path)[0]
+    execute(db_path, "DELETE FROM conversions WHERE conv_id = ?", (conv_id,))
+
+    assert update_customer_journeys(db_path, save_path)['stale_conversions'] == 1
+    assert conv_id not in journeys_by_conversion(save_path)
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
+
+def test_moved_conversion_is_rebuilt(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    conv_id = some_conversion(db_path)[0]
+    execute(db_path, "UPDATE conversions SET conv_date = '2023-09-30', conv_time = '23:00:00' WHERE conv_id = ?",
+            (conv_id,))
+
+    assert update_customer_journeys(db_path, save_path)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
+
+@pytest.mark.parametrize("window", WINDOWS.values(), ids=WINDOWS.keys())
+def test_late_session_rebuilds_journey(db_path, tmp_path, window):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path, window=window)
+
+    conv = some_conversion(db_path)
+    insert_session(db_path, "late_session", conv[1], conv[2], "00:00:00")
+
+    assert update_customer_journeys(db_path, save_path, window=window)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, window)
+
+def test_deleted_session_rebuilds_journey(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    session_id = prior_session(db_path, some_conversion(db_path))[0]
+    execute(db_path, "DELETE FROM session_sources WHERE session_id = ?", (session_id,))
+
+    assert update_customer_journeys(db_path, save_path)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
+
+def test_new_previous_conversion_rebuilds_journey(db_path, tmp_path):
+    window = {'exclude_previous_conversion': True}
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path, window=window)
+
+    conv = some_conversion(db_path)
+    session_date, session_time = prior_session(db_path, conv)[1:]
+    execute(db_path, "INSERT INTO conversions VALUES ('earlier_conv', ?, ?, ?, 5.0)",
+            (conv[1], session_date, session_time))
+
+    assert update_customer_journeys(db_path, save_path, window=window)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, window)
+
+def test_changed_window_rebuilds_store(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    window = {'max_sessions': 2}
+    update_customer_journeys(db_path, save_path, window=window)
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, window)
+
+def test_uncommitted_tail_is_truncated(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    # A crashed run appended entries it never recorded in the manifest
+    with open(save_path, "a") as f:
+        f.write('{"conversion_id": "crashed"}\n')
+
+    update_customer_journeys(db_path, save_path)
+    assert "crashed" not in journeys_by_conversion(save_path)
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
+
+@pytest.mark.parametrize("change", ["channel", "engagement", "timestamp"])
+def test_edited_session_rebuilds_journey(db_path, tmp_path, change):
+    window = {'lookback_days': 5}
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path, window=window)
+
+    session_id, event_date, event_time = prior_session(db_path, some_conversion(db_path))
+    statement = {
+        'channel': "UPDATE session_sources SET channel_name = 'Affiliate' || channel_name WHERE session_id = ?",
+        'engagement': "UPDATE session_sources SET holder_engagement = 1 - holder_engagement WHERE session_id = ?",
+        'timestamp': "UPDATE session_sources SET event_time = '00:00:01' WHERE session_id = ?",
+    }[change]
+    execute(db_path, statement, (session_id,))
+
+    assert update_customer_journeys(db_path, save_path, window=window)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, window)
+
+def test_swapped_session_with_the_same_count_rebuilds_journey(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    conv = some_conversion(db_path)
+    session_id, event_date, event_time = prior_session(db_path, conv)
+    execute(db_path, "DELETE FROM session_sources WHERE session_id = ?", (session_id,))
+    insert_session(db_path, "swapped_session", conv[1], event_date, event_time, channel="Display")
+
+    assert update_customer_journeys(db_path, save_path)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
+
+def test_replaced_session_rebuilds_journeys_of_its_old_and_new_time(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    conv = some_conversion(db_path)
+    session_id = prior_session(db_path, conv)[0]
+    # Moves the session after its conversion, so only the old timestamp marks the journey stale
+    execute(db_path, "INSERT OR REPLACE INTO session_sources VALUES (?, ?, '2023-12-31', '23:59:59', 'Email', 0, 0, 0)",
+            (session_id, conv[1]))
+
+    assert update_customer_journeys(db_path, save_path)['stale_conversions'] >= 1
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
+
+def test_missing_change_tracking_rebuilds_store(db_path, tmp_path):
+    save_path = str(tmp_path / "journeys.jsonl")
+    update_customer_journeys(db_path, save_path)
+
+    execute(db_path, "DROP TRIGGER trg_jc_session_sources_update")
+    execute(db_path, "UPDATE session_sources SET channel_name = 'Affiliate'")
+
+    update_customer_journeys(db_path, save_path)
+    assert_matches_full_rebuild(db_path, tmp_path, save_path, {})
@@ -0,0 +1,38 @@
+from parallel_journeys import partition_users, user_range_filter, generate_customer_journeys_parallel
+from customer_journey import generate_customer_journeys
+from journey_store import iter_journeys
+from database import get_connection
+
+def users_in_range(db_path, user_range):
+    condition, params = user_range_filter(user_range)
+    return {row[0] for row in get_connection(db_path).execute(
+        f"SELECT user_id FROM conversions WHERE {condition} UNION SELECT user_id FROM session_sources WHERE {condition}",
+        params + params)}
+
+def test_ranges_split_every_user_into_exactly_one_shard(db_path):
+    user_ranges = partition_users(db_path, 4)
+    assert len(user_ranges) == 4
+    assert user_ranges[0][0] is None and user_ranges[-1][1] is None
+
+    shards = [users_in_range(db_path, user_range) for user_range in user_ranges]
+    assert all(shards)
+    assert sum(len(users) for users in shards) == len(set().union(*shards))
+    assert set().union(*shards) == users_in_range(db_path, (None, None))
+
+def test_workers_search_their_range_through_the_user_indexes(db_path):
+    partition_users(db_path, 2)
+    condition, params = user_range_filter(('u', 'v'))
+    conn = get_connection(db_path)
+
+    for table, index in (('conversions', 'idx_conversions_user_time'),
+                         ('session_sources', 'idx_session_sources_user_time')):
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {table} WHERE {condition}", params)]
+        assert any(f"USING INDEX {index}" in detail for detail in plan)
+
+def test_more_shards_than_users(db_path, tmp_path):
+    user_ranges = partition_users(db_path, 1000)
+    assert len(user_ranges) <= len(users_in_range(db_path, (None, None)))
+
+    generate_customer_journeys(db_path, str(tmp_path / "expected.jsonl"))
+    generate_customer_journeys_parallel(db_path, str(tmp_path / "parallel.jsonl"), workers=2, num_shards=1000)
+    assert list(iter_journeys(str(tmp_path / "parallel.jsonl"))) == list(iter_journeys(str(tmp_path / "expected.jsonl")))
@@ -0,0 +1,81 @@
+import json
+import pytest
+from pipeline_runner import run_pipeline, load_checkpoint, save_checkpoint, hash_tables
+from database import get_connection
+
+@pytest.fixture
+def run(db_path, tmp_path):
+    def run(**options):
+        return run_pipeline(db_path, str(tmp_path / "journeys.jsonl"), str(tmp_path / "output"),
+                            checkpoint_path=str(tmp_path / "checkpoint.json"), backend='local', **options)
+    return run
+
+def test_first_run_completes_every_stage(run, db_path):
+    assert run() == {stage: 'completed' for stage in ['build_journeys', 'attribute', 'report', 'export']}
+    assert get_connection(db_path).execute("SELECT COUNT(*) FROM channel_reporting").fetchone()[0] > 0
+
+def test_rerun_skips_unchanged_stages(run):
+    run()
+    assert set(run().values()) == {'skipped'}
+
+def test_changed_sessions_rerun_the_stages_that_read_them(run, db_path):
+    run()
+    conn = get_connection(db_path)
+    conn.execute("UPDATE session_sources SET channel_name = 'Display' WHERE rowid = 1")
+    conn.commit()
+
+    outcomes = run()
+    assert outcomes['build_journeys'] == 'completed'
+    assert outcomes['report'] == 'completed'
+
+def test_force_reruns_skipped_stages(run):
+    run()
+    assert run(stages=['report'], force=True) == {'report': 'completed'}
+
+def test_interrupted_attribute_stage_resumes(run, tmp_path, db_path):
+    run(stages=['build_journeys', 'attribute'])
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint['stages']['attribute']['status'] = 'running'
+    save_checkpoint(checkpoint, checkpoint_path)
+
+    conn = get_connection(db_path)
+    conn.execute("""
+        DELETE FROM attribution_customer_journey
+        WHERE conv_id IN (SELECT DISTINCT conv_id FROM attribution_customer_journey LIMIT 10)
+    """)
+    conn.commit()
+
+    assert run(stages=['attribute']) == {'attribute': 'resumed'}
+    assert run(stages=['report'])['report'] == 'completed'
+
+def test_pipelined_run_builds_and_attributes(run, tmp_path):
+    outcomes = run(stages=['build_journeys', 'attribute'], pipelined=True)
+    assert outcomes == {'build_journeys': 'completed', 'attribute': 'completed'}
+
+    checkpoint = json.loads((tmp_path / "checkpoint.json").read_text())
+    assert checkpoint['stages']['build_and_attribute']['outputs']['attributed_conversions'] > 0
+
+def test_table_versions_change_with_every_write(db_path):
+    before = hash_tables(db_path, ['session_sources', 'missing_table'])
+    assert before['missing_table'] is None
+    assert hash_tables(db_path, ['session_sources']) == {'session_sources': before['session_sources']}
+
+    conn = get_connection(db_path)
+    conn.execute("UPDATE session_sources SET channel_name = channel_name WHERE rowid = 1")
+    conn.commit()
+    updated = hash_tables(db_path, ['session_sources'])['session_sources']
+    assert updated != before['session_sources']
+
+    # A recreated table may have been written to without triggers, it starts a new epoch
+    conn.execute("DROP TRIGGER trg_tv_session_sources_update")
+    conn.commit()
+    assert hash_tables(db_path, ['session_sources'])['session_sources'] not in (before['session_sources'], updated)
+
+def test_completed_attribute_stage_removes_failed_batches(run, tmp_path):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    (output_dir / "failed_batches.jsonl").write_text('{"conversion_id": "c1"}\n')
+
+    assert run(stages=['build_journeys', 'attribute'])['attribute'] == 'completed'
+    assert not (output_dir / "failed_batches.jsonl").exists()
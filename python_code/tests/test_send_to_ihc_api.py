@@ -0,0 +1,151 @@
+import os
+import pytest
+import send_to_ihc_api
+import attribution_backends
+from send_to_ihc_api import send_to_ihc_api_and_store_results, attribute_journeys, ResultWriter
+from attribution_backends import LocalBackend
+from customer_journey import get_customer_journeys
+from journey_store import iter_journeys
+from mock_ihc_server import start_mock_ihc_server
+from data_quality import validate_attribution
+from database import get_connection
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(send_to_ihc_api, "API_KEY", "test-key")
+    server = start_mock_ihc_server()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def journeys(db_path, workdir):
+    return get_customer_journeys(db_path, str(workdir / "journeys.jsonl"), engine='sql')
+
+def send(journeys, db_path, server, **options):
+    options.setdefault('cache_path', None)
+    options.setdefault('failed_path', "failed.jsonl")
+    return send_to_ihc_api_and_store_results(journeys, db_path, 'conv', api_url=server.url,
+                                             requests_per_second=1000, **options)
+
+def attributed_conversions(db_path):
+    return {row[0] for row in get_connection(db_path).execute("SELECT DISTINCT conv_id FROM attribution_customer_journey")}
+
+def test_every_journey_is_attributed(db_path, journeys, server):
+    assert send(journeys, db_path, server) == 0
+
+    assert attributed_conversions(db_path) == {entry['conversion_id'] for entry in journeys}
+    assert validate_attribution(db_path)['passed']
+
+@pytest.mark.parametrize("backend", ['api', 'local'])
+def test_journey_frames_are_attributed_like_entries(db_path, workdir, server, backend):
+    frame = get_customer_journeys(db_path, str(workdir / "journeys.jsonl"), engine='sql', as_frame=True)
+    assert send(frame, db_path, server, backend=backend, write_mode='replace') == 0
+    from_frame = set(get_connection(db_path).execute("SELECT * FROM attribution_customer_journey"))
+
+    assert send(list(iter_journeys(str(workdir / "journeys.jsonl"))), db_path, server,
+                backend=backend, write_mode='replace') == 0
+    assert set(get_connection(db_path).execute("SELECT * FROM attribution_customer_journey")) == from_frame
+
+def test_cached_journeys_are_not_sent_again(db_path, journeys, server):
+    send(journeys, db_path, server, cache_path="cache.db")
+    requests = server.requests
+
+    assert send(journeys, db_path, server, cache_path="cache.db", write_mode='replace') == 0
+    assert server.requests == requests
+    assert attributed_conversions(db_path) == {entry['conversion_id'] for entry in journeys}
+
+def test_truncated_journeys_are_served_from_the_cache(db_path, journeys, server, monkeypatch):
+    monkeypatch.setattr(send_to_ihc_api, "MAX_SESSIONS_PER_REQUEST", 3)
+    send(journeys, db_path, server, cache_path="cache.db", oversized='truncate')
+    expected = set(get_connection(db_path).execute("SELECT * FROM attribution_customer_journey"))
+    requests = server.requests
+
+    assert send(journeys, db_path, server, cache_path="cache.db", oversized='truncate', write_mode='replace') == 0
+    assert server.requests == requests
+    assert set(get_connection(db_path).execute("SELECT * FROM attribution_customer_journey")) == expected
+
+def test_skipped_oversized_journeys_count_as_failed(db_path, journeys, server, monkeypatch):
+    monkeypatch.setattr(send_to_ihc_api, "MAX_SESSIONS_PER_REQUEST", 3)
+    session_counts = {}
+    for entry in journeys:
+        session_counts[entry['conversion_id']] = session_counts.get(entry['conversion_id'], 0) + 1
+    oversized = {conv_id for conv_id, sessions in session_counts.items() if sessions > 3}
+    assert oversized
+
+    os.makedirs("out")
+    assert send(journeys, db_path, server, failed_path="out/failed.jsonl") == len(oversized)
+    assert {entry['conversion_id'] for entry in iter_journeys("out/oversized_journeys.jsonl")} == oversized
+    assert not os.path.exists("oversized_journeys.jsonl")
+    assert attributed_conversions(db_path) == set(session_counts) - oversized
+
+def test_resume_only_sends_unattributed_conversions(db_path, journeys, server):
+    send(journeys, db_path, server)
+    conn = get_connection(db_path)
+    conn.execute("DELETE FROM attribution_customer_journey WHERE conv_id = ?", (journeys[0]['conversion_id'],))
+    conn.commit()
+    requests = server.requests
+
+    assert send(journeys, db_path, server, resume=True) == 0
+    assert server.requests == requests + 1
+    assert journeys[0]['conversion_id'] in attributed_conversions(db_path)
+
+def test_pipelined_writes_store_the_same_results(db_path, journeys, server):
+    send(journeys, db_path, server)
+    expected = set(get_connection(db_path).execute("SELECT * FROM attribution_customer_journey"))
+
+    assert send(journeys, db_path, server, write_mode='replace', pipelined=True) == 0
+    assert set(get_connection(db_path).execute("SELECT * FROM attribution_customer_journey")) == expected
+
+def test_failed_batches_are_saved_for_a_rerun(db_path, journeys, server, monkeypatch):
+    monkeypatch.setattr(send_to_ihc_api, "MAX_RETRIES", 0)
+    server.error_rate = 1.0
+
+    failed = send(journeys, db_path, server)
+    assert failed > 0
+    assert {entry['conversion_id'] for entry in iter_journeys("failed.jsonl")} == \
+        {entry['conversion_id'] for entry in journeys}
+
+    server.error_rate = 0.0
+    assert send(iter_journeys("failed.jsonl"), db_path, server, failed_path="failed_again.jsonl") == 0
+    assert attributed_conversions(db_path) == {entry['conversion_id'] for entry in journeys}
+
+def test_conversions_missing_from_the_response_count_as_failed(db_path, journeys, server, monkeypatch):
+    send_batches = attribution_backends.send_batches_concurrently
+    dropped = set()
+
+    def drop_first_conversion(batches, url, headers, on_result, **options):
+        def on_partial_result(batch_idx, batch, response_data):
+            dropped.add(batch[0]['conversion_id'])
+            response_data = {'value': [result for result in response_data['value']
+                                       if result['conversion_id'] != batch[0]['conversion_id']]}
+            on_result(batch_idx, batch, response_data)
+        return send_batches(batches, url, headers, on_partial_result, **options)
+
+    monkeypatch.setattr(attribution_backends, "send_batches_concurrently", drop_first_conversion)
+    assert send(journeys, db_path, server, cache_path="cache.db") == len(dropped)
+    assert {entry['conversion_id'] for entry in iter_journeys("failed.jsonl")} == dropped
+
+    monkeypatch.setattr(attribution_backends, "send_batches_concurrently", send_batches)
+    requests = server.requests
+    assert send(journeys, db_path, server, cache_path="cache.db", failed_path="failed_again.jsonl") == 0
+    assert server.requests == requests + 1
+    assert attributed_conversions(db_path) == {entry['conversion_id'] for entry in journeys}
+
+def test_local_backend_resumes_without_touching_the_cache(db_path, journeys):
+    assert attribute_journeys(journeys, db_path, 'conv', LocalBackend(), cache_path="cache.db") == 0
+    conn = get_connection(db_path)
+    conn.execute("DELETE FROM attribution_customer_journey WHERE conv_id = ?", (journeys[0]['conversion_id'],))
+    conn.commit()
+
+    assert attribute_journeys(journeys, db_path, 'conv', LocalBackend(), resume=True, cache_path="cache.db") == 0
+    assert attributed_conversions(db_path) == {entry['conversion_id'] for entry in journeys}
+    assert not os.path.exists("cache.db")
+
+def test_result_writer_stores_every_response(db_path, workdir):
+    attribute_journeys([], db_path, 'conv', LocalBackend())
+    writer = ResultWriter(db_path, pipelined=True)
+    for conv_id in ('c1', 'c2', 'c3'):
+        writer.put({'value': [{'conversion_id': conv_id, 'session_id': 's1', 'ihc': 1.0}]})
+    writer.close()
+
+    assert attributed_conversions(db_path) == {'c1', 'c2', 'c3'}
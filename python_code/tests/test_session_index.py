@@ -0,0 +1,85 @@
+import pytest
+from customer_journey import generate_customer_journeys
+from session_index import get_journey, get_user_sessions, ensure_session_index
+from journey_store import iter_journeys
+from database import get_connection
+
+WINDOWS = {
+    'default': {},
+    'lookback': {'lookback_days': 2},
+    'max_sessions': {'max_sessions': 3},
+    'previous_conversion': {'exclude_previous_conversion': True},
+}
+
+def execute(db_path, statement, params=()):
+    conn = get_connection(db_path)
+    conn.execute(statement, params)
+    conn.commit()
+
+def session_rows(db_path, user_id):
+    return sorted(row[0] for row in get_connection(db_path).execute(
+        "SELECT session_id FROM session_sources WHERE user_id = ?", (user_id,)))
+
+def assert_journeys_match_full_rebuild(db_path, tmp_path, window):
+    full_path = str(tmp_path / "full.jsonl")
+    generate_customer_journeys(db_path, full_path, window=window)
+    expected = {}
+    for entry in iter_journeys(full_path):
+        expected.setdefault(entry['conversion_id'], []).append(entry)
+
+    conv_ids = [row[0] for row in get_connection(db_path).execute("SELECT conv_id FROM conversions")]
+    for conv_id in conv_ids:
+        assert get_journey(db_path, conv_id, window) == expected.get(conv_id, [])
+
+@pytest.fixture
+def indexed_db(db_path):
+    ensure_session_index(get_connection(db_path))
+    return db_path
+
+def some_session(db_path):
+    return get_connection(db_path).execute("SELECT session_id, user_id FROM session_sources LIMIT 1").fetchone()
+
+@pytest.mark.parametrize("window", WINDOWS.values(), ids=WINDOWS.keys())
+def test_journeys_match_full_rebuild(indexed_db, tmp_path, window):
+    assert_journeys_match_full_rebuild(indexed_db, tmp_path, window)
+
+def test_unknown_conversion(indexed_db):
+    assert get_journey(indexed_db, "no_such_conversion") is None
+
+def test_index_follows_inserts_updates_and_deletes(indexed_db, tmp_path):
+    session_id, user_id = some_session(indexed_db)
+    execute(indexed_db, "INSERT INTO session_sources VALUES ('new_s', ?, '2023-09-02', '08:00:00', 'Email', 1, 1, 0)",
+            (user_id,))
+    execute(indexed_db, "UPDATE session_sources SET event_date = '2023-09-03', channel_name = 'Social' "
+                        "WHERE session_id = ?", (session_id,))
+    execute(indexed_db, "DELETE FROM session_sources WHERE rowid = 2")
+
+    assert sorted(s['session_id'] for s in get_user_sessions(indexed_db, user_id)) == session_rows(indexed_db, user_id)
+    assert_journeys_match_full_rebuild(indexed_db, tmp_path, {})
+
+def test_replaced_session_leaves_no_ghost(indexed_db, tmp_path):
+    session_id, user_id = some_session(indexed_db)
+    execute(indexed_db, "INSERT OR REPLACE INTO session_sources VALUES (?, ?, '2023-09-20', '10:00:00', 'Email', 0, 0, 0)",
+            (session_id, user_id))
+
+    sessions = get_user_sessions(indexed_db, user_id)
+    assert sorted(s['session_id'] for s in sessions) == session_rows(indexed_db, user_id)
+    assert [s['timestamp'] for s in sessions if s['session_id'] == session_id] == ['2023-09-20 10:00:00']
+    assert_journeys_match_full_rebuild(indexed_db, tmp_path, {})
+
+def test_ignored_insert_keeps_the_session(indexed_db):
+    session_id, user_id = some_session(indexed_db)
+    execute(indexed_db, "INSERT OR IGNORE INTO session_sources VALUES (?, ?, '2023-09-20', '10:00:00', 'Email', 0, 0, 0)",
+            (session_id, user_id))
+
+    assert sorted(s['session_id'] for s in get_user_sessions(indexed_db, user_id)) == session_rows(indexed_db, user_id)
+
+def test_outdated_triggers_rebuild_the_index(indexed_db):
+    execute(indexed_db, "DROP TRIGGER trg_usi_session_sources_insert")
+    execute(indexed_db, "CREATE TRIGGER trg_usi_session_sources_insert AFTER INSERT ON session_sources BEGIN SELECT 1; END")
+    session_id, user_id = some_session(indexed_db)
+    execute(indexed_db, "INSERT INTO session_sources VALUES ('untracked', ?, '2023-09-02', '08:00:00', 'Email', 0, 0, 0)",
+            (user_id,))
+
+    assert ensure_session_index(get_connection(indexed_db))
+    assert sorted(s['session_id'] for s in get_user_sessions(indexed_db, user_id)) == session_rows(indexed_db, user_id)